@@ -12,6 +12,8 @@ from loguru import logger
 from app.config import config
 from app.models.exception import HttpException
 from app.router import root_api_router
+from app.services import bgm, events, llm_client, pipeline, webhooks
+from app.services import state as sm
 from app.utils import utils
 
 
@@ -19,6 +21,7 @@ def exception_handler(request: Request, e: HttpException):
     return JSONResponse(
         status_code=e.status_code,
         content=utils.get_response(e.status_code, e.data, e.message),
+        headers=e.headers,
     )
 
 
@@ -75,8 +78,31 @@ app.mount("/", StaticFiles(directory=public_dir, html=True), name="")
 @app.on_event("shutdown")
 def shutdown_event():
     logger.info("shutdown event")
+    from app.controllers.v1.video import task_manager
+
+    # stop accepting tasks and let the workers finish what they are running
+    joined = task_manager.shutdown(timeout=config.app.get("shutdown_timeout", 60))
+    webhooks.shutdown(timeout=5)
+    events.stop()
+    bgm.library().stop()
+    if not joined:
+        # the tasks still running use the stage pools, llm clients and state
+        logger.warning("tasks still running, leaving their pools, clients and state open")
+        return
+    pipeline.shutdown(block=False)
+    # the pooled llm clients, async ones closed on their loop
+    llm_client.registry.clear()
+    sm.state.close()
 
 
 @app.on_event("startup")
 def startup_event():
     logger.info("startup event")
+    # the tasks stored by older versions
+    sm.state.migrate()
+    # the lines logged by the tasks, for GET /tasks/{task_id}/events
+    events.start()
+    # send the callbacks still in the outbox from before a restart
+    webhooks.dispatcher()
+    # index the songs and decode them for the renders, in the background
+    bgm.library().watch()
@@ -18,6 +18,11 @@ def get_api_key(request: Request):
     return api_key
 
 
+def get_priority(request: Request, default: str = "normal"):
+    """Scheduling priority of the task created by the request: high, normal or low."""
+    return request.headers.get("x-priority") or default
+
+
 def verify_token(request: Request):
     token = get_api_key(request)
     if token != config.app.get("api_key", ""):
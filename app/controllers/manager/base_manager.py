@@ -1,64 +1,147 @@
 import threading
-from typing import Any, Callable, Dict
+import time
+from typing import Any, Callable, Dict, Optional
+
+from loguru import logger
+
+from app.controllers.manager.fair_scheduler import FairScheduler
+from app.models.exception import TaskManagerStoppedError, TaskQueueFullError
 
 
 class TaskManager:
-    def __init__(self, max_concurrent_tasks: int):
+    """
+    Runs queued tasks on a fixed pool of max_concurrent_tasks worker threads.
+
+    add_task only enqueues, so admission is a single atomic queue operation and the
+    number of running tasks can never exceed the pool size. The queue holds at most
+    max_queue_size waiting tasks (0: unbounded), add_task raises TaskQueueFullError
+    beyond that. Waiting tasks are run in the order of their FairScheduler score,
+    by priority and fairly across tenants.
+    """
+
+    # seconds a worker blocks on an empty queue before checking for shutdown
+    poll_interval = 1
+
+    def __init__(self, max_concurrent_tasks: int, max_queue_size: int = 0):
         self.max_concurrent_tasks = max_concurrent_tasks
+        self.max_queue_size = max_queue_size
         self.current_tasks = 0
         self.lock = threading.Lock()
+        self.scheduler = FairScheduler()
         self.queue = self.create_queue()
+        self._stopping = threading.Event()
+        self._workers = []
+        for i in range(max_concurrent_tasks):
+            worker = threading.Thread(
+                target=self._worker_loop, name=f"task-worker-{i}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
 
     def create_queue(self):
         raise NotImplementedError()
 
-    def add_task(self, func: Callable, *args: Any, **kwargs: Any):
-        with self.lock:
-            if self.current_tasks < self.max_concurrent_tasks:
-                print(f"add task: {func.__name__}, current_tasks: {self.current_tasks}")
-                self.execute_task(func, *args, **kwargs)
-            else:
-                print(
-                    f"enqueue task: {func.__name__}, current_tasks: {self.current_tasks}"
-                )
-                self.enqueue({"func": func, "args": args, "kwargs": kwargs})
-
-    def execute_task(self, func: Callable, *args: Any, **kwargs: Any):
-        thread = threading.Thread(
-            target=self.run_task, args=(func, *args), kwargs=kwargs
+    def add_task(
+        self,
+        func: Callable,
+        *args: Any,
+        priority: str = "normal",
+        api_key: str = "",
+        **kwargs: Any,
+    ):
+        """
+        priority: high, normal or low, raises ValueError for anything else
+        api_key: the tenant of the task, tasks of different tenants share the workers fairly
+        """
+        if self._stopping.is_set():
+            raise TaskManagerStoppedError("the task manager is shutting down")
+        task = {
+            "func": func,
+            "args": args,
+            "kwargs": kwargs,
+            "priority": self.scheduler.priority(priority),
+            "tenant": self.scheduler.tenant_id(api_key),
+        }
+        if not self.enqueue(task):
+            raise TaskQueueFullError(
+                f"the task queue is full ({self.max_queue_size} waiting tasks)"
+            )
+        logger.info(
+            f"enqueue task: {func.__name__}, priority: {task['priority']}, current_tasks: {self.current_tasks}"
         )
-        thread.start()
+
+    def _worker_loop(self):
+        # waiting tasks are not started once shutdown began
+        while not self._stopping.is_set():
+            try:
+                task_info = self.dequeue(timeout=self.poll_interval)
+            except Exception as e:
+                logger.error(f"failed to dequeue task: {str(e)}")
+                time.sleep(self.poll_interval)
+                continue
+            if not task_info:
+                continue
+            self.execute(task_info)
+
+    def execute(self, task_info: Dict):
+        func = task_info["func"]
+        args = task_info.get("args", ())
+        kwargs = task_info.get("kwargs", {})
+        self.run_task(func, *args, **kwargs)
 
     def run_task(self, func: Callable, *args: Any, **kwargs: Any):
+        with self.lock:
+            self.current_tasks += 1
         try:
-            with self.lock:
-                self.current_tasks += 1
             func(*args, **kwargs)  # call the function here, passing *args and **kwargs.
+        except Exception as e:
+            # a failing task must not take its worker down
+            logger.exception(f"task {func.__name__} failed: {str(e)}")
         finally:
             self.task_done()
 
-    def check_queue(self):
-        with self.lock:
-            if (
-                self.current_tasks < self.max_concurrent_tasks
-                and not self.is_queue_empty()
-            ):
-                task_info = self.dequeue()
-                func = task_info["func"]
-                args = task_info.get("args", ())
-                kwargs = task_info.get("kwargs", {})
-                self.execute_task(func, *args, **kwargs)
-
     def task_done(self):
         with self.lock:
             self.current_tasks -= 1
-        self.check_queue()
 
-    def enqueue(self, task: Dict):
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop accepting and starting tasks and wait up to timeout seconds for the workers
+        to finish the running ones. The waiting tasks are left in the queue.
+
+        Returns False when workers are still running after timeout, the resources
+        they use must then be left open.
+        """
+        logger.info(
+            f"shutting down task manager, running: {self.current_tasks}, waiting: {self.queue_size()}"
+        )
+        self._stopping.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            worker.join(remaining)
+        alive = sum(worker.is_alive() for worker in self._workers)
+        if alive:
+            logger.warning(f"{alive} task workers still running after {timeout} seconds")
+        return not alive
+
+    def enqueue(self, task: Dict) -> bool:
+        """
+        Add a task unless the queue is full, returns False when it is.
+        task: {"func", "args", "kwargs", "priority", "tenant"}
+        """
         raise NotImplementedError()
 
-    def dequeue(self):
+    def dequeue(self, timeout: float = 0):
+        """Return the next task, waiting up to timeout seconds, or None."""
         raise NotImplementedError()
 
-    def is_queue_empty(self):
+    def queue_size(self) -> int:
         raise NotImplementedError()
+
+    def running_count(self) -> int:
+        """Tasks running, on all the workers sharing the queue."""
+        return self.current_tasks
+
+    def is_queue_empty(self):
+        return self.queue_size() == 0
@@ -0,0 +1,90 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.config import config
+from app.models.schema import TaskPriority
+
+# seconds a task of each priority is scheduled after a high priority task queued at the same time
+_default_priority_delays = {
+    TaskPriority.high.value: 0,
+    TaskPriority.normal.value: 30,
+    TaskPriority.low.value: 300,
+}
+
+
+class FairScheduler:
+    """
+    Orders queued tasks by priority and by tenant (the x-api-key of the request).
+
+    Every task gets a score, the queue runs the lowest score first:
+
+        tag   = max(now, tag of the previous task of the tenant and priority) + fair_share / weight
+        score = tag + delay of the priority
+
+    A tenant queuing many tasks at once gets tags fair_share seconds apart, so the
+    tasks of the other tenants interleave with them (weighted fair queuing), and the
+    tasks of one priority never wait behind the tasks of a lower one of the same
+    tenant. The priority delay is in seconds too: a low priority task runs before
+    the higher priority tasks queued more than its delay later (aging), nothing
+    waits forever.
+    """
+
+    def __init__(
+        self,
+        fair_share: Optional[float] = None,
+        priority_delays: Optional[Dict[str, float]] = None,
+        tenant_weights: Optional[Dict[str, float]] = None,
+    ):
+        if fair_share is None:
+            fair_share = config.app.get("task_fair_share", 60)
+        self.fair_share = fair_share
+        self.priority_delays = dict(_default_priority_delays)
+        self.priority_delays.update(
+            priority_delays
+            if priority_delays is not None
+            else config.app.get("task_priority_delays", {})
+        )
+        if tenant_weights is None:
+            tenant_weights = config.app.get("tenant_weights", {})
+        self.tenant_weights = {
+            self.tenant_id(api_key): weight for api_key, weight in tenant_weights.items()
+        }
+        # (tenant, priority) => tag of its last queued task, for the in-process queues
+        self._tags: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tenant_id(api_key: Optional[str]) -> str:
+        """The tenant of a request, the api key itself is never stored in the queue."""
+        if not api_key:
+            return ""
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def priority(value) -> str:
+        """The priority name, raises ValueError for an unknown one."""
+        return TaskPriority(value or TaskPriority.normal).value
+
+    def tag(self, tenant: str, last_tag: float = 0, now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.time()
+        weight = max(float(self.tenant_weights.get(tenant or "", 1)), 0.01)
+        return max(now, last_tag) + self.fair_share / weight
+
+    def score(self, tag: float, priority: str) -> float:
+        return tag + self.priority_delays[self.priority(priority)]
+
+    def next_score(self, tenant: str = "", priority: str = TaskPriority.normal) -> float:
+        """Score of a new task, remembering its tag in this process."""
+        priority = self.priority(priority)
+        now = time.time()
+        with self._lock:
+            key = (tenant or "", priority)
+            tag = self.tag(tenant, self._tags.get(key, 0), now)
+            self._tags[key] = tag
+            if len(self._tags) > 1000:
+                # tags in the past count as no tag
+                self._tags = {k: v for k, v in self._tags.items() if v > now}
+        return self.score(tag, priority)
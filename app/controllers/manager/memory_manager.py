@@ -1,18 +1,53 @@
-from queue import Queue
-from typing import Dict
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, Optional
+
+from loguru import logger
 
 from app.controllers.manager.base_manager import TaskManager
 
 
 class InMemoryTaskManager(TaskManager):
+    def __init__(self, max_concurrent_tasks: int, max_queue_size: int = 0):
+        self._cond = threading.Condition()
+        # FIFO among tasks with the same score
+        self._counter = itertools.count()
+        super().__init__(max_concurrent_tasks, max_queue_size)
+
     def create_queue(self):
-        return Queue()
+        # heap of (score, sequence, task)
+        return []
+
+    def enqueue(self, task: Dict) -> bool:
+        with self._cond:
+            if self.max_queue_size and len(self.queue) >= self.max_queue_size:
+                return False
+            # only a queued task moves the tenant's tag forward
+            score = self.scheduler.next_score(task["tenant"], task["priority"])
+            heapq.heappush(self.queue, (score, next(self._counter), task))
+            self._cond.notify()
+        return True
 
-    def enqueue(self, task: Dict):
-        self.queue.put(task)
+    def dequeue(self, timeout: float = 0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self.queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return heapq.heappop(self.queue)[2]
 
-    def dequeue(self):
-        return self.queue.get()
+    def queue_size(self) -> int:
+        with self._cond:
+            return len(self.queue)
 
-    def is_queue_empty(self):
-        return self.queue.empty()
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        joined = super().shutdown(timeout)
+        # nothing keeps the waiting tasks past this process
+        dropped = self.queue_size()
+        if dropped:
+            logger.warning(f"{dropped} waiting tasks dropped, they were not started before shutdown")
+        return joined
@@ -1,56 +1,250 @@
+import hashlib
 import json
+import threading
+import time
+import uuid
 from typing import Dict
 
 import redis
+from loguru import logger
 
+from app.config import config
 from app.controllers.manager.base_manager import TaskManager
-from app.models.schema import VideoParams
-from app.services import task as tm
+from app.controllers.manager.registry import (  # noqa: F401, re-exported
+    FUNC_MAP,
+    MODEL_MAP,
+    decode_task,
+    encode_task,
+    register_task_func,
+)
+from app.models import const
+from app.services import state as sm
 
-FUNC_MAP = {
-    "start": tm.start,
-    # 'start_test': tm.start_test
-}
+def redis_url_from_config() -> str:
+    host = config.app.get("redis_host", "localhost")
+    port = config.app.get("redis_port", 6379)
+    db = config.app.get("redis_db", 0)
+    password = config.app.get("redis_password", None)
+    return f"redis://:{password}@{host}:{port}/{db}"
 
 
 class RedisTaskManager(TaskManager):
-    def __init__(self, max_concurrent_tasks: int, redis_url: str):
-        self.redis_client = redis.Redis.from_url(redis_url)
-        super().__init__(max_concurrent_tasks)
+    """
+    Reliable Redis queue, shared by the api node and any number of workers (worker.py).
+
+    Waiting tasks are kept in a sorted set scored by FairScheduler, workers move the
+    task with the lowest score atomically into a processing list, heartbeat it while
+    it runs and remove it (ack) when it is done. A task whose heartbeat is older than visibility_timeout, because its worker
+    died, is put back at the head of the queue, up to max_attempts times, and then
+    moved to the dead letter list.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_tasks: int,
+        redis_url: str = "",
+        max_queue_size: int = 0,
+        redis_client: redis.Redis = None,
+        heartbeat_interval: float = 10,
+        visibility_timeout: float = 60,
+        max_attempts: int = 3,
+    ):
+        self.redis_client = redis_client or redis.Redis.from_url(redis_url)
+        self.heartbeat_interval = heartbeat_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._running = {}
+        self._running_lock = threading.Lock()
+        super().__init__(max_concurrent_tasks, max_queue_size)
+        self._monitor = threading.Thread(
+            target=self._monitor_loop, name="task-heartbeat", daemon=True
+        )
+        self._monitor.start()
 
     def create_queue(self):
-        return "task_queue"
-
-    def enqueue(self, task: Dict):
-        task_with_serializable_params = task.copy()
-
-        if "params" in task["kwargs"] and isinstance(
-            task["kwargs"]["params"], VideoParams
-        ):
-            task_with_serializable_params["kwargs"]["params"] = task["kwargs"][
-                "params"
-            ].dict()
-
-        # 将函数对象转换为其名称
-        task_with_serializable_params["func"] = task["func"].__name__
-        self.redis_client.rpush(self.queue, json.dumps(task_with_serializable_params))
-
-    def dequeue(self):
-        task_json = self.redis_client.lpop(self.queue)
-        if task_json:
-            task_info = json.loads(task_json)
-            # 将函数名称转换回函数对象
-            task_info["func"] = FUNC_MAP[task_info["func"]]
-
-            if "params" in task_info["kwargs"] and isinstance(
-                task_info["kwargs"]["params"], dict
-            ):
-                task_info["kwargs"]["params"] = VideoParams(
-                    **task_info["kwargs"]["params"]
-                )
-
-            return task_info
-        return None
-
-    def is_queue_empty(self):
-        return self.redis_client.llen(self.queue) == 0
+        # the FIFO list of older versions, still drained after the scheduled tasks
+        queue = "task_queue"
+        self.scheduled_queue = f"{queue}:scheduled"
+        # "priority:tenant" => tag of the last task queued for it, see FairScheduler
+        self.tags = f"{queue}:tags"
+        # one entry per queued task, idle workers block on it
+        self.wakeup = f"{queue}:wakeup"
+        self.processing_queue = f"{queue}:processing"
+        self.heartbeats = f"{queue}:heartbeats"
+        self.dead_letter_queue = f"{queue}:dead"
+        return queue
+
+    def enqueue(self, task: Dict) -> bool:
+        task_id = str(uuid.uuid4())
+        encoded = encode_task(task)
+        field = f"{task['priority']}:{task['tenant']}"
+        # the tag, the length check and the push are one transaction, even with several api nodes
+        with self.redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    if self.max_queue_size:
+                        pipe.watch(self.tags, self.scheduled_queue, self.queue)
+                        if self._queue_size(pipe) >= self.max_queue_size:
+                            pipe.unwatch()
+                            return False
+                    else:
+                        pipe.watch(self.tags)
+                    last_tag = float(pipe.hget(self.tags, field) or 0)
+                    tag = self.scheduler.tag(task["tenant"], last_tag)
+                    score = self.scheduler.score(tag, task["priority"])
+                    payload = json.dumps({"id": task_id, **encoded, "attempts": 0, "score": score})
+                    pipe.multi()
+                    pipe.hset(self.tags, field, tag)
+                    pipe.zadd(self.scheduled_queue, {payload: score})
+                    pipe.lpush(self.wakeup, 1)
+                    pipe.ltrim(self.wakeup, 0, 999)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+
+    def _move_to_processing(self):
+        with self.redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.scheduled_queue)
+                    first = pipe.zrange(self.scheduled_queue, 0, 0)
+                    if not first:
+                        pipe.unwatch()
+                        break
+                    pipe.multi()
+                    pipe.zrem(self.scheduled_queue, first[0])
+                    pipe.lpush(self.processing_queue, first[0])
+                    pipe.execute()
+                    return first[0]
+                except redis.WatchError:
+                    # another worker took it
+                    continue
+        return self.redis_client.rpoplpush(self.queue, self.processing_queue)
+
+    def dequeue(self, timeout: float = 0):
+        raw = self._move_to_processing()
+        if not raw:
+            self.redis_client.blpop(self.wakeup, max(1, int(timeout or self.poll_interval)))
+            raw = self._move_to_processing()
+        if not raw:
+            return None
+
+        task_info = json.loads(raw)
+        # tasks queued by older versions have no id
+        task_info.setdefault("id", hashlib.sha1(raw).hexdigest())
+        task_info["raw"] = raw
+        self.redis_client.hset(self.heartbeats, task_info["id"], time.time())
+
+        try:
+            task_info["func"], task_info["args"], task_info["kwargs"] = decode_task(task_info)
+        except KeyError:
+            logger.error(f"unknown task function: {task_info['func']}, moving the task to {self.dead_letter_queue}")
+            self._dead_letter(task_info)
+            return None
+        return task_info
+
+    def execute(self, task_info: Dict):
+        with self._running_lock:
+            self._running[task_info["id"]] = task_info["raw"]
+        try:
+            super().execute(task_info)
+        finally:
+            with self._running_lock:
+                self._running.pop(task_info["id"], None)
+            self.ack(task_info)
+
+    def ack(self, task_info: Dict):
+        pipe = self.redis_client.pipeline()
+        pipe.lrem(self.processing_queue, 1, task_info["raw"])
+        pipe.hdel(self.heartbeats, task_info["id"])
+        pipe.execute()
+
+    def _dead_letter(self, task_info: Dict):
+        pipe = self.redis_client.pipeline()
+        pipe.lrem(self.processing_queue, 1, task_info["raw"])
+        pipe.hdel(self.heartbeats, task_info["id"])
+        pipe.rpush(self.dead_letter_queue, task_info["raw"])
+        pipe.execute()
+
+    def _monitor_loop(self):
+        last_check = 0.0
+        while not self._stopping.is_set() or self._running:
+            try:
+                with self._running_lock:
+                    running = list(self._running)
+                if running:
+                    self.redis_client.hset(
+                        self.heartbeats, mapping={task_id: time.time() for task_id in running}
+                    )
+                if time.monotonic() - last_check >= self.visibility_timeout / 2:
+                    last_check = time.monotonic()
+                    self.requeue_stuck_tasks()
+            except Exception as e:
+                logger.error(f"task heartbeat failed: {str(e)}")
+            self._stopping.wait(self.heartbeat_interval)
+
+    def requeue_stuck_tasks(self) -> int:
+        """Put tasks whose worker stopped heartbeating back into the queue, returns how many."""
+        now = time.time()
+        heartbeats = {
+            k.decode("utf-8"): float(v)
+            for k, v in self.redis_client.hgetall(self.heartbeats).items()
+        }
+        requeued = 0
+        for raw in self.redis_client.lrange(self.processing_queue, 0, -1):
+            task_info = json.loads(raw)
+            task_id = task_info.get("id") or hashlib.sha1(raw).hexdigest()
+            beat = heartbeats.get(task_id)
+            if beat is None:
+                # moved to processing, but the worker died before its first heartbeat
+                self.redis_client.hsetnx(self.heartbeats, task_id, now)
+                continue
+            if now - beat < self.visibility_timeout:
+                continue
+            if self._requeue(raw, task_info, task_id):
+                requeued += 1
+        return requeued
+
+    def _requeue(self, raw: bytes, task_info: Dict, task_id: str) -> bool:
+        attempts = task_info.get("attempts", 0) + 1
+        task_info["id"] = task_id
+        task_info["attempts"] = attempts
+        give_up = attempts >= self.max_attempts
+        with self.redis_client.pipeline() as pipe:
+            try:
+                # only requeue if no worker acked or requeued it in the meantime
+                pipe.watch(self.processing_queue)
+                if raw not in pipe.lrange(self.processing_queue, 0, -1):
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.lrem(self.processing_queue, 1, raw)
+                pipe.hdel(self.heartbeats, task_id)
+                if give_up:
+                    pipe.rpush(self.dead_letter_queue, json.dumps(task_info))
+                else:
+                    # with its score, so it is ahead of the tasks queued after it
+                    pipe.zadd(self.scheduled_queue, {json.dumps(task_info): task_info.get("score", 0)})
+                    pipe.lpush(self.wakeup, 1)
+                pipe.execute()
+            except redis.WatchError:
+                return False
+
+        kwargs_task_id = task_info.get("kwargs", {}).get("task_id", "")
+        if give_up:
+            logger.error(f"task {kwargs_task_id} stalled {attempts} times, moved to {self.dead_letter_queue}")
+            if kwargs_task_id:
+                sm.state.update_task(kwargs_task_id, state=const.TASK_STATE_FAILED)
+        else:
+            logger.warning(f"task {kwargs_task_id} stalled, requeued (attempt {attempts + 1})")
+        return True
+
+    def _queue_size(self, client) -> int:
+        return client.zcard(self.scheduled_queue) + client.llen(self.queue)
+
+    def queue_size(self) -> int:
+        return self._queue_size(self.redis_client)
+
+    def running_count(self) -> int:
+        return self.redis_client.llen(self.processing_queue)
@@ -0,0 +1,72 @@
+"""
+Task functions and argument encoding shared by the durable task queues (redis,
+sqlite): a queued task is stored as the function name plus JSON encoded arguments,
+every node must be able to resolve the name.
+"""
+
+from typing import Callable, Dict, Tuple
+
+from pydantic import BaseModel
+
+from app.models.schema import VideoParams
+from app.services import task as tm
+
+FUNC_MAP: Dict[str, Callable] = {
+    "start": tm.start,
+}
+
+# pydantic models that can be passed as task arguments
+MODEL_MAP = {
+    "VideoParams": VideoParams,
+}
+
+
+def register_task_func(func: Callable, name: str = "") -> Callable:
+    FUNC_MAP[name or func.__name__] = func
+    return func
+
+
+def _encode_value(value):
+    if isinstance(value, BaseModel):
+        data = value.model_dump(mode="json", warnings=False)
+        # request bodies are subclasses of the registered models, e.g. TaskVideoRequest
+        for name, model in MODEL_MAP.items():
+            if isinstance(value, model):
+                return {"__model__": name, "data": data}
+        return data
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and value.get("__model__") in MODEL_MAP:
+        return MODEL_MAP[value["__model__"]](**value["data"])
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    return value
+
+
+def encode_task(task: Dict) -> Dict:
+    """{"func", "args", "kwargs", ...} as passed to TaskManager.enqueue, to a JSON serializable dict."""
+    func_name = task["func"].__name__
+    if FUNC_MAP.get(func_name) is not task["func"]:
+        raise ValueError(f"task function is not registered: {func_name}")
+    return {
+        "func": func_name,
+        "args": [_encode_value(arg) for arg in task["args"]],
+        "kwargs": {k: _encode_value(v) for k, v in task["kwargs"].items()},
+        "priority": task.get("priority", "normal"),
+        "tenant": task.get("tenant", ""),
+    }
+
+
+def decode_task(payload: Dict) -> Tuple[Callable, list, Dict]:
+    """Inverse of encode_task, raises KeyError for an unknown function."""
+    func = FUNC_MAP[payload["func"]]
+    args = [_decode_value(arg) for arg in payload.get("args", [])]
+    kwargs = {k: _decode_value(v) for k, v in payload.get("kwargs", {}).items()}
+    # tasks queued by older versions pass the params as a plain dict
+    if isinstance(kwargs.get("params"), dict):
+        kwargs["params"] = VideoParams(**kwargs["params"])
+    return func, args, kwargs
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from typing import Dict
+
+from loguru import logger
+
+from app.controllers.manager.base_manager import TaskManager
+from app.controllers.manager.registry import decode_task, encode_task
+from app.models import const
+from app.services import state as sm
+
+
+class SqliteTaskManager(TaskManager):
+    """
+    Durable queue in an embedded SQLite database, for single node deployments.
+
+    A task row is marked running when a worker takes it and deleted once it is
+    done. Rows still marked running on startup belong to tasks interrupted by a
+    crash or restart: they are queued again, up to max_attempts times, and then
+    marked as failed.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_tasks: int,
+        db_path: str,
+        max_queue_size: int = 0,
+        max_attempts: int = 3,
+    ):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        super().__init__(max_concurrent_tasks, max_queue_size)
+
+    def create_queue(self):
+        conn = sm.sqlite_connect(self.db_path)
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS task_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                running INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                score REAL NOT NULL DEFAULT 0
+            );
+            """
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(task_queue)")]
+        if "score" not in columns:
+            # queues created by older versions, their tasks keep running first
+            conn.execute("ALTER TABLE task_queue ADD COLUMN score REAL NOT NULL DEFAULT 0")
+        conn.execute("DROP INDEX IF EXISTS idx_task_queue_running")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_task_queue_score ON task_queue (running, score, id)"
+        )
+        self._recover(conn)
+        return conn
+
+    def _recover(self, conn):
+        # runs before the workers start, every running row was left by a previous process
+        rows = conn.execute(
+            "SELECT id, payload, attempts FROM task_queue WHERE running = 1"
+        ).fetchall()
+        for row_id, payload, attempts in rows:
+            attempts += 1
+            task_id = json.loads(payload).get("kwargs", {}).get("task_id", "")
+            if attempts >= self.max_attempts:
+                conn.execute("DELETE FROM task_queue WHERE id = ?", (row_id,))
+                logger.error(f"task {task_id} interrupted {attempts} times, marked as failed")
+                if task_id:
+                    sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+                continue
+            conn.execute(
+                "UPDATE task_queue SET running = 0, attempts = ? WHERE id = ?",
+                (attempts, row_id),
+            )
+            logger.warning(f"task {task_id} was interrupted, requeued (attempt {attempts + 1})")
+
+    def enqueue(self, task: Dict) -> bool:
+        payload = json.dumps(encode_task(task))
+        with self._cond:
+            # the count and the insert are one transaction
+            with sm.sqlite_transaction(self.queue, "BEGIN IMMEDIATE"):
+                if self.max_queue_size and self._count_waiting() >= self.max_queue_size:
+                    return False
+                # only a queued task moves the tenant's tag forward
+                score = self.scheduler.next_score(task["tenant"], task["priority"])
+                self.queue.execute(
+                    "INSERT INTO task_queue (payload, created_at, score) VALUES (?, ?, ?)",
+                    (payload, time.time(), score),
+                )
+            self._cond.notify()
+        return True
+
+    def dequeue(self, timeout: float = 0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                row = self.queue.execute(
+                    "SELECT id, payload FROM task_queue WHERE running = 0 ORDER BY score, id LIMIT 1"
+                ).fetchone()
+                if row:
+                    self.queue.execute("UPDATE task_queue SET running = 1 WHERE id = ?", (row[0],))
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+        row_id, payload = row
+        task_info = json.loads(payload)
+        task_info["id"] = row_id
+        try:
+            task_info["func"], task_info["args"], task_info["kwargs"] = decode_task(task_info)
+        except KeyError:
+            logger.error(f"unknown task function: {task_info['func']}, dropping the task")
+            self.ack(task_info)
+            return None
+        return task_info
+
+    def execute(self, task_info: Dict):
+        try:
+            super().execute(task_info)
+        finally:
+            self.ack(task_info)
+
+    def ack(self, task_info: Dict):
+        with self._cond:
+            self.queue.execute("DELETE FROM task_queue WHERE id = ?", (task_info["id"],))
+
+    def _count_waiting(self) -> int:
+        return self.queue.execute(
+            "SELECT COUNT(*) FROM task_queue WHERE running = 0"
+        ).fetchone()[0]
+
+    def queue_size(self) -> int:
+        with self._cond:
+            return self._count_waiting()
@@ -1,4 +1,7 @@
-import glob
+import asyncio
+import json
+import math
+import mimetypes
 import os
 import pathlib
 import shutil
@@ -6,49 +9,74 @@ from typing import Union
 
 from fastapi import BackgroundTasks, Depends, Path, Request, UploadFile
 from fastapi.params import File
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import StreamingResponse
 from loguru import logger
+from starlette.concurrency import run_in_threadpool
 
 from app.config import config
 from app.controllers import base
+from app.controllers.manager.fair_scheduler import FairScheduler
 from app.controllers.manager.memory_manager import InMemoryTaskManager
-from app.controllers.manager.redis_manager import RedisTaskManager
+from app.controllers.manager.redis_manager import RedisTaskManager, redis_url_from_config
+from app.controllers.manager.sqlite_manager import SqliteTaskManager
 from app.controllers.v1.base import new_router
-from app.models.exception import HttpException
+from app.models import const
+from app.models.exception import (
+    HttpException,
+    IdempotencyKeyReusedError,
+    TaskManagerStoppedError,
+    TaskQueueFullError,
+    UnsupportedMediaError,
+    UploadTooLargeError,
+)
 from app.models.schema import (
     AudioRequest,
     BgmRetrieveResponse,
     BgmUploadResponse,
+    MaterialUploadResponse,
     SubtitleRequest,
+    TaskBatchResponse,
     TaskDeletionResponse,
     TaskQueryRequest,
     TaskQueryResponse,
     TaskResponse,
+    TaskVideoBatchRequest,
     TaskVideoRequest,
 )
+from app.services import bgm, cancellation, checkpoint, eta, events, idempotency, uploads, webhooks
 from app.services import state as sm
 from app.services import task as tm
-from app.utils import utils
+from app.utils import range_response, utils
 
 # 认证依赖项
 # router = new_router(dependencies=[Depends(base.verify_token)])
 router = new_router()
 
 _enable_redis = config.app.get("enable_redis", False)
-_redis_host = config.app.get("redis_host", "localhost")
-_redis_port = config.app.get("redis_port", 6379)
-_redis_db = config.app.get("redis_db", 0)
-_redis_password = config.app.get("redis_password", None)
 _max_concurrent_tasks = config.app.get("max_concurrent_tasks", 5)
+_max_queued_tasks = config.app.get("max_queued_tasks", 100)
 
-redis_url = f"redis://:{_redis_password}@{_redis_host}:{_redis_port}/{_redis_db}"
 # 根据配置选择合适的任务管理器
 if _enable_redis:
+    # max_concurrent_tasks = 0 turns the api node into a pure producer, tasks are then run by worker.py
     task_manager = RedisTaskManager(
-        max_concurrent_tasks=_max_concurrent_tasks, redis_url=redis_url
+        max_concurrent_tasks=_max_concurrent_tasks,
+        redis_url=redis_url_from_config(),
+        max_queue_size=_max_queued_tasks,
+        visibility_timeout=config.app.get("task_visibility_timeout", 60),
+        max_attempts=config.app.get("task_max_attempts", 3),
+    )
+elif config.app.get("enable_sqlite", False):
+    task_manager = SqliteTaskManager(
+        max_concurrent_tasks=_max_concurrent_tasks,
+        db_path=sm.sqlite_path_from_config(),
+        max_queue_size=_max_queued_tasks,
+        max_attempts=config.app.get("task_max_attempts", 3),
     )
 else:
-    task_manager = InMemoryTaskManager(max_concurrent_tasks=_max_concurrent_tasks)
+    task_manager = InMemoryTaskManager(
+        max_concurrent_tasks=_max_concurrent_tasks, max_queue_size=_max_queued_tasks
+    )
 
 
 @router.post("/videos", response_model=TaskResponse, summary="Generate a short video")
@@ -72,6 +100,36 @@ def create_audio(
     return create_task(request, body, stop_at="audio")
 
 
+def _estimate_wait() -> float:
+    """Seconds until a task queued now starts, see app.services.eta."""
+    # the api node of a redis deployment may run no tasks itself
+    concurrency = config.app.get("eta_concurrency", 0) or task_manager.max_concurrent_tasks
+    return eta.queue_wait(
+        task_manager.queue_size(),
+        task_manager.running_count(),
+        concurrency,
+        tm.estimate_duration("video"),
+    )
+
+
+def _check_admission(task_id: str, request_id: str, wait: float):
+    """Reject the task with 429 when it would wait longer than max_queue_wait seconds."""
+    max_wait = config.app.get("max_queue_wait", 3600)
+    if max_wait and wait > max_wait:
+        raise HttpException(
+            task_id=task_id,
+            status_code=429,
+            message=f"{request_id}: the estimated wait is {int(wait)} seconds, more than {max_wait} seconds",
+            headers={"Retry-After": str(math.ceil(wait - max_wait))},
+        )
+
+
+def _queue_full_headers():
+    # a worker should be free once a task finished
+    concurrency = config.app.get("eta_concurrency", 0) or task_manager.max_concurrent_tasks
+    return {"Retry-After": str(math.ceil(tm.estimate_duration("video") / max(1, concurrency)))}
+
+
 def create_task(
     request: Request,
     body: Union[TaskVideoRequest, SubtitleRequest, AudioRequest],
@@ -79,20 +137,205 @@ def create_task(
 ):
     task_id = utils.get_uuid()
     request_id = base.get_task_id(request)
+    claimed = []
     try:
+        priority = FairScheduler.priority(base.get_priority(request))
+        if body.callback_url:
+            webhooks.validate_url(body.callback_url)
         task = {
             "task_id": task_id,
             "request_id": request_id,
             "params": body.model_dump(),
         }
-        sm.state.update_task(task_id)
-        task_manager.add_task(tm.start, task_id=task_id, params=body, stop_at=stop_at)
+        wait = _estimate_wait()
+        _check_admission(task_id, request_id, wait)
+        # the state first: a duplicate that finds the key bound to a task without state takes it over
+        sm.state.update_task(
+            task_id,
+            estimated_start_at=eta.timestamp(wait),
+            estimated_finish_at=eta.timestamp(wait + tm.estimate_duration(stop_at)),
+        )
+        existing_task_id, claimed = idempotency.claim(
+            task_id,
+            body,
+            stop_at,
+            request.headers.get("Idempotency-Key", ""),
+            tenant=FairScheduler.tenant_id(base.get_api_key(request)),
+        )
+        if existing_task_id:
+            sm.state.delete_task(task_id)
+            return utils.get_response(
+                200, {"task_id": existing_task_id, "request_id": request_id}
+            )
+
+        task_manager.add_task(
+            tm.start,
+            task_id=task_id,
+            params=body,
+            stop_at=stop_at,
+            priority=priority,
+            api_key=base.get_api_key(request),
+        )
         logger.success(f"Task created: {utils.to_json(task)}")
         return utils.get_response(200, task)
+    except IdempotencyKeyReusedError as e:
+        sm.state.delete_task(task_id)
+        raise HttpException(
+            task_id=task_id, status_code=422, message=f"{request_id}: {str(e)}"
+        )
     except ValueError as e:
         raise HttpException(
             task_id=task_id, status_code=400, message=f"{request_id}: {str(e)}"
         )
+    except (TaskQueueFullError, TaskManagerStoppedError) as e:
+        sm.state.delete_task(task_id)
+        idempotency.release(task_id, body, stop_at, claimed)
+        if isinstance(e, TaskQueueFullError):
+            raise HttpException(
+                task_id=task_id,
+                status_code=429,
+                message=f"{request_id}: {str(e)}",
+                headers=_queue_full_headers(),
+            )
+        raise HttpException(
+            task_id=task_id, status_code=503, message=f"{request_id}: {str(e)}"
+        )
+
+@router.post(
+    "/videos/batch",
+    response_model=TaskBatchResponse,
+    summary="Generate many short videos, sharing the common work",
+)
+def create_video_batch(request: Request, body: TaskVideoBatchRequest):
+    request_id = base.get_task_id(request)
+    batch_id = utils.get_uuid()
+    max_batch_size = config.app.get("max_batch_size", 50)
+    if len(body.tasks) > max_batch_size:
+        raise HttpException(
+            task_id=batch_id,
+            status_code=400,
+            message=f"{request_id}: a batch has at most {max_batch_size} tasks",
+        )
+    try:
+        # bulk work, unless asked otherwise
+        priority = FairScheduler.priority(base.get_priority(request, default="low"))
+        for params in body.tasks:
+            if params.callback_url:
+                webhooks.validate_url(params.callback_url)
+    except ValueError as e:
+        raise HttpException(
+            task_id=batch_id, status_code=400, message=f"{request_id}: {str(e)}"
+        )
+
+    wait = _estimate_wait()
+    _check_admission(batch_id, request_id, wait)
+    if task_manager.max_queue_size and (
+        task_manager.queue_size() + len(body.tasks) > task_manager.max_queue_size
+    ):
+        raise HttpException(
+            task_id=batch_id,
+            status_code=429,
+            message=f"{request_id}: the task queue has no room for {len(body.tasks)} more tasks",
+            headers=_queue_full_headers(),
+        )
+    duration = tm.estimate_duration("video")
+    concurrency = max(
+        1, config.app.get("eta_concurrency", 0) or task_manager.max_concurrent_tasks
+    )
+
+    task_ids = [utils.get_uuid() for _ in body.tasks]
+    for i, task_id in enumerate(task_ids):
+        start = wait + i // concurrency * duration
+        sm.state.update_task(
+            task_id,
+            batch_id=batch_id,
+            estimated_start_at=eta.timestamp(start),
+            estimated_finish_at=eta.timestamp(start + duration),
+        )
+    rounds = math.ceil(len(task_ids) / concurrency)
+    sm.state.update_task(
+        batch_id,
+        task_ids=task_ids,
+        estimated_start_at=eta.timestamp(wait),
+        estimated_finish_at=eta.timestamp(wait + rounds * duration),
+    )
+    # each task of the batch is queued on its own, so it takes a worker like any other
+    # task and the batch shares the workers fairly with the other tenants
+    queued = 0
+    try:
+        for task_id, params in zip(task_ids, body.tasks):
+            task_manager.add_task(
+                tm.start,
+                task_id=task_id,
+                params=params,
+                stop_at="video",
+                priority=priority,
+                api_key=base.get_api_key(request),
+            )
+            queued += 1
+    except (TaskQueueFullError, TaskManagerStoppedError) as e:
+        # the queued tasks stop when they see their cancelled state
+        for task_id in task_ids[:queued]:
+            sm.state.update_task(task_id, state=const.TASK_STATE_CANCELLED)
+            cancellation.cancel(task_id)
+        for task_id in [batch_id] + task_ids[queued:]:
+            sm.state.delete_task(task_id)
+        if isinstance(e, TaskQueueFullError):
+            raise HttpException(
+                task_id=batch_id,
+                status_code=429,
+                message=f"{request_id}: {str(e)}",
+                headers=_queue_full_headers(),
+            )
+        raise HttpException(
+            task_id=batch_id, status_code=503, message=f"{request_id}: {str(e)}"
+        )
+
+    response = {"batch_id": batch_id, "task_ids": task_ids, "request_id": request_id}
+    logger.success(f"Batch created: {utils.to_json(response)}")
+    return utils.get_response(200, response)
+
+
+@router.get(
+    "/videos/batch/{batch_id}",
+    response_model=TaskQueryResponse,
+    summary="Query the aggregated progress of a batch",
+)
+def get_video_batch(request: Request, batch_id: str = Path(..., description="Batch ID")):
+    request_id = base.get_task_id(request)
+    batch = sm.state.get_task(batch_id)
+    if not batch or "task_ids" not in batch:
+        raise HttpException(
+            task_id=batch_id, status_code=404, message=f"{request_id}: batch not found"
+        )
+
+    counts = {"processing": 0, "completed": 0, "failed": 0, "cancelled": 0}
+    names = {
+        const.TASK_STATE_COMPLETE: "completed",
+        const.TASK_STATE_FAILED: "failed",
+        const.TASK_STATE_CANCELLED: "cancelled",
+    }
+    tasks = []
+    progress = 0
+    for task_id in batch["task_ids"]:
+        # a deleted task counts as failed
+        task = sm.state.get_task(task_id) or {"state": const.TASK_STATE_FAILED}
+        state = task.get("state")
+        counts[names.get(state, "processing")] += 1
+        task_progress = task.get("progress", 0) if state == const.TASK_STATE_PROCESSING else 100
+        progress += task_progress
+        tasks.append({"task_id": task_id, "state": state, "progress": task_progress})
+
+    response = {
+        "batch_id": batch_id,
+        "state": batch.get("state"),
+        "progress": progress // max(1, len(tasks)),
+        "total": len(tasks),
+        **counts,
+        "tasks": tasks,
+    }
+    return utils.get_response(200, response)
+
 
 from fastapi import Query
 
@@ -156,6 +399,148 @@ def get_task(
     )
 
 
+_finished_states = (
+    const.TASK_STATE_COMPLETE,
+    const.TASK_STATE_FAILED,
+    const.TASK_STATE_CANCELLED,
+)
+# seconds between keep-alive comments on an idle event stream
+_event_keepalive = 15
+
+
+@router.get(
+    "/tasks/{task_id}/events",
+    summary="Follow the state, progress and log lines of a task (server-sent events)",
+)
+async def get_task_events(request: Request, task_id: str = Path(..., description="Task ID")):
+    request_id = base.get_task_id(request)
+    # before reading the task, so no update falls between the two
+    subscription = events.subscribe(task_id)
+    try:
+        task = await run_in_threadpool(sm.state.get_task, task_id)
+    except Exception:
+        subscription.close()
+        raise
+    if not task:
+        subscription.close()
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+    return StreamingResponse(
+        _event_stream(request, subscription, task),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def _event_stream(request: Request, subscription: events.Subscription, task: dict):
+    """
+    The whole task as a first "state" event, then every update ("state" events with
+    the updated fields) and log line ("log" events), until the task finished.
+    """
+    try:
+        yield "retry: 3000\n\n"
+        yield _sse("state", task)
+        if task.get("state") in _finished_states:
+            return
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), _event_keepalive)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            message = json.loads(message)
+            yield _sse(message["event"], message["data"])
+            if message["event"] == "state" and message["data"].get("state") in _finished_states:
+                return
+    finally:
+        subscription.close()
+
+
+@router.post(
+    "/tasks/{task_id}/cancel",
+    response_model=TaskResponse,
+    summary="Cancel a queued or running task",
+)
+def cancel_task(request: Request, task_id: str = Path(..., description="Task ID")):
+    request_id = base.get_task_id(request)
+    task = sm.state.get_task(task_id)
+    if not task:
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+    if task.get("state") != const.TASK_STATE_PROCESSING:
+        raise HttpException(
+            task_id=task_id, status_code=400, message=f"{request_id}: task is not running"
+        )
+
+    # the state first: a queued task, or one running on another node, stops when it sees it
+    sm.state.update_task(
+        task_id, state=const.TASK_STATE_CANCELLED, progress=task.get("progress", 0)
+    )
+    cancellation.cancel(task_id)
+    if "task_ids" in task:
+        tm.cancel_batch(task_id)
+    logger.success(f"Task cancelled: {task_id}")
+    return utils.get_response(200, {"task_id": task_id, "request_id": request_id})
+
+
+@router.post(
+    "/tasks/{task_id}/resume",
+    response_model=TaskResponse,
+    summary="Resume a task, skipping the stages that already finished",
+)
+def resume_task(request: Request, task_id: str = Path(..., description="Task ID")):
+    request_id = base.get_task_id(request)
+    task = sm.state.get_task(task_id)
+    if task and task.get("state") == const.TASK_STATE_PROCESSING:
+        raise HttpException(
+            task_id=task_id, status_code=400, message=f"{request_id}: task is still running"
+        )
+
+    saved = checkpoint.load_task(task_id)
+    if not saved:
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: no checkpoint found"
+        )
+
+    params, stop_at = saved
+    try:
+        priority = FairScheduler.priority(base.get_priority(request))
+    except ValueError as e:
+        raise HttpException(
+            task_id=task_id, status_code=400, message=f"{request_id}: {str(e)}"
+        )
+    try:
+        sm.state.update_task(task_id)
+        task_manager.add_task(
+            tm.start,
+            task_id=task_id,
+            params=params,
+            stop_at=stop_at,
+            resume=True,
+            priority=priority,
+            api_key=base.get_api_key(request),
+        )
+    except (TaskQueueFullError, TaskManagerStoppedError) as e:
+        if task:
+            sm.state.update_task(task_id, state=task["state"], progress=task.get("progress", 0))
+        else:
+            sm.state.delete_task(task_id)
+        status_code = 429 if isinstance(e, TaskQueueFullError) else 503
+        raise HttpException(
+            task_id=task_id, status_code=status_code, message=f"{request_id}: {str(e)}"
+        )
+    logger.success(f"Task resumed: {task_id}, stop_at: {stop_at}")
+    return utils.get_response(200, {"task_id": task_id, "request_id": request_id})
+
+
 @router.delete(
     "/tasks/{task_id}",
     response_model=TaskDeletionResponse,
@@ -165,6 +550,17 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
     request_id = base.get_task_id(request)
     task = sm.state.get_task(task_id)
     if task:
+        if task.get("state") == const.TASK_STATE_PROCESSING:
+            sm.state.update_task(task_id, state=const.TASK_STATE_CANCELLED)
+            cancellation.cancel(task_id)
+            # the worker writes into the task dir until it has stopped
+            if not cancellation.wait(task_id, timeout=config.app.get("task_delete_timeout", 30)):
+                raise HttpException(
+                    task_id=task_id,
+                    status_code=400,
+                    message=f"{request_id}: task is still stopping, try again later",
+                )
+
         tasks_dir = utils.task_dir()
         current_task_dir = os.path.join(tasks_dir, task_id)
         if os.path.exists(current_task_dir):
@@ -183,105 +579,136 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
     "/musics", response_model=BgmRetrieveResponse, summary="Retrieve local BGM files"
 )
 def get_bgm_list(request: Request):
-    suffix = "*.mp3"
-    song_dir = utils.song_dir()
-    files = glob.glob(os.path.join(song_dir, suffix))
+    # indexed by the bgm library, only rescanned when the directory changed
     bgm_list = []
-    for file in files:
+    for track in bgm.library().tracks():
         bgm_list.append(
             {
-                "name": os.path.basename(file),
-                "size": os.path.getsize(file),
-                "file": file,
+                "name": track["name"],
+                "size": track["size"],
+                "file": track["path"],
+                "duration": track.get("duration"),
+                "loudness": track.get("loudness"),
+                "sample_rate": track.get("sample_rate"),
             }
         )
     response = {"files": bgm_list}
     return utils.get_response(200, response)
 
 
+def _save_upload(request: Request, file: UploadFile, directory: str, formats, max_mb: int, kind: str, **kwargs):
+    """Stream an upload to directory (see app.services.uploads), mapping its errors to 413 / 415."""
+    request_id = base.get_task_id(request)
+    max_bytes = max_mb * 1024 * 1024
+    # the multipart body is a little larger than the file, refuse clearly oversized ones right away
+    content_length = request.headers.get("content-length", "")
+    if max_bytes and content_length.isdigit() and int(content_length) > max_bytes + 64 * 1024:
+        raise HttpException(
+            "", status_code=413, message=f"{request_id}: the file is larger than {max_mb} MB"
+        )
+    try:
+        file.file.seek(0)
+        return uploads.save_upload(
+            file.file, directory, file.filename, formats, max_bytes, kind, **kwargs
+        )
+    except UploadTooLargeError as e:
+        raise HttpException("", status_code=413, message=f"{request_id}: {str(e)}")
+    except UnsupportedMediaError as e:
+        raise HttpException("", status_code=415, message=f"{request_id}: {str(e)}")
+
+
 @router.post(
     "/musics",
     response_model=BgmUploadResponse,
     summary="Upload the BGM file to the songs directory",
 )
 def upload_bgm_file(request: Request, file: UploadFile = File(...)):
-    request_id = base.get_task_id(request)
-    # check file ext
-    if file.filename.endswith("mp3"):
-        song_dir = utils.song_dir()
-        save_path = os.path.join(song_dir, file.filename)
-        # save file
-        with open(save_path, "wb+") as buffer:
-            # If the file already exists, it will be overwritten
-            file.file.seek(0)
-            buffer.write(file.file.read())
-        response = {"file": save_path}
-        return utils.get_response(200, response)
+    # If the file already exists, it will be overwritten
+    save_path, entry = _save_upload(
+        request,
+        file,
+        utils.song_dir(),
+        ("mp3",),
+        config.app.get("max_bgm_upload_mb", 50),
+        "bgm",
+        loudness=True,
+    )
+    response = {
+        "file": save_path,
+        "duration": entry["duration"],
+        "codec": entry["codec"],
+        "sample_rate": entry["sample_rate"],
+        "loudness": entry["loudness"],
+    }
+    return utils.get_response(200, response)
 
-    raise HttpException(
-        "", status_code=400, message=f"{request_id}: Only *.mp3 files can be uploaded"
+
+@router.post(
+    "/materials",
+    response_model=MaterialUploadResponse,
+    summary="Upload a local video or image material (for video_source = local)",
+)
+def upload_material_file(request: Request, file: UploadFile = File(...)):
+    save_path, entry = _save_upload(
+        request,
+        file,
+        utils.storage_dir("local_videos", create=True),
+        uploads.VIDEO_FORMATS + uploads.IMAGE_FORMATS,
+        config.app.get("max_material_upload_mb", 500),
+        "material",
     )
+    response = {
+        "file": save_path,
+        "duration": entry["duration"],
+        "codec": entry["codec"],
+        "width": entry["width"],
+        "height": entry["height"],
+    }
+    return utils.get_response(200, response)
+
+
+def _task_file(request: Request, file_path: str):
+    """The path and stat of a file in the task directory, 404 outside of it or when missing."""
+    tasks_dir = os.path.realpath(utils.task_dir())
+    path = os.path.realpath(os.path.join(tasks_dir, file_path))
+    stat_result = None
+    if path.startswith(tasks_dir + os.sep):
+        stat_result = range_response.stat_file(path)
+    if stat_result is None:
+        request_id = base.get_task_id(request)
+        raise HttpException(
+            task_id=file_path, status_code=404, message=f"{request_id}: file not found"
+        )
+    return path, stat_result
 
 
-@router.get("/stream/{file_path:path}")
+@router.api_route("/stream/{file_path:path}", methods=["GET", "HEAD"])
 async def stream_video(request: Request, file_path: str):
-    tasks_dir = utils.task_dir()
-    video_path = os.path.join(tasks_dir, file_path)
-    range_header = request.headers.get("Range")
-    video_size = os.path.getsize(video_path)
-    start, end = 0, video_size - 1
-
-    length = video_size
-    if range_header:
-        range_ = range_header.split("bytes=")[1]
-        start, end = [int(part) if part else None for part in range_.split("-")]
-        if start is None:
-            start = video_size - end
-            end = video_size - 1
-        if end is None:
-            end = video_size - 1
-        length = end - start + 1
-
-    def file_iterator(file_path, offset=0, bytes_to_read=None):
-        with open(file_path, "rb") as f:
-            f.seek(offset, os.SEEK_SET)
-            remaining = bytes_to_read or video_size
-            while remaining > 0:
-                bytes_to_read = min(4096, remaining)
-                data = f.read(bytes_to_read)
-                if not data:
-                    break
-                remaining -= len(data)
-                yield data
-
-    response = StreamingResponse(
-        file_iterator(video_path, start, length), media_type="video/mp4"
+    """
+    Serve a task file for playback, with range, conditional and multi-range requests
+    (see app.utils.range_response), without blocking the event loop.
+    """
+    video_path, stat_result = await run_in_threadpool(_task_file, request, file_path)
+    return range_response.RangeFileResponse(
+        video_path, stat_result, media_type=mimetypes.guess_type(video_path)[0] or "video/mp4"
     )
-    response.headers["Content-Range"] = f"bytes {start}-{end}/{video_size}"
-    response.headers["Accept-Ranges"] = "bytes"
-    response.headers["Content-Length"] = str(length)
-    response.status_code = 206  # Partial Content
-
-    return response
 
 
-@router.get("/download/{file_path:path}")
-async def download_video(_: Request, file_path: str):
+@router.api_route("/download/{file_path:path}", methods=["GET", "HEAD"])
+async def download_video(request: Request, file_path: str):
     """
     download video
-    :param _: Request request
+    :param request: Request request
     :param file_path: video file path, eg: /cd1727ed-3473-42a2-a7da-4faafafec72b/final-1.mp4
-    :return: video file
+    :return: video file, interrupted downloads can be resumed with a Range request
     """
-    tasks_dir = utils.task_dir()
-    video_path = os.path.join(tasks_dir, file_path)
+    video_path, stat_result = await run_in_threadpool(_task_file, request, file_path)
     file_path = pathlib.Path(video_path)
     filename = file_path.stem
     extension = file_path.suffix
-    headers = {"Content-Disposition": f"attachment; filename={filename}{extension}"}
-    return FileResponse(
-        path=video_path,
-        headers=headers,
+    return range_response.RangeFileResponse(
+        video_path,
+        stat_result,
         filename=f"{filename}{extension}",
         media_type=f"video/{extension[1:]}",
     )
@@ -1,16 +1,22 @@
 import traceback
-from typing import Any
+from typing import Any, Dict, Optional
 
 from loguru import logger
 
 
 class HttpException(Exception):
     def __init__(
-        self, task_id: str, status_code: int, message: str = "", data: Any = None
+        self,
+        task_id: str,
+        status_code: int,
+        message: str = "",
+        data: Any = None,
+        headers: Optional[Dict[str, str]] = None,
     ):
         self.message = message
         self.status_code = status_code
         self.data = data
+        self.headers = headers
         # Retrieve the exception stack trace information.
         tb_str = traceback.format_exc().strip()
         if not tb_str or tb_str == "NoneType: None":
@@ -26,3 +32,31 @@ class HttpException(Exception):
 
 class FileNotFoundException(Exception):
     pass
+
+
+class TaskQueueFullError(Exception):
+    pass
+
+
+class TaskManagerStoppedError(Exception):
+    pass
+
+
+class TaskCancelledError(Exception):
+    pass
+
+
+class IdempotencyKeyReusedError(Exception):
+    pass
+
+
+class ProbeError(Exception):
+    pass
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class UnsupportedMediaError(Exception):
+    pass
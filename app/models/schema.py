@@ -11,6 +11,11 @@ class VideoConcatMode(str, Enum):
     random = "random"
     sequential = "sequential"
 
+class TaskPriority(str, Enum):
+    high = "high"
+    normal = "normal"
+    low = "low"
+
 class VideoTransitionMode(str, Enum):
     none = None
     shuffle = "Shuffle"
@@ -82,6 +87,8 @@ class VideoParams(BaseModel):
     stroke_width: float = 1.5
     n_threads: Optional[int] = 2
     paragraph_number: Optional[int] = 1
+    use_llm_cache: Optional[bool] = True  # 是否复用缓存的LLM结果
+    callback_url: Optional[str] = ""  # 任务完成或失败时通知的地址
 
 class SubtitleRequest(BaseModel):
     podcast_script: Optional[List[PodcastScript]] = None
@@ -102,6 +109,7 @@ class SubtitleRequest(BaseModel):
     stroke_width: float = 1.5
     video_source: Optional[str] = "local"
     subtitle_enabled: Optional[str] = "true"
+    callback_url: Optional[str] = ""
 
 class AudioRequest(BaseModel):
     podcast_script: Optional[List[PodcastScript]] = None
@@ -114,6 +122,7 @@ class AudioRequest(BaseModel):
     bgm_file: Optional[str] = ""
     bgm_volume: Optional[float] = 0.2
     video_source: Optional[str] = "local"
+    callback_url: Optional[str] = ""
 
 class PodcastGenerateRequest(BaseModel):
     """播客生成请求"""
@@ -146,6 +155,9 @@ class BaseResponse(BaseModel):
 class TaskVideoRequest(VideoParams, BaseModel):
     pass
 
+class TaskVideoBatchRequest(BaseModel):
+    tasks: List[TaskVideoRequest] = pydantic.Field(..., min_length=1)
+
 class TaskQueryRequest(BaseModel):
     pass
 
@@ -160,6 +172,12 @@ class TaskResponse(BaseResponse):
         task_id: str
     data: TaskResponseData
 
+class TaskBatchResponse(BaseResponse):
+    class TaskBatchResponseData(BaseModel):
+        batch_id: str
+        task_ids: List[str]
+    data: TaskBatchResponseData
+
 class TaskQueryResponse(BaseResponse):
     pass
 
@@ -181,3 +199,12 @@ class BgmRetrieveResponse(BaseResponse):
 
 class BgmUploadResponse(BaseResponse):
     pass
+
+class MaterialUploadResponse(BaseResponse):
+    class MaterialUploadResponseData(BaseModel):
+        file: str
+        duration: Optional[float] = None
+        codec: Optional[str] = None
+        width: Optional[int] = None
+        height: Optional[int] = None
+    data: MaterialUploadResponseData
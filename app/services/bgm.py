@@ -0,0 +1,283 @@
+"""
+The BGM library: the tracks of resource/songs, indexed once and kept up to date.
+
+Every track is probed once (duration, sample rate, loudness, see
+app.services.media_catalog); the listing is only rebuilt when the directory changed
+(its mtime), checked at most every bgm_watch_interval seconds. With watch(), a
+thread probes new tracks and prepares their audio in the background.
+
+A render does not decode the track: the track is decoded once, its gain adjusted to
+bgm_target_loudness (LUFS), into raw 16-bit PCM under storage/bgm_cache. The render
+memory-maps that file and slices it (looping, with the fade-out at the end of each
+pass) into a moviepy AudioClip.
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from app.config import config
+from app.models.exception import ProbeError
+from app.services import cancellation, media_catalog
+from app.services.cancellation import CancelToken
+from app.utils import utils
+
+_suffixes = (".mp3",)
+_sample_rate = 44100
+_channels = 2
+# seconds faded out at the end of each pass through a track
+_fade_out = 3
+
+
+class BgmLibrary:
+    def __init__(
+        self,
+        song_dir: str,
+        cache_dir: str,
+        target_loudness: float = -20,
+        watch_interval: float = 5,
+        cache_max_bytes: int = 0,
+        catalog: Optional[media_catalog.MediaCatalog] = None,
+    ):
+        self.song_dir = song_dir
+        self.cache_dir = cache_dir
+        self.target_loudness = target_loudness
+        self.watch_interval = watch_interval
+        self.cache_max_bytes = cache_max_bytes
+        self._catalog = catalog
+        self._lock = threading.Lock()
+        self._tracks: Dict[str, Dict] = {}
+        self._dir_mtime = None
+        self._checked_at = 0.0
+        self._watcher: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def catalog(self) -> media_catalog.MediaCatalog:
+        return self._catalog or media_catalog.catalog()
+
+    def tracks(self) -> List[Dict]:
+        """
+        {"path", "name", "size", and once probed "duration", "sample_rate", "loudness"}
+        of every track, by name.
+        """
+        self._refresh()
+        with self._lock:
+            return sorted(self._tracks.values(), key=lambda track: track["name"])
+
+    def pick(self) -> str:
+        """A random track, "" when there is none."""
+        tracks = self.tracks()
+        return random.choice(tracks)["path"] if tracks else ""
+
+    def _refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.watch_interval and self._dir_mtime is not None:
+            return
+        self._checked_at = now
+        try:
+            dir_mtime = os.stat(self.song_dir).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        if not force and dir_mtime == self._dir_mtime:
+            return
+
+        tracks = {}
+        if dir_mtime is not None:
+            with os.scandir(self.song_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.lower().endswith(_suffixes):
+                        continue
+                    path = os.path.abspath(entry.path)
+                    track = {"path": path, "name": entry.name, "size": entry.stat().st_size}
+                    indexed = self.catalog.get(path)
+                    if indexed:
+                        track.update(
+                            duration=indexed["duration"],
+                            sample_rate=indexed["sample_rate"],
+                            loudness=indexed["loudness"],
+                        )
+                    tracks[path] = track
+        with self._lock:
+            removed = set(self._tracks) - set(tracks)
+            self._tracks = tracks
+            self._dir_mtime = dir_mtime
+        for path in removed:
+            self.catalog.remove(path)
+
+    def _index(self, path: str) -> Optional[Dict]:
+        """The catalog entry of a track, probing it when missing or outdated."""
+        entry = self.catalog.get(path)
+        if entry is None or entry["kind"] != "bgm" or entry["sample_rate"] == 0:
+            try:
+                entry = self.catalog.record(path, "bgm", media_catalog.probe(path, loudness=True))
+            except ProbeError as e:
+                logger.warning(f"failed to index bgm {path}: {str(e)}")
+                return None
+        with self._lock:
+            track = self._tracks.get(path)
+            if track is not None:
+                track.update(
+                    duration=entry["duration"],
+                    sample_rate=entry["sample_rate"],
+                    loudness=entry["loudness"],
+                )
+        return entry
+
+    def pcm(self, path: str, cancel_token: Optional[CancelToken] = None) -> np.memmap:
+        """
+        The track as loudness-normalized 16-bit PCM, (frames, channels) at 44.1 kHz,
+        memory-mapped from the cache; decoded on first use (killed if cancel_token is
+        cancelled meanwhile).
+        """
+        path = os.path.abspath(path)
+        entry = self._index(path)
+        if entry is None:
+            raise ProbeError(f"not an audio file: {path}")
+        stat_result = os.stat(path)
+        key = hashlib.sha1(
+            f"{path}:{stat_result.st_size}:{stat_result.st_mtime_ns}:{self.target_loudness}".encode("utf-8")
+        ).hexdigest()
+        cache_path = os.path.join(self.cache_dir, f"{key}-{_sample_rate}-{_channels}.s16")
+        if os.path.exists(cache_path):
+            # the cache is evicted by last use
+            os.utime(cache_path)
+        else:
+            self._decode(path, entry["loudness"], cache_path, cancel_token)
+        return np.memmap(cache_path, dtype=np.int16, mode="r").reshape(-1, _channels)
+
+    def _decode(
+        self,
+        path: str,
+        loudness: Optional[float],
+        cache_path: str,
+        cancel_token: Optional[CancelToken] = None,
+    ):
+        gain = 0.0 if loudness is None else self.target_loudness - loudness
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = os.path.join(self.cache_dir, f".{uuid.uuid4().hex}.tmp")
+        cmd = [
+            media_catalog.ffmpeg_exe(), "-hide_banner", "-nostdin", "-loglevel", "error",
+            "-i", path, "-map", "0:a:0", "-af", f"volume={gain:.2f}dB",
+            "-ac", str(_channels), "-ar", str(_sample_rate), "-f", "s16le", "-y", temp_path,
+        ]
+        started = time.time()
+        try:
+            result = cancellation.run(
+                cmd, cancel_token, capture_output=True, text=True, errors="replace"
+            )
+            if result.returncode != 0 or not os.path.exists(temp_path) or not os.path.getsize(temp_path):
+                raise ProbeError(f"failed to decode {path}: {result.stderr.strip()}")
+            # another process decoding the same track at the same time writes the same bytes
+            os.replace(temp_path, cache_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logger.info(f"bgm {path} decoded in {time.time() - started:.1f}s, gain {gain:+.1f} dB")
+        self._evict(keep=cache_path)
+
+    def _evict(self, keep: str):
+        if not self.cache_max_bytes:
+            return
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".s16"):
+                    stat_result = entry.stat()
+                    files.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= self.cache_max_bytes:
+                break
+            if file == keep:
+                continue
+            try:
+                # a render that mapped it keeps reading the unlinked file
+                os.remove(file)
+                total -= size
+            except OSError:
+                # still mapped, on windows
+                pass
+
+    def clip(
+        self,
+        path: str,
+        duration: float,
+        volume: float = 1.0,
+        cancel_token: Optional[CancelToken] = None,
+    ):
+        """
+        A moviepy AudioClip of the track looped to duration seconds, scaled by volume,
+        each pass fading out over its last seconds (like AudioFadeOut before AudioLoop).
+        """
+        from moviepy import AudioClip
+
+        pcm = self.pcm(path, cancel_token)
+        frames = len(pcm)
+        fade_frames = max(1, min(_fade_out * _sample_rate, frames))
+        scale = volume / 32768
+
+        def frame_function(t):
+            index = np.round(np.asarray(t) * _sample_rate).astype(np.int64) % frames
+            gain = np.minimum(1.0, (frames - index) / fade_frames) * scale
+            return pcm[index].astype(np.float32) * gain[..., None]
+
+        return AudioClip(frame_function, duration=duration, fps=_sample_rate)
+
+    def watch(self):
+        """Index new tracks and prepare their audio in a background thread."""
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._stopping.clear()
+            self._watcher = threading.Thread(target=self._watch_loop, name="bgm-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _watch_loop(self):
+        prepared = set()
+        while not self._stopping.is_set():
+            try:
+                self._refresh()
+                for track in self.tracks():
+                    if self._stopping.is_set():
+                        break
+                    key = (track["path"], track["size"])
+                    if key in prepared:
+                        continue
+                    try:
+                        self.pcm(track["path"])
+                    except ProbeError as e:
+                        logger.warning(f"skipping bgm {track['path']}: {str(e)}")
+                    # not retried until the file changes
+                    prepared.add(key)
+            except Exception as e:
+                logger.warning(f"failed to index the bgm library: {str(e)}")
+            self._stopping.wait(self.watch_interval)
+
+
+_library: Optional[BgmLibrary] = None
+_library_lock = threading.Lock()
+
+
+def library() -> BgmLibrary:
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = BgmLibrary(
+                utils.song_dir(),
+                utils.storage_dir("bgm_cache"),
+                target_loudness=config.app.get("bgm_target_loudness", -20),
+                watch_interval=config.app.get("bgm_watch_interval", 5),
+                cache_max_bytes=config.app.get("bgm_cache_max_mb", 2048) * 1024 * 1024,
+            )
+        return _library
@@ -0,0 +1,233 @@
+"""Cooperative cancellation of running tasks.
+
+task.start creates a CancelToken for its task and passes it down to the stages,
+which call token.raise_if_cancelled() between units of work (clips, dialogue turns).
+The subprocesses they start themselves go through token.run() / token.popen(), so
+they are killed as soon as the task is cancelled; moviepy's ffmpeg writers get
+token.progress_logger(), which stops them at the next frame.
+
+The token is also passed to the render processes: cancelling writes a flag file
+into the task dir that they poll, and a task cancelled on another api node (only
+its state is shared, through redis or sqlite) is picked up from the task state.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from loguru import logger
+
+from app.models import const
+from app.models.exception import TaskCancelledError
+from app.utils import utils
+
+_flag_file = ".cancelled"
+# seconds between checks of the flag file (render processes) and of the task state
+_poll_interval = 0.5
+_state_check_interval = 1
+
+_tokens: Dict[str, "CancelToken"] = {}
+_tokens_lock = threading.Lock()
+
+
+def _flag_path(task_id: str) -> str:
+    # checked for any task id: must not create its directory
+    return os.path.join(utils.storage_dir("tasks"), task_id, _flag_file)
+
+
+class CancelToken:
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self._event = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._last_state_check = 0.0
+        self._released = threading.Event()
+
+    def __getstate__(self):
+        # a copy in a render process only sees the flag file
+        return {"task_id": self.task_id}
+
+    def __setstate__(self, state):
+        self.__init__(state["task_id"])
+
+    @property
+    def flag_file(self) -> str:
+        return _flag_path(self.task_id)
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if os.path.exists(self.flag_file):
+            self._event.set()
+            return True
+        return False
+
+    def cancel(self):
+        if not self._event.is_set():
+            self._event.set()
+            os.makedirs(os.path.dirname(self.flag_file), exist_ok=True)
+            with open(self.flag_file, "w") as f:
+                f.write(str(time.time()))
+            logger.info(f"task {self.task_id} cancelled")
+        self._kill_processes()
+
+    def raise_if_cancelled(self):
+        if not self.cancelled and time.monotonic() - self._last_state_check >= _state_check_interval:
+            self._last_state_check = time.monotonic()
+            self._check_state()
+        if self.cancelled:
+            raise TaskCancelledError(f"task {self.task_id} was cancelled")
+
+    def _check_state(self):
+        from app.services import state as sm
+
+        task = sm.state.get_task(self.task_id)
+        if task and task.get("state") == const.TASK_STATE_CANCELLED:
+            self.cancel()
+
+    @contextmanager
+    def watch(self):
+        """Kill the processes of this token once the flag file appears (render processes)."""
+        done = threading.Event()
+        poller = threading.Thread(target=self._poll, args=(done,), daemon=True)
+        poller.start()
+        try:
+            yield self
+        finally:
+            done.set()
+
+    def _poll(self, done: threading.Event):
+        # cancel() kills the processes of this process right away, the poller is for the
+        # render processes, which only see the flag file
+        while not done.wait(_poll_interval):
+            if self.cancelled:
+                self._kill_processes()
+                return
+
+    def popen(self, args, **kwargs) -> subprocess.Popen:
+        """subprocess.Popen, killed when the task is cancelled."""
+        self.raise_if_cancelled()
+        process = subprocess.Popen(args, **kwargs)
+        with self._lock:
+            self._processes = {p for p in self._processes if p.poll() is None}
+            self._processes.add(process)
+        if self.cancelled:
+            self._kill_processes()
+        return process
+
+    def run(self, args, input=None, timeout=None, check=False, **kwargs) -> subprocess.CompletedProcess:
+        """
+        subprocess.run, killed when the task is cancelled; raises TaskCancelledError
+        then instead of returning the result of the killed process.
+        """
+        if kwargs.pop("capture_output", False):
+            kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+        if input is not None:
+            kwargs["stdin"] = subprocess.PIPE
+        with self.popen(args, **kwargs) as process:
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                with self._lock:
+                    self._processes.discard(process)
+        self.raise_if_cancelled()
+        result = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+        if check:
+            result.check_returncode()
+        return result
+
+    def progress_logger(self):
+        """A proglog logger for moviepy's write_*file(logger=...), stops the write on cancel."""
+        import proglog
+
+        token = self
+
+        class _CancellingLogger(proglog.ProgressBarLogger):
+            def bars_callback(self, bar, attr, value, old_value=None):
+                token.raise_if_cancelled()
+
+        return _CancellingLogger(logged_bars=None)
+
+    def _kill_processes(self):
+        with self._lock:
+            processes, self._processes = self._processes, set()
+        for process in processes:
+            if process.poll() is None:
+                logger.info(f"task {self.task_id}: killing subprocess {process.pid}")
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+
+
+def create(task_id: str) -> CancelToken:
+    """The token of a task that is starting."""
+    token = CancelToken(task_id)
+    # left over from an earlier, cancelled run of the task (resume)
+    if os.path.exists(token.flag_file):
+        os.remove(token.flag_file)
+    with _tokens_lock:
+        _tokens[task_id] = token
+    return token
+
+
+def release(task_id: str):
+    """The task has stopped, called last by task.start."""
+    with _tokens_lock:
+        token = _tokens.pop(task_id, None)
+    if token is not None:
+        token._released.set()
+
+
+def cancel(task_id: str) -> bool:
+    """
+    Cancel a task running in this process, returns False if it is not running here.
+    Queued tasks and tasks running on other nodes stop when they see the cancelled
+    state, see CancelToken.raise_if_cancelled().
+    """
+    with _tokens_lock:
+        token = _tokens.get(task_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+
+def wait(task_id: str, timeout: Optional[float] = None) -> bool:
+    """
+    Wait for a task running in this process to stop, returns False if it is still
+    running after timeout seconds (True right away when it does not run here).
+    """
+    with _tokens_lock:
+        token = _tokens.get(task_id)
+    if token is None:
+        return True
+    return token._released.wait(timeout)
+
+
+def is_cancelled(task_id: str) -> bool:
+    with _tokens_lock:
+        token = _tokens.get(task_id)
+    if token is not None:
+        return token.cancelled
+    return os.path.exists(_flag_path(task_id))
+
+
+def run(args, cancel_token: Optional[CancelToken] = None, **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run, through cancel_token.run() when there is a token."""
+    if cancel_token is None:
+        return subprocess.run(args, **kwargs)
+    return cancel_token.run(args, **kwargs)
+
+
+def progress_logger(cancel_token: Optional[CancelToken] = None):
+    """The logger argument of moviepy's write_*file(), None (silent) without a token."""
+    return cancel_token.progress_logger() if cancel_token is not None else None
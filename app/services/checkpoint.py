@@ -0,0 +1,172 @@
+"""Stage checkpoints of a task, so a failed task can be resumed.
+
+Every stage that finishes writes an entry into the task's checkpoints.json: a hash
+of its inputs (the task params and the outputs of the stages it depends on), its
+outputs and the size of every file it produced. When the task is resumed, a stage
+is skipped and its outputs restored if its inputs hash matches and all of its files
+are still there; a stage that runs again changes its outputs, so every stage that
+depends on it runs again too.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.models.schema import PodcastScript, VideoParams
+from app.utils import utils
+
+_manifest_file = "checkpoints.json"
+
+# pydantic models that can appear in stage outputs
+_models = {
+    "PodcastScript": PodcastScript,
+}
+
+_lock = threading.Lock()
+
+
+def manifest_path(task_id: str) -> str:
+    return os.path.join(utils.task_dir(task_id), _manifest_file)
+
+
+def load_manifest(task_id: str) -> Optional[Dict[str, Any]]:
+    file = manifest_path(task_id)
+    if not os.path.exists(file):
+        return None
+    try:
+        with open(file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"invalid checkpoint manifest: {file}, {str(e)}")
+        return None
+
+
+def load_task(task_id: str):
+    """(params, stop_at) the task was started with, or None without a manifest."""
+    manifest = load_manifest(task_id)
+    if not manifest or "params" not in manifest:
+        return None
+    return VideoParams(**manifest["params"]), manifest.get("stop_at", "video")
+
+
+def _encode(value):
+    if isinstance(value, BaseModel):
+        return {"__model__": type(value).__name__, "data": value.model_dump(mode="json", warnings=False)}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    # e.g. the edge tts SubMaker, only needed by the stages right after it
+    return None
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        if value.get("__model__") in _models:
+            return _models[value["__model__"]](**value["data"])
+        return {k: _decode(v) for k, v in value.items()}
+    return value
+
+
+def _files(value) -> Dict[str, int]:
+    """Files referenced by the outputs, with their size."""
+    files = {}
+    if isinstance(value, str):
+        if value and os.path.isfile(value):
+            files[value] = os.path.getsize(value)
+    elif isinstance(value, list):
+        for v in value:
+            files.update(_files(v))
+    elif isinstance(value, dict):
+        for v in value.values():
+            files.update(_files(v))
+    return files
+
+
+def _digest(data) -> str:
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+class Checkpoints:
+    def __init__(self, task_id: str, params: VideoParams, stop_at: str, resume: bool = False):
+        self.task_id = task_id
+        self.resume = resume
+        self.params = params.model_dump(mode="json", warnings=False)
+        self.stop_at = stop_at
+        manifest = load_manifest(task_id) if resume else None
+        self.stages = (manifest or {}).get("stages", {})
+        self._save()
+
+    def wrap(
+        self,
+        name: str,
+        func: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+        inputs: Sequence[str],
+    ) -> Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        def run(context):
+            inputs_hash = _digest(
+                {
+                    "stage": name,
+                    "params": self.params,
+                    "inputs": [self.stages.get(dep, {}).get("digest") for dep in inputs],
+                }
+            )
+            if self.resume:
+                outputs = self._restore(name, inputs_hash)
+                if outputs is not None:
+                    logger.info(f"task {self.task_id}: stage {name} restored from checkpoint")
+                    return outputs
+
+            outputs = func(context)
+            if outputs is not None:
+                self._record(name, inputs_hash, outputs)
+            return outputs
+
+        return run
+
+    def _restore(self, name: str, inputs_hash: str):
+        entry = self.stages.get(name)
+        if not entry or entry.get("inputs") != inputs_hash:
+            return None
+        for file, size in entry.get("files", {}).items():
+            if not os.path.isfile(file) or os.path.getsize(file) != size:
+                logger.info(f"task {self.task_id}: stage {name} output changed: {file}")
+                return None
+        return _decode(entry["outputs"])
+
+    def _record(self, name: str, inputs_hash: str, outputs: Dict[str, Any]):
+        encoded = _encode(outputs)
+        files = _files(encoded)
+        with _lock:
+            self.stages[name] = {
+                "inputs": inputs_hash,
+                # a regenerated file under the same path still invalidates the dependent stages
+                "digest": _digest({"outputs": encoded, "files": files}),
+                "outputs": encoded,
+                "files": files,
+            }
+        self._save()
+
+    def _save(self):
+        with _lock:
+            manifest = {
+                "params": self.params,
+                "stop_at": self.stop_at,
+                "stages": self.stages,
+            }
+            file = manifest_path(self.task_id)
+            tmp_file = f"{file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, file)
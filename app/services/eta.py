@@ -0,0 +1,90 @@
+"""Estimated start and finish of new tasks, for admission control.
+
+Every pipeline stage that runs records how long it took (see task._timed). A
+stage is estimated by the median of its recent durations, a task by the longest
+chain of dependent stages up to its target stage, since independent stages
+overlap. The wait of a new task assumes the queue ahead of it runs first, on
+all the workers.
+"""
+
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Sequence
+
+from app.services import state as sm
+
+# seconds, until enough tasks ran to know better
+_default_stage_durations = {
+    "script": 15,
+    "terms": 5,
+    "audio": 20,
+    "subtitle": 5,
+    "materials": 30,
+    "render": 120,
+}
+# the recorded durations are read from the state store at most this often
+_cache_ttl = 10
+
+_cache = (0.0, {})
+_cache_lock = threading.Lock()
+
+
+def stage_durations() -> Dict[str, float]:
+    """stage => estimated seconds."""
+    global _cache
+    now = time.monotonic()
+    with _cache_lock:
+        expires, durations = _cache
+        if expires > now:
+            return durations
+
+    durations = dict(_default_stage_durations)
+    for stage, samples in sm.state.get_durations().items():
+        if samples:
+            durations[stage] = statistics.median(samples)
+    with _cache_lock:
+        _cache = (now + _cache_ttl, durations)
+    return durations
+
+
+def task_duration(
+    target: str,
+    stage_inputs: Dict[str, Sequence[str]],
+    durations: Optional[Dict[str, float]] = None,
+) -> float:
+    """Seconds to run target and the stages it depends on."""
+    if durations is None:
+        durations = stage_durations()
+    finish = {}
+
+    def finish_at(stage):
+        if stage not in finish:
+            inputs = stage_inputs.get(stage, [])
+            finish[stage] = durations.get(stage, 0) + max(
+                (finish_at(dep) for dep in inputs), default=0
+            )
+        return finish[stage]
+
+    return finish_at(target)
+
+
+def queue_wait(queued: int, running: int, concurrency: int, duration: float) -> float:
+    """
+    Seconds until a task queued now starts, when queued tasks wait ahead of it,
+    running tasks are running, every one of them takes duration seconds and
+    concurrency tasks run at a time. Running tasks are assumed half done.
+    """
+    concurrency = max(1, concurrency)
+    # tasks that have to finish before a worker is free for the new one
+    ahead = queued + running - concurrency + 1
+    if ahead <= 0:
+        return 0.0
+    return (ahead - 0.5) * duration / concurrency
+
+
+def timestamp(seconds_from_now: float) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds_from_now)).isoformat(
+        timespec="seconds"
+    )
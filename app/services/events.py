@@ -0,0 +1,230 @@
+"""Task events, pushed to the clients following a task (GET /tasks/{task_id}/events).
+
+A "state" event is published on every state update of a task (see app.services.state),
+a "log" event for every line logged while the task runs (logger.contextualize(task_id=...)).
+
+Events are dispatched to the subscribers in this process. With enable_redis they are
+published on a Redis channel per task instead: every api node receives them through
+one pattern subscription and dispatches them to its own subscribers, whichever node
+runs the task. The log lines are then published in batches by a background thread,
+logging never waits for Redis.
+
+start() registers the log sink and stop() removes it and stops the threads, from the
+startup and shutdown of the api (app.asgi) and of worker.py.
+"""
+
+import asyncio
+import json
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from loguru import logger
+
+from app.config import config
+
+_channel_prefix = "task_events:"
+# events buffered per client, a client that does not keep up misses the ones beyond
+_max_queued_events = 1000
+# log events waiting to be published to redis, lines beyond are dropped
+_max_queued_logs = 10000
+_log_batch_size = 100
+
+_subscribers: Dict[str, Set["Subscription"]] = {}
+_lock = threading.Lock()
+_redis = None
+_listener: Optional[threading.Thread] = None
+_log_publisher: Optional[threading.Thread] = None
+_log_queue: "queue.Queue" = queue.Queue(maxsize=_max_queued_logs)
+_sink_id: Optional[int] = None
+_stopping = threading.Event()
+
+
+def channel(task_id: str) -> str:
+    return f"{_channel_prefix}{task_id}"
+
+
+def encode(event: str, data: dict, default: Callable = str) -> str:
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False, default=default)
+
+
+class Subscription:
+    """The events of one task for one client, delivered to an asyncio queue of its event loop."""
+
+    def __init__(self, task_id: str, loop: asyncio.AbstractEventLoop):
+        self.task_id = task_id
+        self.queue = asyncio.Queue(maxsize=_max_queued_events)
+        self.dropped = 0
+        self._loop = loop
+
+    def deliver(self, message: str):
+        # called from any thread
+        try:
+            self._loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # the event loop is closed
+            pass
+
+    def _put(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def close(self):
+        with _lock:
+            subscribers = _subscribers.get(self.task_id)
+            if subscribers:
+                subscribers.discard(self)
+                if not subscribers:
+                    del _subscribers[self.task_id]
+
+
+def subscribe(task_id: str) -> Subscription:
+    """Follow the events of a task, from a coroutine; close() the subscription when done."""
+    subscription = Subscription(task_id, asyncio.get_running_loop())
+    with _lock:
+        _subscribers.setdefault(task_id, set()).add(subscription)
+    if _redis_client() is not None:
+        _start_listener()
+    return subscription
+
+
+def has_subscribers(task_id: str) -> bool:
+    with _lock:
+        return task_id in _subscribers
+
+
+def publish(task_id: str, event: str, data: dict, default: Callable = str):
+    client = _redis_client()
+    if client is None:
+        if has_subscribers(task_id):
+            _dispatch(task_id, encode(event, data, default))
+        return
+    client.publish(channel(task_id), encode(event, data, default))
+
+
+def _dispatch(task_id: str, message: str):
+    with _lock:
+        subscribers = list(_subscribers.get(task_id, ()))
+    for subscription in subscribers:
+        subscription.deliver(message)
+
+
+def _redis_client():
+    global _redis
+    if _redis is None and config.app.get("enable_redis", False):
+        import redis
+
+        _redis = redis.Redis(
+            host=config.app.get("redis_host", "localhost"),
+            port=config.app.get("redis_port", 6379),
+            db=config.app.get("redis_db", 0),
+            password=config.app.get("redis_password", None),
+        )
+    return _redis
+
+
+def _start_listener():
+    global _listener
+    with _lock:
+        if _stopping.is_set() or (_listener is not None and _listener.is_alive()):
+            return
+        _listener = threading.Thread(target=_listen, name="task-events", daemon=True)
+        _listener.start()
+
+
+def _listen():
+    while not _stopping.is_set():
+        pubsub = None
+        try:
+            pubsub = _redis_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(f"{_channel_prefix}*")
+            while not _stopping.is_set():
+                # a timeout, so stop() is noticed
+                message = pubsub.get_message(timeout=1)
+                if not message or message["type"] != "pmessage":
+                    continue
+                task_id = message["channel"].decode("utf-8")[len(_channel_prefix):]
+                _dispatch(task_id, message["data"].decode("utf-8"))
+        except Exception as e:
+            logger.warning(f"task events subscription failed, reconnecting: {str(e)}")
+            _stopping.wait(1)
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+
+def _publish_logs():
+    while not _stopping.is_set() or not _log_queue.empty():
+        try:
+            batch: List = [_log_queue.get(timeout=1)]
+        except queue.Empty:
+            continue
+        while len(batch) < _log_batch_size:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            pipe = _redis_client().pipeline(transaction=False)
+            for task_id, message in batch:
+                pipe.publish(channel(task_id), message)
+            pipe.execute()
+        except Exception as e:
+            # not logged with a task_id, which would feed the sink again
+            logger.warning(f"failed to publish {len(batch)} task log events: {str(e)}")
+
+
+def _log_sink(message):
+    record = message.record
+    try:
+        task_id = record["extra"]["task_id"]
+        data = {
+            "time": record["time"].isoformat(timespec="seconds"),
+            "level": record["level"].name,
+            "message": record["message"],
+        }
+        if _redis_client() is None:
+            publish(task_id, "log", data)
+        else:
+            _log_queue.put_nowait((task_id, encode("log", data)))
+    except Exception:
+        # never log from the log sink, a full queue drops the line
+        pass
+
+
+def start():
+    """Push the lines logged by the tasks to their subscribers, until stop()."""
+    global _sink_id, _log_publisher
+    with _lock:
+        if _sink_id is not None:
+            return
+        _stopping.clear()
+        _sink_id = logger.add(
+            _log_sink,
+            level=config.app.get("task_event_log_level", "INFO"),
+            filter=lambda record: "task_id" in record["extra"],
+        )
+    if _redis_client() is not None:
+        _log_publisher = threading.Thread(
+            target=_publish_logs, name="task-log-events", daemon=True
+        )
+        _log_publisher.start()
+
+
+def stop(timeout: float = 5):
+    """Remove the log sink, publish the log lines still queued and stop the redis listener."""
+    global _sink_id
+    with _lock:
+        if _sink_id is not None:
+            logger.remove(_sink_id)
+            _sink_id = None
+        _stopping.set()
+        threads = [t for t in (_log_publisher, _listener) if t is not None]
+    for thread in threads:
+        thread.join(timeout)
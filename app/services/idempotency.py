@@ -0,0 +1,95 @@
+"""Deduplication of task creation requests.
+
+A request with an Idempotency-Key header is bound to the task it created for
+idempotency_ttl seconds: a retry gets the same task id back, whatever the task's
+state. Independently, requests with the same normalized params (and stop_at) are
+coalesced while the first task is still running, so retries without a key do not
+render the same video twice.
+
+Both keys are scoped to the tenant (FairScheduler.tenant_id of the x-api-key): a
+request never attaches to the task of another API key.
+"""
+
+import hashlib
+import json
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.config import config
+from app.models import const
+from app.models.exception import IdempotencyKeyReusedError
+from app.services import state as sm
+
+
+def fingerprint(params: BaseModel, stop_at: str) -> str:
+    data = params.model_dump(mode="json", warnings=False)
+    normalized = {
+        k: v.strip() if isinstance(v, str) else v for k, v in data.items()
+    }
+    return hashlib.sha256(
+        json.dumps([stop_at, normalized], sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def _claim(key: str, task_id: str, params_hash: str, finished_too: bool) -> Optional[str]:
+    """None once key is bound to task_id, else the task id key is already bound to."""
+    ttl = config.app.get("idempotency_ttl", 86400)
+    value = f"{task_id} {params_hash}"
+    for _ in range(3):
+        stored = sm.state.claim_key(key, value, ttl)
+        if stored is None:
+            return None
+        stored_id, _, stored_hash = stored.partition(" ")
+        if stored_hash != params_hash:
+            raise IdempotencyKeyReusedError(
+                "the Idempotency-Key was used for a request with different parameters"
+            )
+        task = sm.state.get_task(stored_id)
+        if task and (finished_too or task.get("state") == const.TASK_STATE_PROCESSING):
+            return stored_id
+        # the task finished, or was deleted: the key is free again
+        sm.state.release_key(key, stored)
+    return None
+
+
+def claim(
+    task_id: str,
+    params: BaseModel,
+    stop_at: str,
+    idempotency_key: str = "",
+    tenant: str = "",
+) -> Tuple[Optional[str], List[str]]:
+    """
+    Returns (the id of the existing task of the same tenant to attach to or None, the
+    keys claimed for task_id), the keys must be released if the task cannot be queued.
+    """
+    params_hash = fingerprint(params, stop_at)
+    claimed = []
+    if idempotency_key:
+        key = f"{tenant}:request:{idempotency_key}"
+        existing = _claim(key, task_id, params_hash, finished_too=True)
+        if existing:
+            logger.info(f"Idempotency-Key {idempotency_key} already used by task {existing}")
+            return existing, []
+        claimed.append(key)
+
+    if config.app.get("coalesce_duplicate_tasks", True):
+        key = f"{tenant}:params:{params_hash}"
+        existing = _claim(key, task_id, params_hash, finished_too=False)
+        if existing:
+            logger.info(f"same request as the running task {existing}, attaching to it")
+            if claimed:
+                # a retry with the same Idempotency-Key must get the same task
+                release(task_id, params, stop_at, claimed)
+                _claim(claimed[0], existing, params_hash, finished_too=True)
+            return existing, []
+        claimed.append(key)
+    return None, claimed
+
+
+def release(task_id: str, params: BaseModel, stop_at: str, keys: List[str]):
+    value = f"{task_id} {fingerprint(params, stop_at)}"
+    for key in keys:
+        sm.state.release_key(key, value)
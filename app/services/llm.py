@@ -1,96 +1,251 @@
+import asyncio
+import contextvars
 import json
 from app.models.schema import PodcastScript
 import logging
 import re
 import requests
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, List, Tuple
 
 import g4f
 from loguru import logger
-from openai import AzureOpenAI, OpenAI
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
 from openai.types.chat import ChatCompletion
 
 from app.config import config
+from app.services import llm_cache, llm_health
+from app.services.llm_client import registry
+from app.services.llm_json import JsonArrayStreamParser, extract_json
 
 _max_retries = 5
+# invalid JSON answers are fixed with a short repair prompt before regenerating
+_max_repair_attempts = 2
 
 
-def _generate_response(prompt: str) -> str:
+class _CallBudget:
+    """
+    The llm calls left for one result (app.llm_max_calls), shared by its regenerations
+    and the repairs of their answers, so retries inside retries cannot multiply.
+    """
+
+    def __init__(self, calls: int = None):
+        self.left = config.app.get("llm_max_calls", 6) if calls is None else calls
+
+    def take(self) -> bool:
+        if self.left <= 0:
+            return False
+        self.left -= 1
+        return True
+
+
+def _get_provider_config(llm_provider: str) -> dict:
+    """Resolve the model, endpoint and credentials of an llm provider from config."""
+    api_key = ""
+    model_name = ""
+    base_url = ""
+    api_version = ""  # for azure
+    secret_key = ""  # for ernie
+    account_id = ""  # for cloudflare
+    if llm_provider == "g4f":
+        model_name = config.app.get("g4f_model_name", "")
+        if not model_name:
+            model_name = "gpt-3.5-turbo-16k-0613"
+    elif llm_provider == "moonshot":
+        api_key = config.app.get("moonshot_api_key")
+        model_name = config.app.get("moonshot_model_name")
+        base_url = "https://api.moonshot.cn/v1"
+    elif llm_provider == "ollama":
+        # api_key = config.app.get("openai_api_key")
+        api_key = "ollama"  # any string works but you are required to have one
+        model_name = config.app.get("ollama_model_name")
+        base_url = config.app.get("ollama_base_url", "")
+        if not base_url:
+            base_url = "http://localhost:11434/v1"
+    elif llm_provider == "openai":
+        api_key = config.app.get("openai_api_key")
+        model_name = config.app.get("openai_model_name")
+        base_url = config.app.get("openai_base_url", "")
+        if not base_url:
+            base_url = "https://api.openai.com/v1"
+    elif llm_provider == "oneapi":
+        api_key = config.app.get("oneapi_api_key")
+        model_name = config.app.get("oneapi_model_name")
+        base_url = config.app.get("oneapi_base_url", "")
+    elif llm_provider == "azure":
+        api_key = config.app.get("azure_api_key")
+        model_name = config.app.get("azure_model_name")
+        base_url = config.app.get("azure_base_url", "")
+        api_version = config.app.get("azure_api_version", "2024-02-15-preview")
+    elif llm_provider == "gemini":
+        api_key = config.app.get("gemini_api_key")
+        model_name = config.app.get("gemini_model_name")
+        base_url = "***"
+    elif llm_provider == "qwen":
+        api_key = config.app.get("qwen_api_key")
+        model_name = config.app.get("qwen_model_name")
+        base_url = "***"
+    elif llm_provider == "cloudflare":
+        api_key = config.app.get("cloudflare_api_key")
+        model_name = config.app.get("cloudflare_model_name")
+        account_id = config.app.get("cloudflare_account_id")
+        base_url = "***"
+    elif llm_provider == "deepseek":
+        api_key = config.app.get("deepseek_api_key")
+        model_name = config.app.get("deepseek_model_name")
+        base_url = config.app.get("deepseek_base_url")
+        if not base_url:
+            base_url = "https://api.deepseek.com"
+    elif llm_provider == "ernie":
+        api_key = config.app.get("ernie_api_key")
+        secret_key = config.app.get("ernie_secret_key")
+        base_url = config.app.get("ernie_base_url")
+        model_name = "***"
+        if not secret_key:
+            raise ValueError(
+                f"{llm_provider}: secret_key is not set, please set it in the config.toml file."
+            )
+    elif llm_provider == "pollinations":
+        base_url = config.app.get("pollinations_base_url", "")
+        if not base_url:
+            base_url = "https://text.pollinations.ai/openai"
+        model_name = config.app.get("pollinations_model_name", "openai-fast")
+
+    return {
+        "api_key": api_key,
+        "model_name": model_name,
+        "base_url": base_url,
+        "api_version": api_version,
+        "secret_key": secret_key,
+        "account_id": account_id,
+    }
+
+
+def _validate_provider_config(llm_provider: str, provider_config: dict):
+    if llm_provider in ["pollinations", "ollama"]:  # Skip validation for providers that don't require API key
+        return
+    if not provider_config["api_key"]:
+        raise ValueError(
+            f"{llm_provider}: api_key is not set, please set it in the config.toml file."
+        )
+    if not provider_config["model_name"]:
+        raise ValueError(
+            f"{llm_provider}: model_name is not set, please set it in the config.toml file."
+        )
+    if not provider_config["base_url"]:
+        raise ValueError(
+            f"{llm_provider}: base_url is not set, please set it in the config.toml file."
+        )
+
+
+def _get_http_session(llm_provider: str) -> requests.Session:
+    # one keep-alive session per provider for the plain HTTP providers
+    return registry.get_client(("requests", llm_provider), requests.Session)
+
+
+def _get_openai_client(llm_provider: str, api_key: str, base_url: str, api_version: str = ""):
+    key = (llm_provider, base_url, api_key, api_version)
+    if llm_provider == "azure":
+        return registry.get_client(
+            key,
+            lambda: AzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=base_url,
+            ),
+        )
+    return registry.get_client(
+        key,
+        lambda: OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+        ),
+    )
+
+
+def _get_async_openai_client(llm_provider: str, api_key: str, base_url: str, api_version: str = ""):
+    key = (llm_provider, base_url, api_key, api_version)
+    if llm_provider == "azure":
+        return registry.get_async_client(
+            key,
+            lambda: AsyncAzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=base_url,
+            ),
+        )
+    return registry.get_async_client(
+        key,
+        lambda: AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+        ),
+    )
+
+
+def _get_ernie_access_token(api_key: str, secret_key: str) -> str:
+    def fetch():
+        response = _get_http_session("ernie").post(
+            "https://aip.baidubce.com/oauth/2.0/token",
+            params={
+                "grant_type": "client_credentials",
+                "client_id": api_key,
+                "client_secret": secret_key,
+            },
+        )
+        result = response.json()
+        return result.get("access_token"), result.get("expires_in", 0)
+
+    return registry.get_token(("ernie", api_key, secret_key), fetch)
+
+
+# providers whose chat completions API supports response_format={"type": "json_object"}
+_json_mode_providers = ["openai", "azure", "deepseek", "moonshot", "ollama"]
+
+
+def _json_mode_request(llm_provider: str, prompt: str, json_mode: bool) -> Tuple[str, dict]:
+    """
+    Return the (prompt, extra create() kwargs) for a JSON answer. JSON mode only allows
+    an object at the top level, so the prompt asks for the array under an "items" key;
+    extract_json unwraps it again.
+    """
+    if (
+        not json_mode
+        or llm_provider not in _json_mode_providers
+        or not config.app.get("llm_json_mode", True)
+    ):
+        return prompt, {}
+    prompt = f'{prompt}\n\nReturn a JSON object of the form {{"items": <the JSON array described above>}}.'
+    return prompt, {"response_format": {"type": "json_object"}}
+
+
+def _format_content(content: str, strip_newlines: bool) -> str:
+    # plain text answers are joined into one line, JSON answers keep their newlines
+    return content.replace("\n", "") if strip_newlines else content
+
+
+def _generate_provider_response(
+    llm_provider: str, prompt: str, strip_newlines: bool = True, json_mode: bool = False
+) -> str:
     try:
         content = ""
-        llm_provider = config.app.get("llm_provider", "openai")
         logger.info(f"llm provider: {llm_provider}")
+        provider_config = _get_provider_config(llm_provider)
+        api_key = provider_config["api_key"]
+        model_name = provider_config["model_name"]
+        base_url = provider_config["base_url"]
+        api_version = provider_config["api_version"]
         if llm_provider == "g4f":
-            model_name = config.app.get("g4f_model_name", "")
-            if not model_name:
-                model_name = "gpt-3.5-turbo-16k-0613"
             content = g4f.ChatCompletion.create(
                 model=model_name,
                 messages=[{"role": "user", "content": prompt}],
             )
         else:
-            api_version = ""  # for azure
-            if llm_provider == "moonshot":
-                api_key = config.app.get("moonshot_api_key")
-                model_name = config.app.get("moonshot_model_name")
-                base_url = "https://api.moonshot.cn/v1"
-            elif llm_provider == "ollama":
-                # api_key = config.app.get("openai_api_key")
-                api_key = "ollama"  # any string works but you are required to have one
-                model_name = config.app.get("ollama_model_name")
-                base_url = config.app.get("ollama_base_url", "")
-                if not base_url:
-                    base_url = "http://localhost:11434/v1"
-            elif llm_provider == "openai":
-                api_key = config.app.get("openai_api_key")
-                model_name = config.app.get("openai_model_name")
-                base_url = config.app.get("openai_base_url", "")
-                if not base_url:
-                    base_url = "https://api.openai.com/v1"
-            elif llm_provider == "oneapi":
-                api_key = config.app.get("oneapi_api_key")
-                model_name = config.app.get("oneapi_model_name")
-                base_url = config.app.get("oneapi_base_url", "")
-            elif llm_provider == "azure":
-                api_key = config.app.get("azure_api_key")
-                model_name = config.app.get("azure_model_name")
-                base_url = config.app.get("azure_base_url", "")
-                api_version = config.app.get("azure_api_version", "2024-02-15-preview")
-            elif llm_provider == "gemini":
-                api_key = config.app.get("gemini_api_key")
-                model_name = config.app.get("gemini_model_name")
-                base_url = "***"
-            elif llm_provider == "qwen":
-                api_key = config.app.get("qwen_api_key")
-                model_name = config.app.get("qwen_model_name")
-                base_url = "***"
-            elif llm_provider == "cloudflare":
-                api_key = config.app.get("cloudflare_api_key")
-                model_name = config.app.get("cloudflare_model_name")
-                account_id = config.app.get("cloudflare_account_id")
-                base_url = "***"
-            elif llm_provider == "deepseek":
-                api_key = config.app.get("deepseek_api_key")
-                model_name = config.app.get("deepseek_model_name")
-                base_url = config.app.get("deepseek_base_url")
-                if not base_url:
-                    base_url = "https://api.deepseek.com"
-            elif llm_provider == "ernie":
-                api_key = config.app.get("ernie_api_key")
-                secret_key = config.app.get("ernie_secret_key")
-                base_url = config.app.get("ernie_base_url")
-                model_name = "***"
-                if not secret_key:
-                    raise ValueError(
-                        f"{llm_provider}: secret_key is not set, please set it in the config.toml file."
-                    )
-            elif llm_provider == "pollinations":
+            if llm_provider == "pollinations":
                 try:
-                    base_url = config.app.get("pollinations_base_url", "")
-                    if not base_url:
-                        base_url = "https://text.pollinations.ai/openai"
-                    model_name = config.app.get("pollinations_model_name", "openai-fast")
-                   
                     # Prepare the payload
                     payload = {
                         "model": model_name,
@@ -111,13 +266,15 @@ def _generate_response(prompt: str) -> str:
                     }
                     
                     # Make the API request
-                    response = requests.post(base_url, headers=headers, json=payload)
+                    response = _get_http_session(llm_provider).post(
+                        base_url, headers=headers, json=payload
+                    )
                     response.raise_for_status()
                     result = response.json()
                     
                     if result and "choices" in result and len(result["choices"]) > 0:
                         content = result["choices"][0]["message"]["content"]
-                        return content.replace("\n", "")
+                        return _format_content(content, strip_newlines)
                     else:
                         raise Exception(f"[{llm_provider}] returned an invalid response format")
                         
@@ -126,19 +283,7 @@ def _generate_response(prompt: str) -> str:
                 except Exception as e:
                     raise Exception(f"[{llm_provider}] error: {str(e)}")
 
-            if llm_provider not in ["pollinations", "ollama"]:  # Skip validation for providers that don't require API key
-                if not api_key:
-                    raise ValueError(
-                        f"{llm_provider}: api_key is not set, please set it in the config.toml file."
-                    )
-                if not model_name:
-                    raise ValueError(
-                        f"{llm_provider}: model_name is not set, please set it in the config.toml file."
-                    )
-                if not base_url:
-                    raise ValueError(
-                        f"{llm_provider}: base_url is not set, please set it in the config.toml file."
-                    )
+            _validate_provider_config(llm_provider, provider_config)
 
             if llm_provider == "qwen":
                 import dashscope
@@ -157,7 +302,7 @@ def _generate_response(prompt: str) -> str:
                             )
 
                         content = response["output"]["text"]
-                        return content.replace("\n", "")
+                        return _format_content(content, strip_newlines)
                     else:
                         raise Exception(
                             f'[{llm_provider}] returned an invalid response: "{response}"'
@@ -168,38 +313,43 @@ def _generate_response(prompt: str) -> str:
             if llm_provider == "gemini":
                 import google.generativeai as genai
 
-                genai.configure(api_key=api_key, transport="rest")
+                def create_gemini_model():
+                    genai.configure(api_key=api_key, transport="rest")
 
-                generation_config = {
-                    "temperature": 0.5,
-                    "top_p": 1,
-                    "top_k": 1,
-                    "max_output_tokens": 2048,
-                }
+                    generation_config = {
+                        "temperature": 0.5,
+                        "top_p": 1,
+                        "top_k": 1,
+                        "max_output_tokens": 2048,
+                    }
 
-                safety_settings = [
-                    {
-                        "category": "HARM_CATEGORY_HARASSMENT",
-                        "threshold": "BLOCK_ONLY_HIGH",
-                    },
-                    {
-                        "category": "HARM_CATEGORY_HATE_SPEECH",
-                        "threshold": "BLOCK_ONLY_HIGH",
-                    },
-                    {
-                        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        "threshold": "BLOCK_ONLY_HIGH",
-                    },
-                    {
-                        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                        "threshold": "BLOCK_ONLY_HIGH",
-                    },
-                ]
+                    safety_settings = [
+                        {
+                            "category": "HARM_CATEGORY_HARASSMENT",
+                            "threshold": "BLOCK_ONLY_HIGH",
+                        },
+                        {
+                            "category": "HARM_CATEGORY_HATE_SPEECH",
+                            "threshold": "BLOCK_ONLY_HIGH",
+                        },
+                        {
+                            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                            "threshold": "BLOCK_ONLY_HIGH",
+                        },
+                        {
+                            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+                            "threshold": "BLOCK_ONLY_HIGH",
+                        },
+                    ]
+
+                    return genai.GenerativeModel(
+                        model_name=model_name,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                    )
 
-                model = genai.GenerativeModel(
-                    model_name=model_name,
-                    generation_config=generation_config,
-                    safety_settings=safety_settings,
+                model = registry.get_client(
+                    (llm_provider, model_name, api_key), create_gemini_model
                 )
 
                 try:
@@ -212,7 +362,8 @@ def _generate_response(prompt: str) -> str:
                 return generated_text
 
             if llm_provider == "cloudflare":
-                response = requests.post(
+                account_id = provider_config["account_id"]
+                response = _get_http_session(llm_provider).post(
                     f"https://api.cloudflare.com/client/v4/accounts/{account_id}/ai/run/{model_name}",
                     headers={"Authorization": f"Bearer {api_key}"},
                     json={
@@ -230,15 +381,9 @@ def _generate_response(prompt: str) -> str:
                 return result["result"]["response"]
 
             if llm_provider == "ernie":
-                response = requests.post(
-                    "https://aip.baidubce.com/oauth/2.0/token", 
-                    params={
-                        "grant_type": "client_credentials",
-                        "client_id": api_key,
-                        "client_secret": secret_key,
-                    }
+                access_token = _get_ernie_access_token(
+                    api_key, provider_config["secret_key"]
                 )
-                access_token = response.json().get("access_token")
                 url = f"{base_url}?access_token={access_token}"
 
                 payload = json.dumps(
@@ -254,25 +399,21 @@ def _generate_response(prompt: str) -> str:
                 )
                 headers = {"Content-Type": "application/json"}
 
-                response = requests.request(
+                response = _get_http_session(llm_provider).request(
                     "POST", url, headers=headers, data=payload
                 ).json()
+                # 110/111: access token invalid or expired, fetch a new one next time
+                if response.get("error_code") in (110, 111):
+                    registry.invalidate_token(
+                        ("ernie", api_key, provider_config["secret_key"])
+                    )
                 return response.get("result")
 
-            if llm_provider == "azure":
-                client = AzureOpenAI(
-                    api_key=api_key,
-                    api_version=api_version,
-                    azure_endpoint=base_url,
-                )
-            else:
-                client = OpenAI(
-                    api_key=api_key,
-                    base_url=base_url,
-                )
+            client = _get_openai_client(llm_provider, api_key, base_url, api_version)
 
+            prompt, json_kwargs = _json_mode_request(llm_provider, prompt, json_mode)
             response = client.chat.completions.create(
-                model=model_name, messages=[{"role": "user", "content": prompt}]
+                model=model_name, messages=[{"role": "user", "content": prompt}], **json_kwargs
             )
             if response:
                 if isinstance(response, ChatCompletion):
@@ -287,13 +428,408 @@ def _generate_response(prompt: str) -> str:
                     f"[{llm_provider}] returned an empty response, please check your network connection and try again."
                 )
 
-        return content.replace("\n", "")
+        return _format_content(content, strip_newlines)
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def _get_provider_chain() -> List[str]:
+    """
+    The configured llm_provider followed by app.llm_fallback_providers, ordered so
+    that providers with an open circuit are only tried last.
+    """
+    llm_provider = config.app.get("llm_provider", "openai")
+    providers = [llm_provider]
+    for fallback in config.app.get("llm_fallback_providers", []):
+        if fallback not in providers:
+            providers.append(fallback)
+    return llm_health.health.order(providers)
+
+
+def _is_valid_content(content: str) -> bool:
+    return bool(content) and not content.startswith("Error: ")
+
+
+def _call_provider(llm_provider: str, prompt: str, strip_newlines: bool, json_mode: bool) -> str:
+    start = time.monotonic()
+    content = _generate_provider_response(llm_provider, prompt, strip_newlines, json_mode)
+    if _is_valid_content(content):
+        llm_health.health.record_success(llm_provider, time.monotonic() - start)
+    else:
+        llm_health.health.record_failure(llm_provider)
+        content = content or f"Error: [{llm_provider}] returned an empty response"
+    return content
+
+
+# the provider whose answer the last _generate_response (or its async and streamed
+# variants) of this context returned: the cache entry of the answer is keyed on it
+_answered_by: contextvars.ContextVar[str] = contextvars.ContextVar("llm_answered_by", default="")
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    # the providers without an async SDK, when hedged; bounds the abandoned requests
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=max(1, config.app.get("llm_hedge_workers", 8)),
+                thread_name_prefix="llm-hedge",
+            )
+        return _hedge_executor
+
+
+def _generate_response(prompt: str, strip_newlines: bool = True, json_mode: bool = False) -> str:
+    """
+    Ask the provider chain for an answer, failing over to the next provider on error.
+
+    With app.llm_hedging enabled, a request that takes longer than the provider's
+    p95 latency is hedged: the next provider is asked as well and the first valid
+    answer wins. The slower request is cancelled (see _generate_hedged_response).
+    """
+    _answered_by.set("")
+    providers = _get_provider_chain()
+    if len(providers) > 1 and config.app.get("llm_hedging", False):
+        return _generate_hedged_response(providers, prompt, strip_newlines, json_mode)
+
+    content = ""
+    for llm_provider in providers:
+        content = _call_provider(llm_provider, prompt, strip_newlines, json_mode)
+        if _is_valid_content(content):
+            _answered_by.set(llm_provider)
+            return content
+        logger.warning(f"llm provider {llm_provider} failed: {content}")
+    return content
+
+
+def _generate_hedged_response(
+    providers: List[str], prompt: str, strip_newlines: bool, json_mode: bool
+) -> str:
+    """
+    The hedged chain runs on the loop of the async clients, so the losing request is
+    cancelled: an OpenAI-compatible request is aborted. The providers with a sync SDK
+    only cannot be interrupted, they run on the llm_hedge_workers threads of the hedge
+    pool and a losing one is abandoned there.
+    """
+    # the chain's task copies this context, e.g. the task_id the lines are logged with
+    future = asyncio.run_coroutine_threadsafe(
+        _agenerate_chain_response(
+            providers, prompt, strip_newlines, json_mode, executor=_get_hedge_executor()
+        ),
+        registry.loop(),
+    )
+    llm_provider, content = future.result()
+    if _is_valid_content(content):
+        _answered_by.set(llm_provider)
+    return content
+
+
+# providers served through the OpenAI-compatible chat completions API
+_openai_compatible_providers = ["openai", "moonshot", "ollama", "oneapi", "azure", "deepseek"]
+
+
+async def _agenerate_openai_response(
+    llm_provider: str, prompt: str, strip_newlines: bool = True, json_mode: bool = False
+) -> str:
+    try:
+        provider_config = _get_provider_config(llm_provider)
+        _validate_provider_config(llm_provider, provider_config)
+        client = _get_async_openai_client(
+            llm_provider,
+            provider_config["api_key"],
+            provider_config["base_url"],
+            provider_config["api_version"],
+        )
+        prompt, json_kwargs = _json_mode_request(llm_provider, prompt, json_mode)
+        # on the loop the pooled client lives on, see LLMClientRegistry.run
+        response = await registry.run(
+            client.chat.completions.create(
+                model=provider_config["model_name"],
+                messages=[{"role": "user", "content": prompt}],
+                **json_kwargs,
+            )
+        )
+        if not response:
+            raise Exception(
+                f"[{llm_provider}] returned an empty response, please check your network connection and try again."
+            )
+        if not isinstance(response, ChatCompletion):
+            raise Exception(
+                f'[{llm_provider}] returned an invalid response: "{response}", please check your network '
+                f"connection and try again."
+            )
+        content = response.choices[0].message.content or ""
+        return _format_content(content, strip_newlines)
     except Exception as e:
         return f"Error: {str(e)}"
 
 
+async def _acall_provider(
+    llm_provider: str,
+    prompt: str,
+    strip_newlines: bool,
+    json_mode: bool,
+    executor: ThreadPoolExecutor = None,
+) -> str:
+    """executor: where the sync SDKs run, the default executor of the loop if None"""
+    start = time.monotonic()
+    if llm_provider in _openai_compatible_providers:
+        content = await _agenerate_openai_response(llm_provider, prompt, strip_newlines, json_mode)
+    else:
+        content = await asyncio.get_running_loop().run_in_executor(
+            executor,
+            partial(
+                contextvars.copy_context().run,
+                _generate_provider_response,
+                llm_provider,
+                prompt,
+                strip_newlines,
+                json_mode,
+            ),
+        )
+    if _is_valid_content(content):
+        llm_health.health.record_success(llm_provider, time.monotonic() - start)
+    else:
+        llm_health.health.record_failure(llm_provider)
+        content = content or f"Error: [{llm_provider}] returned an empty response"
+    return content
+
+
+async def _agenerate_response(
+    prompt: str, timeout: float = None, strip_newlines: bool = True, json_mode: bool = False
+) -> str:
+    """
+    Async variant of _generate_response, so independent llm calls can run concurrently.
+
+    OpenAI-compatible providers are awaited natively, the other providers only have
+    sync SDKs and run on a worker thread. Cancelling the awaiting task aborts the
+    request (a worker thread call is abandoned rather than interrupted). When no
+    answer arrives within timeout seconds (default: app.llm_timeout), an "Error: "
+    string is returned, the same as for any other provider failure. Failover and
+    hedging work as in _generate_response, the timeout covers the whole chain.
+    """
+    providers = _get_provider_chain()
+    if timeout is None:
+        timeout = config.app.get("llm_timeout", None)
+    logger.info(f"llm providers: {providers} (async)")
+
+    _answered_by.set("")
+    try:
+        llm_provider, content = await asyncio.wait_for(
+            _agenerate_chain_response(providers, prompt, strip_newlines, json_mode),
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        return f"Error: [{providers[0]}] no response within {timeout} seconds"
+    # wait_for ran the chain in a task of its own, with a copy of this context
+    if _is_valid_content(content):
+        _answered_by.set(llm_provider)
+    return content
+
+
+async def _agenerate_chain_response(
+    providers: List[str],
+    prompt: str,
+    strip_newlines: bool,
+    json_mode: bool,
+    executor: ThreadPoolExecutor = None,
+) -> Tuple[str, str]:
+    """(the provider that answered, the answer), the last error when none did."""
+    hedging = len(providers) > 1 and config.app.get("llm_hedging", False)
+    remaining = list(providers)
+    tasks = {}
+    content = ""
+    try:
+        while True:
+            if remaining:
+                llm_provider = remaining.pop(0)
+                task = asyncio.create_task(
+                    _acall_provider(llm_provider, prompt, strip_newlines, json_mode, executor)
+                )
+                tasks[task] = llm_provider
+            if not tasks:
+                return llm_provider, content
+
+            hedge_delay = llm_health.health.p95(llm_provider) if hedging and remaining else None
+            done, _ = await asyncio.wait(
+                list(tasks), timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                logger.info(f"llm provider {llm_provider} is slow (p95: {hedge_delay:.1f}s), hedging")
+                continue
+            for task in done:
+                failed_provider = tasks.pop(task)
+                content = task.result()
+                if _is_valid_content(content):
+                    return failed_provider, content
+                logger.warning(f"llm provider {failed_provider} failed: {content}")
+    finally:
+        # the first valid answer wins, the other requests are no longer needed
+        for task in tasks:
+            task.cancel()
+
+
+async def _agenerate_response_stream(prompt: str, json_mode: bool = False) -> AsyncIterator[str]:
+    """
+    Stream the completion text chunk by chunk. Newlines are kept, so callers must
+    parse the text themselves. Providers without a streaming API yield the whole
+    answer as a single chunk.
+
+    The provider chain is failed over as in _generate_response until a provider
+    yields its first chunk; an error after that is raised, the text already yielded
+    cannot be taken back.
+    """
+    _answered_by.set("")
+    error = None
+    for llm_provider in _get_provider_chain():
+        if llm_provider not in _openai_compatible_providers:
+            timeout = config.app.get("llm_timeout", None)
+            try:
+                content = await asyncio.wait_for(
+                    _acall_provider(llm_provider, prompt, False, json_mode), timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                content = f"Error: [{llm_provider}] no response within {timeout} seconds"
+            if _is_valid_content(content):
+                _answered_by.set(llm_provider)
+                yield content
+                return
+            logger.warning(f"llm provider {llm_provider} failed: {content}")
+            error = Exception(content)
+            continue
+
+        logger.info(f"llm provider: {llm_provider} (stream)")
+        start = time.monotonic()
+        streamed = False
+        try:
+            provider_config = _get_provider_config(llm_provider)
+            _validate_provider_config(llm_provider, provider_config)
+            client = _get_async_openai_client(
+                llm_provider,
+                provider_config["api_key"],
+                provider_config["base_url"],
+                provider_config["api_version"],
+            )
+            provider_prompt, json_kwargs = _json_mode_request(llm_provider, prompt, json_mode)
+
+            async def stream_content():
+                stream = await client.chat.completions.create(
+                    model=provider_config["model_name"],
+                    messages=[{"role": "user", "content": provider_prompt}],
+                    stream=True,
+                    **json_kwargs,
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+
+            async for content in registry.iterate(stream_content):
+                streamed = True
+                yield content
+        except Exception as e:
+            # a failing provider is moved to the end of the chain once its circuit opens
+            llm_health.health.record_failure(llm_provider)
+            if streamed:
+                raise
+            logger.warning(f"llm provider {llm_provider} failed: {str(e)}")
+            error = e
+            continue
+        if not streamed:
+            llm_health.health.record_failure(llm_provider)
+            error = Exception(f"[{llm_provider}] returned an empty response")
+            continue
+        llm_health.health.record_success(llm_provider, time.monotonic() - start)
+        _answered_by.set(llm_provider)
+        return
+    raise error or Exception("no llm provider configured")
+
+
+def _get_cache_key(prompt: str, llm_provider: str = "") -> str:
+    llm_provider = llm_provider or config.app.get("llm_provider", "openai")
+    try:
+        model_name = _get_provider_config(llm_provider)["model_name"]
+    except ValueError:
+        model_name = ""
+    return llm_cache.make_key(llm_provider, model_name, prompt)
+
+
+def _cache_get(prompt: str):
+    """The cached answer to prompt, of the first provider of the chain that has one."""
+    for llm_provider in _get_provider_chain():
+        cached = llm_cache.cache.get(_get_cache_key(prompt, llm_provider))
+        if cached:
+            return cached
+    return None
+
+
+def _cache_set(prompt: str, value, use_cache: bool = True):
+    """Cache the answer to prompt under the provider that gave it, unless use_cache is off."""
+    llm_provider = _answered_by.get()
+    if use_cache and llm_provider:
+        llm_cache.cache.set(_get_cache_key(prompt, llm_provider), value)
+
+
+def _build_repair_prompt(response: str, error: str) -> str:
+    return f"""
+The text below should be a JSON array, but it is invalid: {error}
+
+{response}
+
+Fix it and return only the corrected JSON array. Keep the content unchanged.
+""".strip()
+
+
+def _parse_json_response(response: str, validate, budget: _CallBudget = None):
+    """
+    Extract a JSON array from a response and check it with validate(value), which
+    returns the cleaned value or raises ValueError.
+
+    Most broken answers (code fences, trailing commas, truncation) are fixed locally.
+    Otherwise the model only gets the broken answer and the error back, which is much
+    cheaper than regenerating from the original prompt. Each repair takes a call of
+    budget, if given. Raises ValueError when the answer cannot be repaired.
+    """
+    for attempt in range(_max_repair_attempts + 1):
+        try:
+            return validate(extract_json(response))
+        except ValueError as e:
+            error = str(e)
+        if attempt == _max_repair_attempts or response.startswith("Error: "):
+            break
+        if budget is not None and not budget.take():
+            logger.warning(f"invalid json response: {error}, no llm calls left to repair it")
+            break
+        logger.warning(f"invalid json response: {error}, repairing... {attempt + 1}")
+        response = _generate_response(
+            _build_repair_prompt(response, error), strip_newlines=False, json_mode=True
+        )
+    raise ValueError(error)
+
+
+def _validate_string_list(value: list) -> List[str]:
+    if not all(isinstance(item, str) for item in value):
+        raise ValueError("expected a JSON array of strings")
+    value = [item.strip() for item in value if item.strip()]
+    if not value:
+        raise ValueError("the JSON array is empty")
+    return value
+
+
+def _validate_podcast_turns(value: list) -> list:
+    for i, item in enumerate(value):
+        if not isinstance(item, dict) or not all(
+            isinstance(item.get(key), str) for key in ("speaker_1", "speaker_2")
+        ):
+            raise ValueError(f'item {i} must be an object with "speaker_1" and "speaker_2" strings')
+    if not value:
+        raise ValueError("the JSON array is empty")
+    return value
+
+
 def generate_script(
-    video_subject: str, language: str = "", paragraph_number: int = 1
+    video_subject: str, language: str = "", paragraph_number: int = 1, use_cache: bool = True
 ) -> str:
     prompt = f"""
 # Role: Video Script Generator
@@ -321,6 +857,12 @@ Generate a script for a video, depending on the subject of the video.
     final_script = ""
     logger.info(f"subject: {video_subject}")
 
+    if use_cache:
+        cached = _cache_get(prompt)
+        if cached:
+            logger.success(f"completed (cached): \n{cached}")
+            return cached
+
     def format_response(response):
         # Clean the script
         # Remove asterisks, hashes
@@ -363,10 +905,14 @@ Generate a script for a video, depending on the subject of the video.
         logger.error(f"failed to generate video script: {final_script}")
     else:
         logger.success(f"completed: \n{final_script}")
+        if final_script.strip():
+            _cache_set(prompt, final_script.strip(), use_cache)
     return final_script.strip()
 
 
-def generate_terms(video_subject: str, video_script: str, amount: int = 5) -> List[str]:
+def generate_terms(
+    video_subject: str, video_script: str, amount: int = 5, use_cache: bool = True
+) -> List[str]:
     prompt = f'''
 # Role: Video Search Terms Generator
 
@@ -396,31 +942,26 @@ Please note that you must use English for generating video search terms; Chinese
 
     logger.info(f"subject: {video_subject}")
 
+    if use_cache:
+        cached = _cache_get(prompt)
+        if cached:
+            logger.success(f"completed (cached): \n{cached}")
+            return cached
+
     search_terms = []
     response = ""
+    budget = _CallBudget()
     for i in range(_max_retries):
+        if not budget.take():
+            break
         try:
-            response = _generate_response(prompt)
+            response = _generate_response(prompt, strip_newlines=False, json_mode=True)
             if "Error: " in response:
                 logger.error(f"failed to generate video script: {response}")
                 return response
-            search_terms = json.loads(response)
-            if not isinstance(search_terms, list) or not all(
-                isinstance(term, str) for term in search_terms
-            ):
-                logger.error("response is not a list of strings.")
-                continue
-
+            search_terms = _parse_json_response(response, _validate_string_list, budget)
         except Exception as e:
             logger.warning(f"failed to generate video terms: {str(e)}")
-            if response:
-                match = re.search(r"\[.*]", response)
-                if match:
-                    try:
-                        search_terms = json.loads(match.group())
-                    except Exception as e:
-                        logger.warning(f"failed to generate video terms: {str(e)}")
-                        pass
 
         if search_terms and len(search_terms) > 0:
             break
@@ -428,6 +969,8 @@ Please note that you must use English for generating video search terms; Chinese
             logger.warning(f"failed to generate video terms, trying again... {i + 1}")
 
     logger.success(f"completed: \n{search_terms}")
+    if search_terms:
+        _cache_set(prompt, search_terms, use_cache)
     return search_terms
 
 
@@ -446,16 +989,18 @@ if __name__ == "__main__":
     
 
 # 新增播客相关功能
-def generate_podcast_script(article_text: str, language: str = "") -> List[PodcastScript]:
-    """
-    基于文章生成双人对话播客脚本
-    替代原有的generate_script函数
+def _build_podcast_script_prompt(
+    article_text: str, language: str = "", max_turns: int = 0, section: Tuple[int, int] = None
+) -> str:
     """
-    from app.models.schema import PodcastScript
-    from app.config import config
+    构造播客对话脚本的生成提示
 
+    section=(index, total) 表示文章被分段生成时当前段落的位置，
+    此时会要求模型不要在中间段落重复开场或提前结束
+    """
     # 获取配置中的最大对话轮数
-    max_turns = config.app.get("podcast", {}).get("max_dialogue_turns", 6)
+    if not max_turns:
+        max_turns = config.app.get("podcast", {}).get("max_dialogue_turns", 6)
 
     # 根据语言参数选择提示语言
     if language and language.lower().startswith("en"):
@@ -553,10 +1098,52 @@ Note:
 - 确保对话自然流畅，符合播客风格
 """
 
+    if section:
+        index, total = section
+        is_en = language and language.lower().startswith("en")
+        if is_en:
+            rules = [f"The article above is section {index + 1} of {total} of a longer article. The dialogue of the other sections is written separately and joined afterwards:"]
+            if index > 0:
+                rules.append("- Continue an ongoing conversation: do not greet the audience or introduce the show")
+            if index < total - 1:
+                rules.append("- Do not summarize the whole topic or say goodbye")
+        else:
+            rules = [f"以上原文是一篇长文的第 {index + 1}/{total} 部分，其他部分的对话会单独生成后拼接："]
+            if index > 0:
+                rules.append("- 对话是中途接续的，不要打招呼或介绍节目")
+            if index < total - 1:
+                rules.append("- 不要总结全文或道别")
+        prompt += "\n" + "\n".join(rules) + "\n"
+
+    return prompt
+
+
+def _podcast_scripts_to_cache(podcast_scripts: List[PodcastScript]) -> list:
+    # 音色在读取缓存时从配置重新填充，这里只保存对话内容
+    return [{"speaker_1": turn.speaker_1, "speaker_2": turn.speaker_2} for turn in podcast_scripts]
+
+
+def _generate_podcast_turns(prompt: str, use_cache: bool = True) -> List[PodcastScript]:
+    """请求LLM生成播客对话并解析，失败时重试"""
+    if use_cache:
+        cached = _cache_get(prompt)
+        if cached:
+            logger.info(f"使用缓存的播客脚本: {len(cached)} 轮对话")
+            return _build_podcast_scripts(cached)
+
+    # 重新生成与修复请求共用调用次数上限
+    budget = _CallBudget()
     for i in range(_max_retries):
+        if not budget.take():
+            logger.error("生成播客脚本的LLM调用次数已用完")
+            break
         try:
-            response = _generate_response(prompt)
-            return parse_podcast_response(response)
+            response = _generate_response(prompt, strip_newlines=False, json_mode=True)
+            podcast_scripts = _build_podcast_scripts(
+                _parse_json_response(response, _validate_podcast_turns, budget)
+            )
+            _cache_set(prompt, _podcast_scripts_to_cache(podcast_scripts), use_cache)
+            return podcast_scripts
         except Exception as e:
             logger.error(f"生成播客脚本失败: {e}")
             if i < _max_retries - 1:
@@ -566,41 +1153,265 @@ Note:
     raise Exception("无法生成播客脚本")
 
 
-def parse_podcast_response(response: str) -> List[PodcastScript]:
-    """解析LLM返回的播客脚本"""
-    try:
-        # 清理响应文本，提取JSON部分
-        response = response.strip()
-        if response.startswith("```json"):
-            response = response[7:]
-        if response.endswith("```"):
-            response = response[:-3]
-
-        data = json.loads(response)
-        podcast_scripts = []
+def generate_podcast_script(
+    article_text: str, language: str = "", use_cache: bool = True
+) -> List[PodcastScript]:
+    """
+    基于文章生成双人对话播客脚本
+    替代原有的generate_script函数
+    """
+    if use_chunked_podcast_script(article_text):
+        return generate_podcast_script_chunked(article_text, language, use_cache=use_cache)
+
+    prompt = _build_podcast_script_prompt(article_text, language)
+    return _generate_podcast_turns(prompt, use_cache=use_cache)
+
+
+def use_chunked_podcast_script(article_text: str) -> bool:
+    """文章长度超过 podcast.chunk_size 时按段落分块并发生成"""
+    podcast_config = config.app.get("podcast", {})
+    if not podcast_config.get("chunked_generation", False):
+        return False
+    return len(article_text) > podcast_config.get("chunk_size", 4000)
+
+
+def split_article(article_text: str, chunk_size: int) -> List[str]:
+    """
+    按段落（必要时按句子）将文章切分为不超过 chunk_size 个字符的片段
+    """
+    units = []
+    for paragraph in re.split(r"\n\s*\n|\n", article_text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_size:
+            units.append(paragraph)
+            continue
+        # 超长段落按句子切分，保留句末标点
+        sentences = re.split(r"(?<=[。！？!?.;；])\s*", paragraph)
+        for sentence in sentences:
+            while len(sentence) > chunk_size:
+                units.append(sentence[:chunk_size])
+                sentence = sentence[chunk_size:]
+            if sentence.strip():
+                units.append(sentence.strip())
+
+    chunks = []
+    current = ""
+    for unit in units:
+        if current and len(current) + len(unit) + 2 > chunk_size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{unit}" if current else unit
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _allocate_turns(chunks: List[str], max_turns: int) -> List[int]:
+    """
+    按片段长度分配对话轮数（最大余数法），总数恰好为 max_turns；
+    片段数不超过 max_turns 时每段至少1轮
+    """
+    total_length = sum(len(chunk) for chunk in chunks) or 1
+    quotas = [max_turns * len(chunk) / total_length for chunk in chunks]
+    turns = [int(quota) for quota in quotas]
+    by_remainder = sorted(range(len(chunks)), key=lambda i: quotas[i] - turns[i], reverse=True)
+    for i in by_remainder[: max_turns - sum(turns)]:
+        turns[i] += 1
+    for i in range(len(turns)):
+        if turns[i] == 0:
+            largest = max(range(len(turns)), key=lambda j: turns[j])
+            if turns[largest] <= 1:
+                break
+            turns[largest] -= 1
+            turns[i] = 1
+    return turns
 
-        # 从配置中获取默认音色
-        default_speaker_1_voice = config.app.get("podcast", {}).get("default_speaker_1_voice", "zh-CN-XiaoxiaoNeural-Female")
-        default_speaker_2_voice = config.app.get("podcast", {}).get("default_speaker_2_voice", "zh-CN-YunxiNeural-Male")
 
-        for item in data:
-            podcast_scripts.append(PodcastScript(
-                speaker_1=item["speaker_1"],
-                speaker_2=item["speaker_2"],
-                speaker_1_voice=default_speaker_1_voice,
-                speaker_2_voice=default_speaker_2_voice
-            ))
+def _group_chunks(chunks: List[str], count: int) -> List[str]:
+    # 相邻片段合并为 count 段，使每段至少能分到1轮对话
+    if len(chunks) <= count:
+        return chunks
+    return [
+        "\n\n".join(chunks[i * len(chunks) // count : (i + 1) * len(chunks) // count])
+        for i in range(count)
+    ]
 
+
+def generate_podcast_script_chunked(
+    article_text: str, language: str = "", use_cache: bool = True
+) -> List[PodcastScript]:
+    """
+    长文章的map-reduce生成：先将文章分块，各块并发生成对话（map），
+    再按顺序拼接，并用一次轻量请求改写各块衔接处的第一句话（reduce）。
+    总耗时取决于最长的片段，而不是整篇文章。
+    """
+    podcast_config = config.app.get("podcast", {})
+    chunk_size = podcast_config.get("chunk_size", 4000)
+    max_workers = podcast_config.get("max_parallel_chunks", 4)
+    max_turns = podcast_config.get("max_dialogue_turns", 6)
+
+    chunks = _group_chunks(split_article(article_text, chunk_size), max(1, max_turns))
+    if len(chunks) <= 1:
+        prompt = _build_podcast_script_prompt(article_text, language)
+        return _generate_podcast_turns(prompt, use_cache=use_cache)
+
+    turns_per_chunk = _allocate_turns(chunks, max_turns)
+    logger.info(
+        f"generating podcast script in {len(chunks)} chunks, turns: {turns_per_chunk}"
+    )
+
+    prompts = [
+        _build_podcast_script_prompt(
+            chunk, language, max_turns=turns, section=(i, len(chunks))
+        )
+        for i, (chunk, turns) in enumerate(zip(chunks, turns_per_chunk))
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        sections = list(
+            executor.map(lambda p: _generate_podcast_turns(p, use_cache=use_cache), prompts)
+        )
+
+    return _stitch_podcast_sections(sections, language, use_cache=use_cache)
+
+
+def _stitch_podcast_sections(
+    sections: List[List[PodcastScript]], language: str = "", use_cache: bool = True
+) -> List[PodcastScript]:
+    """按顺序拼接各段对话，并改写每段第一句使其自然承接上一段"""
+    sections = [section for section in sections if section]
+    podcast_scripts = [turn for section in sections for turn in section]
+    if len(sections) <= 1:
         return podcast_scripts
+
+    boundaries = [
+        {"previous": section_before[-1].speaker_2, "next": section_after[0].speaker_1}
+        for section_before, section_after in zip(sections, sections[1:])
+    ]
+    if language and language.lower().startswith("en"):
+        prompt = f"""
+# Role: Podcast Dialogue Editor
+
+The dialogue below was written in sections that are now joined. For each item, "previous" is the last line before a section boundary and "next" is the first line after it.
+Rewrite every "next" line so that it naturally follows "previous", with a short transition. Keep its meaning, language and length.
+
+{json.dumps(boundaries, ensure_ascii=False)}
+
+Return only a JSON array of {len(boundaries)} strings, the rewritten "next" lines in the same order.
+""".strip()
+    else:
+        prompt = f"""
+# Role: 播客对话编辑
+
+以下对话是分段生成后拼接的。每一项中，"previous" 是段落衔接处之前的最后一句，"next" 是之后的第一句。
+请改写每个 "next"，使其自然承接 "previous"，可加入简短的过渡语，保持原意、语言和长度。
+
+{json.dumps(boundaries, ensure_ascii=False)}
+
+只返回包含 {len(boundaries)} 个字符串的JSON数组，按顺序给出改写后的 "next"。
+""".strip()
+
+    rewritten = _cache_get(prompt) if use_cache else None
+    if not rewritten:
+        try:
+            response = _generate_response(prompt, strip_newlines=False, json_mode=True)
+            rewritten = _parse_json_response(response, _validate_string_list)
+            if len(rewritten) != len(boundaries):
+                raise ValueError(f"expected a list of {len(boundaries)} strings")
+            _cache_set(prompt, rewritten, use_cache)
+        except Exception as e:
+            # 衔接改写只是锦上添花，失败时直接使用拼接结果
+            logger.warning(f"failed to smooth podcast section boundaries: {str(e)}")
+            return podcast_scripts
+
+    # podcast_scripts 引用的是同一批对象，直接改写每段的第一句
+    for section, line in zip(sections[1:], rewritten):
+        section[0].speaker_1 = line
+    return podcast_scripts
+
+
+async def astream_podcast_script(
+    article_text: str, language: str = "", use_cache: bool = True
+) -> AsyncIterator[PodcastScript]:
+    """
+    流式生成播客脚本：每解析出一轮完整对话就立即产出，
+    下游（如TTS）可以在模型还在生成后续对话时开始处理第一轮
+    """
+    prompt = _build_podcast_script_prompt(article_text, language)
+
+    if use_cache:
+        cached = _cache_get(prompt)
+        if cached:
+            logger.info(f"使用缓存的播客脚本: {len(cached)} 轮对话")
+            for turn in _build_podcast_scripts(cached):
+                yield turn
+            return
+
+    for i in range(_max_retries):
+        parser = JsonArrayStreamParser()
+        podcast_scripts = []
+        try:
+            async for chunk in _agenerate_response_stream(prompt, json_mode=True):
+                for item in parser.feed(chunk):
+                    turn = _build_podcast_scripts(_validate_podcast_turns([item]))[0]
+                    podcast_scripts.append(turn)
+                    logger.info(f"收到第 {len(podcast_scripts)} 轮对话")
+                    yield turn
+            if not podcast_scripts:
+                raise ValueError("no dialogue turn found in the response")
+            if not parser.finished:
+                raise ValueError(f"the response was cut off after {len(podcast_scripts)} turns")
+            _cache_set(prompt, _podcast_scripts_to_cache(podcast_scripts), use_cache)
+            return
+        except Exception as e:
+            logger.error(f"流式生成播客脚本失败: {e}")
+            # 已经产出的对话无法撤回，只能在尚未产出任何内容时重试，否则让任务失败，
+            # 而不是合成一段被截断的播客
+            if podcast_scripts:
+                raise
+            if i < _max_retries - 1:
+                logger.warning(f"重试第 {i + 1} 次...")
+                continue
+
+    raise Exception("无法生成播客脚本")
+
+
+def parse_podcast_response(response: str) -> List[PodcastScript]:
+    """解析LLM返回的播客脚本"""
+    try:
+        data = _validate_podcast_turns(extract_json(response))
+        return _build_podcast_scripts(data)
     except Exception as e:
         logger.error(f"解析播客脚本失败: {e}")
         raise
 
 
-def generate_terms_from_podcast(podcast_script: List[PodcastScript], amount: int = 5) -> List[str]:
-    """
-    从播客脚本中提取关键词
-    """
+def _build_podcast_scripts(data: list) -> List[PodcastScript]:
+    """将解析出的对话轮次转换为PodcastScript，音色使用配置中的默认值"""
+    podcast_scripts = []
+
+    # 从配置中获取默认音色
+    default_speaker_1_voice = config.app.get("podcast", {}).get("default_speaker_1_voice", "zh-CN-XiaoxiaoNeural-Female")
+    default_speaker_2_voice = config.app.get("podcast", {}).get("default_speaker_2_voice", "zh-CN-YunxiNeural-Male")
+
+    for item in data:
+        podcast_scripts.append(PodcastScript(
+            speaker_1=item["speaker_1"],
+            speaker_2=item["speaker_2"],
+            speaker_1_voice=default_speaker_1_voice,
+            speaker_2_voice=default_speaker_2_voice
+        ))
+
+    return podcast_scripts
+
+
+# 关键词过滤时忽略的常见无意义词汇
+_podcast_common_words = set(["about", "have", "you", "heard", "Hey", "the", "a", "an", "and", "or", "but", "is", "are"])
+
+
+def _build_podcast_terms_prompt(podcast_script: List[PodcastScript], amount: int) -> Tuple[str, str]:
+    """构造关键词提取提示，返回 (提示, 合并后的对话文本)"""
     # 将所有对话内容合并
     all_text = " ".join([
         dialogue.speaker_1 + " " + dialogue.speaker_2
@@ -626,47 +1437,74 @@ def generate_terms_from_podcast(podcast_script: List[PodcastScript], amount: int
 返回JSON格式的关键词列表，使用英文表达：
 ["keyword1", "keyword2", "keyword3", ...]
 '''.strip()
+    return prompt, all_text
 
-    response = _generate_response(prompt)
-    try:
-        # 清理响应文本，提取JSON部分
-        response = response.strip()
-        if response.startswith("```json"):
-            response = response[7:]
-        if response.endswith("```"):
-            response = response[:-3]
+
+def _extract_podcast_terms(response: str, amount: int) -> List[str]:
+    """解析LLM返回的关键词列表，无法解析（修复）为字符串数组时抛出 ValueError"""
+    common_words = _podcast_common_words
+
+    keywords = _parse_json_response(response, _validate_string_list)
+
+    # 过滤关键词，移除常见无意义词汇
+    filtered_keywords = []
+    
+    for keyword in keywords:
+        # 检查关键词或关键词中的单词是否在常见词列表中
+        words = keyword.lower().split()
+        if not any(word in common_words for word in words) and keyword.strip():
+            filtered_keywords.append(keyword)
             
-        keywords = json.loads(response)
-        
-        # 过滤关键词，移除常见无意义词汇
-        common_words = set(["about", "have", "you", "heard", "Hey", "the", "a", "an", "and", "or", "but", "is", "are"])
-        filtered_keywords = []
-        
+    # 如果过滤后关键词不足，从原始关键词中补充
+    if len(filtered_keywords) < amount:
         for keyword in keywords:
-            # 检查关键词或关键词中的单词是否在常见词列表中
-            words = keyword.lower().split()
-            if not any(word in common_words for word in words) and keyword.strip():
+            if keyword not in filtered_keywords:
                 filtered_keywords.append(keyword)
+            if len(filtered_keywords) >= amount:
+                break
                 
-        # 如果过滤后关键词不足，从原始关键词中补充
-        if len(filtered_keywords) < amount:
-            for keyword in keywords:
-                if keyword not in filtered_keywords:
-                    filtered_keywords.append(keyword)
-                if len(filtered_keywords) >= amount:
-                    break
-                    
-        return filtered_keywords[:amount]
-    except:
-        # 如果JSON解析失败，先尝试进行更智能的分词和过滤
-        import re
-        
-        # 简单分词并过滤掉常见词
-        words = re.findall(r'\b\w+\b', all_text.lower())
-        filtered_words = [word for word in words if word not in common_words]
-        
-        # 如果过滤后有足够的词，返回这些词；否则返回原始分词结果
-        if len(filtered_words) >= amount:
-            return filtered_words[:amount]
-        else:
-            return words[:amount]
+    return filtered_keywords[:amount]
+
+
+def _fallback_podcast_terms(all_text: str, amount: int) -> List[str]:
+    """JSON解析失败时，先尝试进行更智能的分词和过滤"""
+    # 简单分词并过滤掉常见词
+    words = re.findall(r'\b\w+\b', all_text.lower())
+    filtered_words = [word for word in words if word not in _podcast_common_words]
+    
+    # 如果过滤后有足够的词，返回这些词；否则返回原始分词结果
+    if len(filtered_words) >= amount:
+        return filtered_words[:amount]
+    else:
+        return words[:amount]
+
+
+def _parse_podcast_terms(
+    response: str, all_text: str, amount: int, prompt: str = "", use_cache: bool = True
+) -> List[str]:
+    """解析关键词，只有成功解析的结果才会写入缓存"""
+    try:
+        keywords = _extract_podcast_terms(response, amount)
+    except Exception:
+        return _fallback_podcast_terms(all_text, amount)
+
+    if prompt and keywords:
+        _cache_set(prompt, keywords, use_cache)
+    return keywords
+
+
+def generate_terms_from_podcast(
+    podcast_script: List[PodcastScript], amount: int = 5, use_cache: bool = True
+) -> List[str]:
+    """
+    从播客脚本中提取关键词
+    """
+    prompt, all_text = _build_podcast_terms_prompt(podcast_script, amount)
+    if use_cache:
+        cached = _cache_get(prompt)
+        if cached:
+            return cached
+
+    response = _generate_response(prompt, strip_newlines=False, json_mode=True)
+    return _parse_podcast_terms(response, all_text, amount, prompt=prompt, use_cache=use_cache)
+
@@ -0,0 +1,85 @@
+"""Persistent cache for validated LLM responses.
+
+Entries are keyed by provider, model and a hash of the normalized prompt, and
+stored as small JSON files under ``storage/llm_cache``. Callers only put values
+that already passed validation (e.g. a parsed list of terms), so a hit can be
+returned without re-parsing or re-validating.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Any, Optional
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+
+def normalize_prompt(prompt: str) -> str:
+    # whitespace differences (indentation, trailing newlines) do not change the answer
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def make_key(llm_provider: str, model_name: str, prompt: str) -> str:
+    text = f"{llm_provider}\n{model_name}\n{normalize_prompt(prompt)}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, cache_dir: str = "", ttl: int = 7 * 24 * 3600, enabled: bool = True):
+        self.cache_dir = cache_dir or utils.storage_dir("llm_cache")
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        file = self._path(key)
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"invalid llm cache entry: {file} => {str(e)}")
+            self.delete(key)
+            return None
+
+        if self.ttl and time.time() - entry.get("created_at", 0) > self.ttl:
+            self.delete(key)
+            return None
+        return entry.get("value")
+
+    def set(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        file = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            # write to a temp file first, so concurrent readers never see a partial entry
+            fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(file), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created_at": time.time(), "value": value}, f, ensure_ascii=False)
+            os.replace(temp_file, file)
+        except Exception as e:
+            logger.warning(f"failed to write llm cache entry: {file} => {str(e)}")
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+cache = LLMCache(
+    ttl=config.app.get("llm_cache_ttl", 7 * 24 * 3600),
+    enabled=config.app.get("llm_cache_enabled", True),
+)
@@ -0,0 +1,186 @@
+"""LLM client registry.
+
+Each provider client (OpenAI/Azure SDK clients, ``requests`` sessions, SDK model
+objects) is built once per (provider, base_url, api_key) and reused, so the
+HTTP keep-alive pool and TLS session survive across calls. Short-lived access
+tokens (e.g. Ernie OAuth) are cached until shortly before they expire.
+
+Async clients hold connections bound to the event loop they are first used on.
+Callers come from many short-lived loops (every task runs its own asyncio.run()),
+so the async clients live on one long-lived loop on a daemon thread, and the calls
+are handed over to it with run() and iterate().
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Tuple
+
+from loguru import logger
+
+# refresh tokens this many seconds before they actually expire
+_token_expiry_margin = 300
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop):
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+
+
+class LLMClientRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Hashable, Any] = {}
+        self._tokens: Dict[Hashable, Tuple[str, float]] = {}
+        self._token_locks: Dict[Hashable, threading.Lock] = {}
+        # async clients, only used on self._loop
+        self._async_clients: Dict[Hashable, Any] = {}
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def get_client(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Return the client registered under key, building it with factory on first use.
+        """
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                logger.debug(f"creating llm client: {key[0] if isinstance(key, tuple) else key}")
+                client = factory()
+                self._clients[key] = client
+            return client
+
+    def get_async_client(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Same as get_client, for async clients: they must only be awaited through
+        run() and iterate(), on the loop of the registry.
+        """
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is None:
+                logger.debug(f"creating async llm client: {key[0] if isinstance(key, tuple) else key}")
+                client = factory()
+                self._async_clients[key] = client
+            return client
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop of the async clients, started on first use."""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=_run_loop, args=(loop,), name="llm-client-loop", daemon=True
+                ).start()
+                self._loop = loop
+            return self._loop
+
+    async def run(self, coro: Awaitable) -> Any:
+        """
+        Await coro on the loop of the async clients, from any event loop. Cancelling
+        the caller cancels coro.
+        """
+        loop = self.loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    async def iterate(self, aiterable: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Iterate aiterable() on the loop of the async clients, from any event loop."""
+        loop = self.loop()
+        caller = asyncio.get_running_loop()
+        if caller is loop:
+            async for item in aiterable():
+                yield item
+            return
+
+        queue = asyncio.Queue()
+        end = object()
+
+        def put(item, error=None):
+            try:
+                caller.call_soon_threadsafe(queue.put_nowait, (item, error))
+            except RuntimeError:
+                # the caller's loop is closed, nobody is waiting anymore
+                pass
+
+        async def pump():
+            try:
+                async for item in aiterable():
+                    put(item)
+            except Exception as e:
+                put(end, e)
+            else:
+                put(end)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is end:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            future.cancel()
+
+    def get_token(
+        self, key: Hashable, fetch: Callable[[], Tuple[str, float]]
+    ) -> str:
+        """
+        Return a cached access token, calling fetch() -> (token, expires_in) when
+        the cached one is missing or about to expire.
+        """
+        with self._lock:
+            token_lock = self._token_locks.setdefault(key, threading.Lock())
+
+        # only one thread refreshes a given token, the others wait for its result
+        with token_lock:
+            cached = self._tokens.get(key)
+            if cached and cached[1] > time.time():
+                return cached[0]
+
+            token, expires_in = fetch()
+            if not token:
+                raise ValueError(f"failed to fetch access token for {key[0] if isinstance(key, tuple) else key}")
+            ttl = max(float(expires_in or 0) - _token_expiry_margin, 0)
+            self._tokens[key] = (token, time.time() + ttl)
+            return token
+
+    def invalidate_token(self, key: Hashable):
+        self._tokens.pop(key, None)
+
+    def clear(self, timeout: float = 5):
+        """Close all the clients (async ones with aclose()/close() on their loop)."""
+        with self._lock:
+            clients = list(self._clients.values())
+            async_clients = list(self._async_clients.values())
+            loop = self._loop
+            self._clients.clear()
+            self._async_clients.clear()
+            self._loop = None
+            self._tokens.clear()
+        for client in clients:
+            close = getattr(client, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning(f"failed to close llm client: {str(e)}")
+        if loop is None:
+            return
+        for client in async_clients:
+            close = getattr(client, "aclose", None) or getattr(client, "close", None)
+            if not callable(close):
+                continue
+            try:
+                result = close()
+                if asyncio.iscoroutine(result):
+                    asyncio.run_coroutine_threadsafe(result, loop).result(timeout)
+            except Exception as e:
+                logger.warning(f"failed to close async llm client: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+registry = LLMClientRegistry()
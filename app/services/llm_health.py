@@ -0,0 +1,88 @@
+"""Per-provider health tracking for LLM failover and hedged requests.
+
+Each provider has a circuit breaker (opened after consecutive failures, retried
+after a cooldown) and a rolling window of successful response latencies, whose
+p95 is used as the hedging delay.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from app.config import config
+
+
+class ProviderHealth:
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+
+
+class HealthTracker:
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        cooldown: float = 60,
+        window: int = 50,
+        min_samples: int = 10,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.window = window
+        self.min_samples = min_samples
+        self._providers: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, llm_provider: str) -> ProviderHealth:
+        health = self._providers.get(llm_provider)
+        if health is None:
+            health = self._providers[llm_provider] = ProviderHealth(self.window)
+        return health
+
+    def available(self, llm_provider: str) -> bool:
+        """False while the circuit is open; after the cooldown a trial request is allowed."""
+        with self._lock:
+            health = self._get(llm_provider)
+            if health.consecutive_failures < self.failure_threshold:
+                return True
+            return time.monotonic() - health.opened_at >= self.cooldown
+
+    def order(self, providers: List[str]) -> List[str]:
+        """Providers with a closed circuit first (in the given order), open ones as a last resort."""
+        available = [p for p in providers if self.available(p)]
+        return available + [p for p in providers if p not in available]
+
+    def record_success(self, llm_provider: str, latency: float):
+        with self._lock:
+            health = self._get(llm_provider)
+            health.consecutive_failures = 0
+            health.latencies.append(latency)
+
+    def record_failure(self, llm_provider: str):
+        with self._lock:
+            health = self._get(llm_provider)
+            health.consecutive_failures += 1
+            if health.consecutive_failures >= self.failure_threshold:
+                # (re)open the circuit, a failed trial request restarts the cooldown
+                health.opened_at = time.monotonic()
+
+    def p95(self, llm_provider: str) -> Optional[float]:
+        """p95 latency in seconds, None until min_samples responses were seen."""
+        with self._lock:
+            latencies = sorted(self._get(llm_provider).latencies)
+        if not latencies or len(latencies) < self.min_samples:
+            return None
+        return latencies[math.ceil(len(latencies) * 0.95) - 1]
+
+    def reset(self):
+        with self._lock:
+            self._providers.clear()
+
+
+health = HealthTracker(
+    failure_threshold=config.app.get("llm_circuit_failures", 3),
+    cooldown=config.app.get("llm_circuit_cooldown", 60),
+)
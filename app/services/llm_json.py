@@ -0,0 +1,171 @@
+"""JSON helpers for LLM output."""
+
+import json
+import re
+from typing import Any, List
+
+
+class JsonArrayStreamParser:
+    """
+    Incrementally parse a JSON array of objects from streamed text.
+
+    feed() accepts arbitrary text chunks and returns the objects of the top-level
+    array that became complete with this chunk, so each element can be processed
+    while the model is still writing the next one. Text before the opening "["
+    (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = -1
+        self.started = False
+        self.finished = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        items = []
+        if self.finished or not chunk:
+            return items
+
+        self._buffer += chunk
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            c = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif not self.started:
+                if c == "[":
+                    self.started = True
+                    self._depth = 1
+            elif c == '"':
+                self._in_string = True
+            elif c in "[{":
+                if self._depth == 1:
+                    self._item_start = i
+                self._depth += 1
+            elif c in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._item_start >= 0:
+                    text = buffer[self._item_start : i + 1]
+                    self._item_start = -1
+                    # strict=False: models often emit raw newlines inside strings
+                    items.append(json.loads(text, strict=False))
+                elif self._depth == 0:
+                    self.finished = True
+                    break
+            i += 1
+
+        # drop consumed text, keep the unfinished element (if any)
+        keep_from = self._item_start if self._item_start >= 0 else i
+        self._buffer = buffer[keep_from:]
+        if self._item_start >= 0:
+            self._item_start = 0
+        self._pos = i - keep_from
+        return items
+
+
+_code_fence_pattern = re.compile(r"```[a-zA-Z]*\s*(.*?)\s*```", re.S)
+_trailing_comma_pattern = re.compile(r",\s*([\]}])")
+
+
+def _find_json_text(text: str, opener: str) -> str:
+    """
+    Return the substring from the first opener to its matching closer, or to the
+    end of the text when the value is truncated.
+    """
+    start = text.find(opener)
+    if start < 0:
+        return ""
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "[{":
+            depth += 1
+        elif c in "]}":
+            depth -= 1
+            if depth == 0:
+                return text[start : i + 1]
+    return text[start:]
+
+
+def _loads(text: str) -> Any:
+    try:
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        pass
+    # the most common model mistake: a trailing comma before ] or }
+    return json.loads(_trailing_comma_pattern.sub(r"\1", text), strict=False)
+
+
+def extract_json(text: str, expect: type = list) -> Any:
+    """
+    Tolerantly extract a JSON value of type expect (list or dict) from LLM output.
+
+    Handles code fences and surrounding prose, trailing commas, raw newlines in
+    strings, arrays wrapped in an object (JSON mode answers such as
+    {"items": [...]}) and arrays cut off mid-way, of which the complete elements
+    are kept. Raises ValueError when nothing usable is found.
+    """
+    if not text or not text.strip():
+        raise ValueError("empty response")
+
+    fence = _code_fence_pattern.search(text)
+    if fence:
+        text = fence.group(1)
+    elif text.lstrip().startswith("```"):
+        # opening fence without a closing one (truncated answer)
+        text = text.lstrip()[3:].lstrip("json").lstrip()
+
+    if expect is list:
+        candidates = [_find_json_text(text, "["), _find_json_text(text, "{")]
+    else:
+        candidates = [_find_json_text(text, "{")]
+
+    error = None
+    for candidate in candidates:
+        if not candidate:
+            continue
+        try:
+            value = _loads(candidate)
+        except (json.JSONDecodeError, ValueError) as e:
+            error = e
+            if expect is list and candidate.startswith("["):
+                # truncated or partly broken array: keep the complete elements
+                parser = JsonArrayStreamParser()
+                try:
+                    items = parser.feed(candidate)
+                except (json.JSONDecodeError, ValueError):
+                    items = []
+                if items:
+                    return items
+            continue
+
+        if isinstance(value, expect):
+            return value
+        if expect is list and isinstance(value, dict):
+            lists = [v for v in value.values() if isinstance(v, list)]
+            if len(lists) == 1:
+                return lists[0]
+        error = ValueError(f"expected a JSON {expect.__name__}, got {type(value).__name__}")
+
+    raise ValueError(str(error) if error else f"no JSON {expect.__name__} found in the response")
@@ -1,6 +1,11 @@
+import copy
 import os
 import random
-from typing import List
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, List
 from urllib.parse import urlencode
 
 import requests
@@ -13,6 +18,14 @@ from app.utils import utils
 
 requested_count = 0
 
+# searches and downloads in flight, concurrent tasks (e.g. of one batch) asking for the
+# same search term or video url wait for the first one instead of repeating it
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+# (provider, search term, minimum duration, aspect) => (expires at, video items)
+_search_cache = OrderedDict()
+_search_cache_size = 1000
+
 
 def get_api_key(cfg_key: str):
     api_keys = config.app.get(cfg_key)
@@ -144,6 +157,70 @@ def search_videos_pixabay(
     return []
 
 
+def _single_flight(key, func: Callable):
+    """Run func once for all the callers asking for the same key at the same time."""
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        result = func()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+
+def search_videos_cached(
+    search_videos: Callable,
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    """
+    search_videos with the results remembered for material_search_cache_ttl seconds,
+    tasks searching for the same terms share one api request. Each caller gets its own
+    copies of the items, the tasks may change them.
+    """
+    ttl = config.app.get("material_search_cache_ttl", 600)
+    key = (
+        search_videos.__name__,
+        search_term.strip().lower(),
+        minimum_duration,
+        VideoAspect(video_aspect).value,
+    )
+    now = time.monotonic()
+    with _in_flight_lock:
+        cached = _search_cache.get(key)
+        if cached and cached[0] > now:
+            return [copy.copy(item) for item in cached[1]]
+
+    def search():
+        video_items = search_videos(
+            search_term=search_term,
+            minimum_duration=minimum_duration,
+            video_aspect=video_aspect,
+        )
+        # failed searches return no items, they are not remembered
+        if ttl > 0 and video_items:
+            with _in_flight_lock:
+                _search_cache[key] = (time.monotonic() + ttl, video_items)
+                _search_cache.move_to_end(key)
+                while len(_search_cache) > _search_cache_size:
+                    _search_cache.popitem(last=False)
+        return video_items
+
+    return [copy.copy(item) for item in _single_flight(("search",) + key, search)]
+
+
 def save_video(video_url: str, save_dir: str = "") -> str:
     if not save_dir:
         save_dir = utils.storage_dir("cache_videos")
@@ -156,6 +233,13 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     video_id = f"vid-{url_hash}"
     video_path = f"{save_dir}/{video_id}.mp4"
 
+    # the same video can be downloaded by several tasks at the same time
+    return _single_flight(
+        ("download", video_path), lambda: _save_video(video_url, video_path)
+    )
+
+
+def _save_video(video_url: str, video_path: str) -> str:
     # if video already exists, return the path
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         logger.info(f"video already exists: {video_path}")
@@ -165,17 +249,24 @@ def save_video(video_url: str, save_dir: str = "") -> str:
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
     }
 
-    # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
-                video_url,
-                headers=headers,
-                proxies=config.proxy,
-                verify=False,
-                timeout=(60, 240),
-            ).content
-        )
+    # if video does not exist, download it, into a temporary file so that no other
+    # task (or process) sharing the cache directory sees a partial video
+    tmp_path = f"{video_path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(
+                requests.get(
+                    video_url,
+                    headers=headers,
+                    proxies=config.proxy,
+                    verify=False,
+                    timeout=(60, 240),
+                ).content
+            )
+        os.replace(tmp_path, video_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
@@ -217,7 +308,8 @@ def download_videos(
         logger.info(f"optimized podcast search terms: {search_terms}")
 
     for search_term in search_terms:
-        video_items = search_videos(
+        video_items = search_videos_cached(
+            search_videos,
             search_term=search_term,
             minimum_duration=max_clip_duration,
             video_aspect=video_aspect,
@@ -0,0 +1,185 @@
+"""
+Probed metadata of the local media files (uploaded BGM and materials): duration,
+codec, sample rate and, for audio, the integrated loudness (EBU R128, LUFS).
+
+Files are probed with the ffmpeg bundled by moviepy (imageio-ffmpeg, or ffmpeg_path)
+and the results kept in a SQLite catalog (storage/media.db), keyed by path; an entry
+no longer counts once the file's size or mtime changed.
+"""
+
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.models.exception import ProbeError
+from app.services import state as sm
+from app.utils import utils
+
+# ffmpeg stops after the input section when no output is given
+_duration_re = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_audio_re = re.compile(r"Stream #\d+:\d+.*?: Audio: (\w+)[^,\n]*(?:, (\d+) Hz)?(?:, ([^,\n]+))?")
+_video_re = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})")
+_loudness_re = re.compile(r"I:\s+(-?[\d.]+|-inf) LUFS")
+_channels = {"mono": 1, "stereo": 2, "2.1": 3, "quad": 4, "5.0": 5, "5.1": 6, "7.1": 8}
+
+
+def ffmpeg_exe() -> str:
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+
+def probe(path: str, loudness: bool = False, timeout: float = 300) -> Dict:
+    """
+    {"duration", "format", "codec", "sample_rate", "channels", "width", "height",
+    "loudness"} of a media file, loudness (LUFS) only when asked for, it decodes the
+    whole audio stream. Raises ProbeError when ffmpeg cannot read the file.
+    """
+    cmd = [ffmpeg_exe(), "-hide_banner", "-nostdin", "-i", path]
+    if loudness:
+        cmd += ["-map", "0:a:0", "-af", "ebur128=framelog=quiet", "-f", "null", "-"]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, errors="replace", timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ProbeError(f"failed to probe {path}: {str(e)}")
+    output = result.stderr
+    # the streams of the input, not those of the null output
+    input_section = re.split(r"\n(?:Stream mapping:|Output #0)", output, maxsplit=1)[0]
+    match = re.search(r"Input #0, ([\w,]+), from", input_section)
+    if not match:
+        raise ProbeError(f"not a media file: {path}")
+
+    info = {
+        "duration": 0.0,
+        "format": match.group(1),
+        "codec": "",
+        "sample_rate": 0,
+        "channels": 0,
+        "width": 0,
+        "height": 0,
+        "loudness": None,
+    }
+    duration = _duration_re.search(input_section)
+    if duration:
+        hours, minutes, seconds = duration.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    video = _video_re.search(input_section)
+    if video:
+        info["codec"] = video.group(1)
+        info["width"], info["height"] = int(video.group(2)), int(video.group(3))
+    audio = _audio_re.search(input_section)
+    if audio:
+        if not video:
+            info["codec"] = audio.group(1)
+        info["sample_rate"] = int(audio.group(2) or 0)
+        layout = (audio.group(3) or "").split("(")[0].strip()
+        info["channels"] = _channels.get(layout, 0)
+    if loudness:
+        if result.returncode != 0 or not audio:
+            raise ProbeError(f"failed to measure the loudness of {path}")
+        measured = _loudness_re.findall(output)
+        if measured and measured[-1] != "-inf":
+            info["loudness"] = float(measured[-1])
+    return info
+
+
+class MediaCatalog:
+    _columns = (
+        "path", "kind", "size", "mtime", "duration", "format", "codec",
+        "sample_rate", "channels", "width", "height", "loudness",
+    )
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sm.sqlite_connect(path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS media (
+                path TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                duration REAL NOT NULL DEFAULT 0,
+                format TEXT NOT NULL DEFAULT '',
+                codec TEXT NOT NULL DEFAULT '',
+                sample_rate INTEGER NOT NULL DEFAULT 0,
+                channels INTEGER NOT NULL DEFAULT 0,
+                width INTEGER NOT NULL DEFAULT 0,
+                height INTEGER NOT NULL DEFAULT 0,
+                loudness REAL,
+                probed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_media_kind ON media (kind, path);
+            """
+        )
+
+    def record(self, path: str, kind: str, info: Dict) -> Dict:
+        """Store the probe result of path, with its current size and mtime."""
+        stat_result = os.stat(path)
+        entry = {
+            **{k: info.get(k) for k in self._columns[4:]},
+            "path": os.path.abspath(path),
+            "kind": kind,
+            "size": stat_result.st_size,
+            "mtime": stat_result.st_mtime,
+        }
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO media ({', '.join(self._columns)}, probed_at)"
+                f" VALUES ({', '.join('?' * len(self._columns))}, ?)",
+                [entry[k] for k in self._columns] + [time.time()],
+            )
+        return entry
+
+    def get(self, path: str) -> Optional[Dict]:
+        """The entry of path, None when missing or the file changed since it was probed."""
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._columns)} FROM media WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(self._columns, row))
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        if stat_result.st_size != entry["size"] or stat_result.st_mtime != entry["mtime"]:
+            return None
+        return entry
+
+    def entries(self, kind: str) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self._columns)} FROM media WHERE kind = ? ORDER BY path",
+                (kind,),
+            ).fetchall()
+        return [dict(zip(self._columns, row)) for row in rows]
+
+    def remove(self, path: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM media WHERE path = ?", (os.path.abspath(path),))
+
+
+_catalog: Optional[MediaCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def catalog() -> MediaCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = MediaCatalog(utils.storage_dir("media.db"))
+        return _catalog
+
+
+def probe_and_record(path: str, kind: str, loudness: bool = False) -> Dict:
+    """Probe path and store it in the catalog, raises ProbeError when it is not media."""
+    return catalog().record(path, kind, probe(path, loudness=loudness))
@@ -0,0 +1,178 @@
+"""Stage scheduler for the video pipeline.
+
+A task is a small DAG of stages (script, terms, audio, subtitle, materials,
+render). Each stage declares the stages it depends on and starts as soon as they
+are finished, so independent stages (e.g. downloading footage and synthesizing
+audio) overlap. Stages run on a shared I/O thread pool, since they mostly wait on
+the network; CPU-bound rendering is handed to a process pool (see cpu_pool()).
+"""
+
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from loguru import logger
+
+from app.config import config
+from app.models.exception import TaskCancelledError
+from app.services.cancellation import CancelToken
+from app.services.stage_limits import limiter
+
+# seconds between cancellation checks while waiting for the running stages
+_cancel_check_interval = 0.5
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+        inputs: Sequence[str] = (),
+    ):
+        """
+        func receives the shared context and returns a dict of outputs that is merged
+        into it, or None when the stage failed.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+
+
+def _required_stages(stages: Dict[str, Stage], target: str) -> List[str]:
+    required = []
+    pending = [target]
+    while pending:
+        name = pending.pop()
+        if name in required:
+            continue
+        if name not in stages:
+            raise ValueError(f"unknown stage: {name}")
+        required.append(name)
+        pending.extend(stages[name].inputs)
+    return required
+
+
+def _run_stage(stage: Stage, context: Dict[str, Any], cancel_token: Optional[CancelToken]):
+    if cancel_token is None:
+        return stage.func(context)
+    cancel_token.raise_if_cancelled()
+    with cancel_token.watch():
+        return stage.func(context)
+
+
+def run_stages(
+    stages: List[Stage],
+    target: str,
+    context: Dict[str, Any],
+    on_stage_done: Callable[[str], None] = None,
+    cancel_token: CancelToken = None,
+) -> bool:
+    """
+    Run target and the stages it (transitively) depends on. Returns False as soon as
+    a stage fails; stages that did not start yet are skipped, running ones finish
+    but their outputs are ignored.
+
+    Raises TaskCancelledError as soon as cancel_token is cancelled, without waiting
+    for the running stages, they stop at their next cancellation check.
+    """
+    stage_map = {stage.name: stage for stage in stages}
+    pending = {name: stage_map[name] for name in _required_stages(stage_map, target)}
+    done = set()
+    futures = {}
+    pool = io_pool()
+    try:
+        while pending or futures:
+            for name, stage in list(pending.items()):
+                if all(dep in done for dep in stage.inputs):
+                    del pending[name]
+                    # in the caller's context, e.g. the task id its log lines are bound to
+                    future = pool.submit(
+                        contextvars.copy_context().run, _run_stage, stage, context, cancel_token
+                    )
+                    futures[future] = stage
+            if not futures:
+                raise ValueError(f"unsatisfiable stage dependencies: {list(pending)}")
+
+            finished, _ = wait(
+                list(futures),
+                timeout=_cancel_check_interval if cancel_token else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            for future in finished:
+                stage = futures.pop(future)
+                try:
+                    outputs = future.result()
+                except TaskCancelledError:
+                    raise
+                except Exception as e:
+                    logger.exception(f"stage {stage.name} failed: {str(e)}")
+                    outputs = None
+                if outputs is None:
+                    logger.error(f"stage {stage.name} failed, skipping: {list(pending)}")
+                    return False
+                context.update(outputs)
+                done.add(stage.name)
+                if on_stage_done:
+                    on_stage_done(stage.name)
+        return True
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+_io_pool = None
+_cpu_pool = None
+_pool_lock = threading.Lock()
+
+
+def io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    with _pool_lock:
+        if _io_pool is None:
+            _io_pool = ThreadPoolExecutor(
+                max_workers=config.app.get("io_pool_size", 16),
+                thread_name_prefix="stage-io",
+            )
+        return _io_pool
+
+
+def cpu_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Process pool for rendering, sized by the render stage limit. None when
+    app.render_processes is disabled, rendering then runs on the calling thread.
+    """
+    global _cpu_pool
+    if not config.app.get("render_processes", True):
+        return None
+    with _pool_lock:
+        if _cpu_pool is None:
+            # spawn: forking a process that runs threads (uvicorn, task workers) is unsafe
+            _cpu_pool = ProcessPoolExecutor(
+                max_workers=limiter.limits.get("render") or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _cpu_pool
+
+
+def reset_cpu_pool():
+    """Drop a broken process pool (e.g. a worker was killed), the next call creates a new one."""
+    global _cpu_pool
+    with _pool_lock:
+        pool, _cpu_pool = _cpu_pool, None
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown(block: bool = True):
+    global _io_pool, _cpu_pool
+    with _pool_lock:
+        pools = [_io_pool, _cpu_pool]
+        _io_pool = _cpu_pool = None
+    for pool in pools:
+        if pool:
+            pool.shutdown(wait=block, cancel_futures=True)
@@ -1,10 +1,14 @@
 import asyncio
 import os
+import shutil
 import tempfile
 import subprocess
-from typing import List, Optional, Tuple
+from typing import AsyncIterable, List, Optional, Tuple
 from loguru import logger
 from app.models.schema import PodcastScript
+from app.models.exception import TaskCancelledError
+from app.services import cancellation
+from app.services.cancellation import CancelToken
 from app.services.voice import tts, get_audio_duration
 from app.config import config
 from app.utils import utils
@@ -24,7 +28,8 @@ class PodcastAudioGenerator:
         podcast_script: List[PodcastScript],
         output_path: str,
         voice_rate: float = None,
-        voice_volume: float = None
+        voice_volume: float = None,
+        cancel_token: CancelToken = None,
     ) -> Tuple[str, float]:
         """
         生成播客音频文件
@@ -34,6 +39,7 @@ class PodcastAudioGenerator:
             output_path: 输出音频文件路径
             voice_rate: 语速
             voice_volume: 音量
+            cancel_token: 每轮对话之前检查任务是否已取消
 
         Returns:
             (音频文件路径, 音频时长)
@@ -52,55 +58,149 @@ class PodcastAudioGenerator:
         try:
             # 为每轮对话生成音频
             for i, dialogue in enumerate(podcast_script):
-                logger.info(f"正在生成第 {i+1} 轮对话音频...")
-
-                # 生成说话人1的音频
-                speaker1_audio = await self._generate_speaker_audio(
-                    text=dialogue.speaker_1,
-                    voice_name=dialogue.speaker_1_voice,
-                    output_prefix=f"speaker1_{i}",
-                    voice_rate=voice_rate,
-                    voice_volume=voice_volume
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                dialogue_audio = await self._generate_dialogue_audio(
+                    i, dialogue, voice_rate, voice_volume, cancel_token
                 )
+                temp_audio_files.append(dialogue_audio)
 
-                # 生成说话人2的音频
-                speaker2_audio = await self._generate_speaker_audio(
-                    text=dialogue.speaker_2,
-                    voice_name=dialogue.speaker_2_voice,
-                    output_prefix=f"speaker2_{i}",
-                    voice_rate=voice_rate,
-                    voice_volume=voice_volume
-                )
+            return self._finalize_audio(temp_audio_files, output_path, cancel_token)
 
-                # 合并当前轮对话的音频
-                dialogue_audio = self._merge_dialogue_audio(speaker1_audio, speaker2_audio)
-                temp_audio_files.append(dialogue_audio)
+        except Exception as e:
+            logger.error(f"生成播客音频失败: {str(e)}")
+            raise
+        finally:
+            # 清理临时文件
+            self._cleanup_temp_files(temp_audio_files)
+
+    async def generate_podcast_audio_stream(
+        self,
+        podcast_turns: AsyncIterable[PodcastScript],
+        output_path: str,
+        voice_rate: float = None,
+        voice_volume: float = None,
+        cancel_token: CancelToken = None,
+    ) -> Tuple[str, float, List[PodcastScript]]:
+        """
+        边接收对话边合成音频（用于流式生成的播客脚本）
 
-            # 合并所有对话音频
-            final_audio_path = self._concatenate_all_audio(temp_audio_files)
+        对话由后台任务持续读取到队列中，因此在合成第1轮音频时，
+        上游仍可继续生成后续对话。
 
-            # 如果合并成功且文件存在，复制到目标路径
-            if final_audio_path and os.path.exists(final_audio_path):
-                import shutil
-                shutil.copy2(final_audio_path, output_path)
-            elif temp_audio_files and os.path.exists(temp_audio_files[0]):
-                # 回退方案：使用第一个音频文件
-                import shutil
-                shutil.copy2(temp_audio_files[0], output_path)
+        Args:
+            podcast_turns: 逐轮产出对话的异步迭代器
+            output_path: 输出音频文件路径
+            voice_rate: 语速
+            voice_volume: 音量
+            cancel_token: 每轮对话之前检查任务是否已取消
 
-            # 获取音频时长
-            audio_duration = self._get_audio_file_duration(output_path)
+        Returns:
+            (音频文件路径, 音频时长, 完整的播客脚本)
+        """
+        voice_rate = voice_rate or self.default_voice_rate
+        voice_volume = voice_volume or self.default_voice_volume
 
-            logger.success(f"播客音频生成完成: {output_path}, 时长: {audio_duration:.2f}秒")
-            return output_path, audio_duration
+        queue: asyncio.Queue = asyncio.Queue()
+        _end = object()
 
-        except Exception as e:
-            logger.error(f"生成播客音频失败: {str(e)}")
+        async def _produce():
+            try:
+                async for turn in podcast_turns:
+                    await queue.put(turn)
+            except Exception as e:
+                await queue.put(e)
+                return
+            await queue.put(_end)
+
+        producer = asyncio.create_task(_produce())
+        podcast_script = []
+        temp_audio_files = []
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is _end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                podcast_script.append(item)
+                dialogue_audio = await self._generate_dialogue_audio(
+                    len(podcast_script) - 1, item, voice_rate, voice_volume, cancel_token
+                )
+                temp_audio_files.append(dialogue_audio)
+
+            if not podcast_script:
+                raise ValueError("播客脚本不能为空")
+
+            audio_path, audio_duration = self._finalize_audio(
+                temp_audio_files, output_path, cancel_token
+            )
+            return audio_path, audio_duration, podcast_script
+
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error(f"生成播客音频失败: {str(e)}")
             raise
         finally:
-            # 清理临时文件
+            producer.cancel()
             self._cleanup_temp_files(temp_audio_files)
 
+    async def _generate_dialogue_audio(
+        self,
+        index: int,
+        dialogue: PodcastScript,
+        voice_rate: float,
+        voice_volume: float,
+        cancel_token: CancelToken = None,
+    ) -> str:
+        """生成一轮对话（两位说话人）的音频，返回合并后的音频文件路径"""
+        logger.info(f"正在生成第 {index+1} 轮对话音频...")
+
+        # 生成说话人1的音频
+        speaker1_audio = await self._generate_speaker_audio(
+            text=dialogue.speaker_1,
+            voice_name=dialogue.speaker_1_voice,
+            output_prefix=f"speaker1_{index}",
+            voice_rate=voice_rate,
+            voice_volume=voice_volume
+        )
+
+        # 生成说话人2的音频
+        speaker2_audio = await self._generate_speaker_audio(
+            text=dialogue.speaker_2,
+            voice_name=dialogue.speaker_2_voice,
+            output_prefix=f"speaker2_{index}",
+            voice_rate=voice_rate,
+            voice_volume=voice_volume
+        )
+
+        # 合并当前轮对话的音频
+        return self._merge_dialogue_audio(speaker1_audio, speaker2_audio, cancel_token)
+
+    def _finalize_audio(
+        self, temp_audio_files: List[str], output_path: str, cancel_token: CancelToken = None
+    ) -> Tuple[str, float]:
+        """拼接所有对话音频并复制到目标路径，返回 (音频文件路径, 音频时长)"""
+        # 合并所有对话音频
+        final_audio_path = self._concatenate_all_audio(temp_audio_files, cancel_token)
+
+        # 如果合并成功且文件存在，复制到目标路径
+        if final_audio_path and os.path.exists(final_audio_path):
+            shutil.copy2(final_audio_path, output_path)
+        elif temp_audio_files and os.path.exists(temp_audio_files[0]):
+            # 回退方案：使用第一个音频文件
+            shutil.copy2(temp_audio_files[0], output_path)
+
+        # 获取音频时长
+        audio_duration = self._get_audio_file_duration(output_path)
+
+        logger.success(f"播客音频生成完成: {output_path}, 时长: {audio_duration:.2f}秒")
+        return output_path, audio_duration
+
     async def _generate_speaker_audio(
         self,
         text: str,
@@ -152,13 +252,16 @@ class PodcastAudioGenerator:
             logger.error(f"生成音频时出错 {output_prefix}: {str(e)}")
             return ""
 
-    def _merge_dialogue_audio(self, speaker1_audio: str, speaker2_audio: str) -> str:
+    def _merge_dialogue_audio(
+        self, speaker1_audio: str, speaker2_audio: str, cancel_token: CancelToken = None
+    ) -> str:
         """
         合并两个说话人的音频（添加停顿）
 
         Args:
             speaker1_audio: 说话人1音频文件路径
             speaker2_audio: 说话人2音频文件路径
+            cancel_token: 任务取消时结束 ffmpeg
 
         Returns:
             合并后的音频文件路径
@@ -196,7 +299,9 @@ class PodcastAudioGenerator:
             ]
 
             try:
-                result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+                result = cancellation.run(
+                    cmd, cancel_token, capture_output=True, text=True, check=True
+                )
                 logger.info(f"对话音频合并完成: {output_file}")
                 return output_file
             except subprocess.CalledProcessError as e:
@@ -214,16 +319,19 @@ class PodcastAudioGenerator:
                 except:
                     pass
 
+        except TaskCancelledError:
+            raise
         except Exception as e:
             logger.error(f"合并对话音频失败: {str(e)}")
             return ""
 
-    def _concatenate_all_audio(self, audio_files: List[str]) -> str:
+    def _concatenate_all_audio(self, audio_files: List[str], cancel_token: CancelToken = None) -> str:
         """
         拼接所有音频文件
 
         Args:
             audio_files: 音频文件路径列表
+            cancel_token: 任务取消时结束 ffmpeg
 
         Returns:
             拼接后的音频文件路径
@@ -255,7 +363,9 @@ class PodcastAudioGenerator:
             ]
 
             try:
-                result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+                result = cancellation.run(
+                    cmd, cancel_token, capture_output=True, text=True, check=True
+                )
                 logger.info(f"所有音频拼接完成: {output_file}")
                 return output_file
             except subprocess.CalledProcessError as e:
@@ -272,6 +382,8 @@ class PodcastAudioGenerator:
                 except:
                     pass
 
+        except TaskCancelledError:
+            raise
         except Exception as e:
             logger.error(f"拼接音频文件失败: {str(e)}")
             return valid_files[0] if valid_files else ""
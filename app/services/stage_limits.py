@@ -0,0 +1,55 @@
+"""Per-stage concurrency limits shared by all running tasks.
+
+The task workers bound how many tasks run at once, but the stages of those tasks
+compete for different resources: rendering is CPU-bound, TTS and footage downloads
+are network-bound. Each stage gets its own limit ([app.stage_limits] in config),
+so e.g. five tasks can synthesize audio while only two of them render.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from loguru import logger
+
+from app.config import config
+
+# 0 means unlimited (only bounded by max_concurrent_tasks)
+_default_stage_limits = {
+    "llm": 0,
+    "tts": 4,
+    "materials": 4,
+    "render": max(1, (os.cpu_count() or 2) // 2),
+}
+
+
+class StageLimiter:
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = dict(limits)
+        self._semaphores = {
+            stage: threading.BoundedSemaphore(limit)
+            for stage, limit in self.limits.items()
+            if limit and limit > 0
+        }
+
+    @contextmanager
+    def limit(self, stage: str):
+        semaphore = self._semaphores.get(stage)
+        if semaphore is None:
+            yield
+            return
+
+        start = time.monotonic()
+        semaphore.acquire()
+        waited = time.monotonic() - start
+        if waited >= 1:
+            logger.info(f"waited {waited:.1f}s for a free {stage} slot")
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+limiter = StageLimiter({**_default_stage_limits, **config.app.get("stage_limits", {})})
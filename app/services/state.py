@@ -1,8 +1,23 @@
 import ast
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from enum import Enum
+from typing import Dict, List
+
+from loguru import logger
+from pydantic import BaseModel
 
 from app.config import config
 from app.models import const
+from app.services import events
+from app.utils import utils
 
 
 # Base class for state management
@@ -19,18 +34,77 @@ class BaseState(ABC):
     def get_all_tasks(self, page: int, page_size: int):
         pass
 
+    @abstractmethod
+    def claim_key(self, key: str, value: str, ttl: float):
+        """
+        Atomically store value under key for ttl seconds unless the key is already
+        taken; returns None once stored, else the value already stored.
+        """
+        pass
+
+    @abstractmethod
+    def release_key(self, key: str, value: str):
+        """Delete key if it still holds value."""
+        pass
+
+    @abstractmethod
+    def add_duration(self, name: str, seconds: float):
+        """Remember how long a run of name (e.g. a pipeline stage) took, the last _duration_samples are kept."""
+        pass
+
+    @abstractmethod
+    def get_durations(self) -> Dict[str, List[float]]:
+        """name => the remembered durations, oldest first."""
+        pass
+
+    def close(self):
+        """Write out anything buffered, called on shutdown."""
+        pass
+
+    def migrate(self):
+        """Upgrade what older versions stored, called on startup."""
+        pass
+
+    @staticmethod
+    def _publish(task_id: str, fields: dict):
+        """The "state" event of an update, for the clients following the task (app.services.events)."""
+        events.publish(task_id, "state", fields, default=_json_default)
+
+
+_duration_samples = 50
+
 
 # Memory state management
 class MemoryState(BaseState):
-    def __init__(self):
-        self._tasks = {}
+    """
+    Tasks kept in creation order, updates are merged into the stored task.
+
+    Finished (complete or failed) tasks are evicted retention seconds after they
+    finished, and the oldest finished ones as soon as more than max_tasks are stored
+    (0: no limit). Running tasks are never evicted.
+    """
+
+    def __init__(self, max_tasks: int = 0, retention: float = 0):
+        self.max_tasks = max_tasks
+        self.retention = retention
+        self._tasks = OrderedDict()
+        # finished task ids in the order they finished, so eviction pops from the front
+        self._finished = OrderedDict()
+        # key => (value, expires at), in the order the keys were claimed
+        self._keys = OrderedDict()
+        self._durations = {}
+        self._lock = threading.Lock()
 
     def get_all_tasks(self, page: int, page_size: int):
+        # newest first, like RedisState; walks only up to the requested page
         start = (page - 1) * page_size
-        end = start + page_size
-        tasks = list(self._tasks.values())
-        total = len(tasks)
-        return tasks[start:end], total
+        with self._lock:
+            self._evict()
+            tasks = [
+                dict(task)
+                for task in itertools.islice(reversed(self._tasks.values()), start, start + page_size)
+            ]
+            return tasks, len(self._tasks)
 
     def update_task(
         self,
@@ -43,48 +117,120 @@ class MemoryState(BaseState):
         if progress > 100:
             progress = 100
 
-        self._tasks[task_id] = {
-            "task_id": task_id,
-            "state": state,
-            "progress": progress,
-            **kwargs,
-        }
+        with self._lock:
+            task = self._tasks.setdefault(task_id, {})
+            task.update(task_id=task_id, state=state, progress=progress, **kwargs)
+            if state == const.TASK_STATE_PROCESSING:
+                self._finished.pop(task_id, None)
+            else:
+                self._finished[task_id] = time.monotonic()
+                self._finished.move_to_end(task_id)
+            self._evict()
+        self._publish(task_id, dict(task_id=task_id, state=state, progress=progress, **kwargs))
 
     def get_task(self, task_id: str):
-        return self._tasks.get(task_id, None)
+        with self._lock:
+            self._evict()
+            task = self._tasks.get(task_id, None)
+            return dict(task) if task is not None else None
 
     def delete_task(self, task_id: str):
-        if task_id in self._tasks:
-            del self._tasks[task_id]
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._finished.pop(task_id, None)
+
+    def claim_key(self, key: str, value: str, ttl: float):
+        now = time.monotonic()
+        with self._lock:
+            while self._keys and next(iter(self._keys.values()))[1] <= now:
+                self._keys.popitem(last=False)
+            stored = self._keys.get(key)
+            if stored and stored[1] > now:
+                return stored[0]
+            self._keys[key] = (value, now + ttl)
+            self._keys.move_to_end(key)
+            return None
+
+    def release_key(self, key: str, value: str):
+        with self._lock:
+            stored = self._keys.get(key)
+            if stored and stored[0] == value:
+                del self._keys[key]
+
+    def add_duration(self, name: str, seconds: float):
+        with self._lock:
+            self._durations.setdefault(name, deque(maxlen=_duration_samples)).append(seconds)
+
+    def get_durations(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {name: list(samples) for name, samples in self._durations.items()}
+
+    def _evict(self):
+        if self.retention:
+            expired_before = time.monotonic() - self.retention
+            while self._finished and next(iter(self._finished.values())) < expired_before:
+                task_id, _ = self._finished.popitem(last=False)
+                self._tasks.pop(task_id, None)
+        if self.max_tasks:
+            while len(self._tasks) > self.max_tasks and self._finished:
+                task_id, _ = self._finished.popitem(last=False)
+                self._tasks.pop(task_id, None)
+
+
+# Redis tasks are stored as a hash of JSON encoded fields, _schema tells the encoding apart
+# from the former str()/literal_eval one (no _schema field)
+_schema_field = "_schema"
+_schema_version = 2
+# task hashes live under their own prefix, the sorted set indexes them by creation time
+_task_key_prefix = "task:"
+_task_index_key = "task_index"
+# set once the tasks stored under the bare task id were moved under the prefix
+_task_keys_migrated_key = "task_keys_migrated"
+_claim_key_prefix = "claim:"
+_duration_key_prefix = "duration:"
+_duration_names_key = "duration_names"
+
+
+def _json_default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", warnings=False)
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "__dict__"):
+        return value.__dict__
+    return str(value)
 
 
 # Redis state management
 class RedisState(BaseState):
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
-        import redis
+    def __init__(self, host="localhost", port=6379, db=0, password=None, redis_client=None):
+        if redis_client is None:
+            import redis
+
+            redis_client = redis.StrictRedis(host=host, port=port, db=db, password=password)
+        self._redis = redis_client
 
-        self._redis = redis.StrictRedis(host=host, port=port, db=db, password=password)
+    @staticmethod
+    def _key(task_id: str) -> str:
+        return f"{_task_key_prefix}{task_id}"
 
     def get_all_tasks(self, page: int, page_size: int):
+        # newest first: ZREVRANGE on the creation time index, then one batch of HGETALL
         start = (page - 1) * page_size
-        end = start + page_size
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zcard(_task_index_key)
+        pipe.zrevrange(_task_index_key, start, start + page_size - 1)
+        total, task_ids = pipe.execute()
+        if not task_ids:
+            return [], total
+
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._key(task_id.decode("utf-8")))
         tasks = []
-        cursor = 0
-        total = 0
-        while True:
-            cursor, keys = self._redis.scan(cursor, count=page_size)
-            total += len(keys)
-            if total > start:
-                for key in keys[max(0, start - total):end - total]:
-                    task_data = self._redis.hgetall(key)
-                    task = {
-                        k.decode("utf-8"): self._convert_to_original_type(v) for k, v in task_data.items()
-                    }
-                    tasks.append(task)
-                    if len(tasks) >= page_size:
-                        break
-            if cursor == 0 or len(tasks) >= page_size:
-                break
+        for task_data in pipe.execute():
+            if task_data:
+                tasks.append(self._decode_task(task_data))
         return tasks, total
 
     def update_task(
@@ -105,28 +251,126 @@ class RedisState(BaseState):
             **kwargs,
         }
 
-        for field, value in fields.items():
-            self._redis.hset(task_id, field, str(value))
+        # one HSET for all fields: a single round trip however many fields are updated
+        mapping = {field: self._encode_value(value) for field, value in fields.items()}
+        mapping[_schema_field] = _schema_version
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hset(self._key(task_id), mapping=mapping)
+        # NX: the score stays the time the task was created
+        pipe.zadd(_task_index_key, {task_id: time.time()}, nx=True)
+        # the clients following the task, on any api node (see app.services.events)
+        pipe.publish(events.channel(task_id), events.encode("state", fields, _json_default))
+        pipe.execute()
 
     def get_task(self, task_id: str):
-        task_data = self._redis.hgetall(task_id)
+        task_data = self._redis.hgetall(self._key(task_id))
         if not task_data:
             return None
+        return self._decode_task(task_data)
 
-        task = {
-            key.decode("utf-8"): self._convert_to_original_type(value)
-            for key, value in task_data.items()
-        }
+    def migrate(self):
+        """
+        Move the tasks stored before the key prefix, under the bare task id, to
+        task:<id> and into the index. Runs once per database, any api node or worker
+        starting first does it.
+        """
+        if not self._redis.set(_task_keys_migrated_key, _schema_version, nx=True):
+            return
+        moved = 0
+        for key in self._redis.scan_iter(count=1000):
+            name = key.decode("utf-8", errors="replace")
+            # the legacy task ids are uuids, every other key of ours has a ":" or is known
+            if ":" in name or name in (_task_index_key, _duration_names_key, _task_keys_migrated_key):
+                continue
+            if self._redis.type(key) != b"hash" or self._redis.hget(key, "task_id") != key:
+                continue
+            pipe = self._redis.pipeline(transaction=True)
+            pipe.renamenx(key, self._key(name))
+            pipe.zadd(_task_index_key, {name: time.time()}, nx=True)
+            try:
+                pipe.execute()
+                moved += 1
+            except Exception as e:
+                logger.warning(f"failed to migrate task {name}: {str(e)}")
+        if moved:
+            logger.info(f"moved {moved} tasks stored by an older version under {_task_key_prefix}")
+
+    @staticmethod
+    def _encode_value(value) -> str:
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+    def _decode_task(self, task_data: dict) -> dict:
+        schema = task_data.pop(_schema_field.encode("utf-8"), None)
+        task = {}
+        for key, value in task_data.items():
+            key = key.decode("utf-8")
+            if schema is None:
+                task[key] = self._convert_to_original_type(value)
+                continue
+            try:
+                task[key] = json.loads(value)
+            except ValueError:
+                # a field written before the task was updated with the JSON schema
+                task[key] = self._convert_to_original_type(value)
         return task
 
     def delete_task(self, task_id: str):
-        self._redis.delete(task_id)
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.delete(self._key(task_id))
+        pipe.zrem(_task_index_key, task_id)
+        pipe.execute()
+
+    def claim_key(self, key: str, value: str, ttl: float):
+        key = f"{_claim_key_prefix}{key}"
+        while True:
+            if self._redis.set(key, value, nx=True, px=int(ttl * 1000)):
+                return None
+            stored = self._redis.get(key)
+            # None: expired between the SET and the GET
+            if stored is not None:
+                return stored.decode("utf-8")
+
+    def release_key(self, key: str, value: str):
+        import redis
+
+        key = f"{_claim_key_prefix}{key}"
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                stored = pipe.get(key)
+                if stored is None or stored.decode("utf-8") != value:
+                    pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+            except redis.WatchError:
+                # changed meanwhile, it is not ours anymore
+                pass
+
+    def add_duration(self, name: str, seconds: float):
+        key = f"{_duration_key_prefix}{name}"
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.sadd(_duration_names_key, name)
+        pipe.rpush(key, seconds)
+        pipe.ltrim(key, -_duration_samples, -1)
+        pipe.execute()
+
+    def get_durations(self) -> Dict[str, List[float]]:
+        names = sorted(n.decode("utf-8") for n in self._redis.smembers(_duration_names_key))
+        pipe = self._redis.pipeline(transaction=False)
+        for name in names:
+            pipe.lrange(f"{_duration_key_prefix}{name}", 0, -1)
+        return {
+            name: [float(v) for v in samples]
+            for name, samples in zip(names, pipe.execute())
+        }
 
     @staticmethod
     def _convert_to_original_type(value):
         """
-        Convert the value from byte string to its original data type.
-        You can extend this method to handle other data types as needed.
+        Convert a value written by the old str() encoding back to its original data type.
+        Only used for tasks stored before the JSON schema.
         """
         value_str = value.decode("utf-8")
 
@@ -142,6 +386,231 @@ class RedisState(BaseState):
         return value_str
 
 
+def sqlite_connect(path: str) -> sqlite3.Connection:
+    """Connection shared by the threads of one process, callers serialize access with a lock."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+    # WAL: readers do not block the writer, and a commit is a single append
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def sqlite_transaction(conn: sqlite3.Connection, begin: str = "BEGIN"):
+    """Commits when the block succeeds (or returns), rolls back when it raises."""
+    conn.execute(begin)
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# SQLite state management, durable task history for single node deployments
+class SqliteState(BaseState):
+    """
+    Tasks in an embedded SQLite database (WAL mode). state and progress are columns,
+    the other fields a JSON object merged on every update.
+
+    Progress ticks (a running task updating only its progress) are buffered and
+    written in one transaction every flush_interval seconds; get_task sees them
+    right away, a crash loses at most flush_interval seconds of progress.
+    Finished tasks are deleted retention seconds after their last update (0: kept).
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1, retention: float = 0):
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._last_purge = 0.0
+        self._conn = sqlite_connect(path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                state INTEGER NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL DEFAULT '{}',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at);
+            CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks (state, updated_at);
+            CREATE TABLE IF NOT EXISTS claimed_keys (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_claimed_keys_expires_at ON claimed_keys (expires_at);
+            CREATE TABLE IF NOT EXISTS durations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                seconds REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_durations_name ON durations (name, id);
+            """
+        )
+
+    def get_all_tasks(self, page: int, page_size: int):
+        with self._lock:
+            self._flush()
+            total = self._conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT task_id, state, progress, data FROM tasks"
+                " ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (page_size, (page - 1) * page_size),
+            ).fetchall()
+        return [self._decode_row(row) for row in rows], total
+
+    def update_task(
+        self,
+        task_id: str,
+        state: int = const.TASK_STATE_PROCESSING,
+        progress: int = 0,
+        **kwargs,
+    ):
+        progress = int(progress)
+        if progress > 100:
+            progress = 100
+
+        now = time.time()
+        with self._lock:
+            if state == const.TASK_STATE_PROCESSING and progress and not kwargs:
+                self._pending[task_id] = (state, progress, now)
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush()
+            else:
+                self._write(task_id, state, progress, kwargs, now)
+        # progress ticks are pushed right away, before they are flushed
+        self._publish(task_id, dict(task_id=task_id, state=state, progress=progress, **kwargs))
+
+    def _write(self, task_id: str, state: int, progress: int, kwargs: dict, now: float):
+        # a full update supersedes the buffered progress of the task
+        self._pending.pop(task_id, None)
+        row = self._conn.execute(
+            "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        data = json.loads(row[0]) if row else {}
+        data.update(
+            json.loads(json.dumps(kwargs, ensure_ascii=False, default=_json_default))
+        )
+        self._conn.execute(
+            "INSERT INTO tasks (task_id, state, progress, data, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (task_id) DO UPDATE SET state = excluded.state,"
+            " progress = excluded.progress, data = excluded.data, updated_at = excluded.updated_at",
+            (task_id, state, progress, json.dumps(data, ensure_ascii=False), now, now),
+        )
+        self._purge()
+
+    def get_task(self, task_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT task_id, state, progress, data FROM tasks WHERE task_id = ?",
+                (task_id,),
+            ).fetchone()
+            pending = self._pending.get(task_id)
+        if row is None and pending is None:
+            return None
+        task = self._decode_row(row) if row else {"task_id": task_id}
+        if pending:
+            task["state"], task["progress"] = pending[0], pending[1]
+        return task
+
+    def delete_task(self, task_id: str):
+        with self._lock:
+            self._pending.pop(task_id, None)
+            self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def claim_key(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            with sqlite_transaction(self._conn, "BEGIN IMMEDIATE"):
+                self._conn.execute("DELETE FROM claimed_keys WHERE expires_at <= ?", (now,))
+                row = self._conn.execute(
+                    "SELECT value FROM claimed_keys WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT INTO claimed_keys (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, now + ttl),
+                    )
+        return row[0] if row else None
+
+    def release_key(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM claimed_keys WHERE key = ? AND value = ?", (key, value)
+            )
+
+    def add_duration(self, name: str, seconds: float):
+        with self._lock:
+            with sqlite_transaction(self._conn):
+                self._conn.execute(
+                    "INSERT INTO durations (name, seconds) VALUES (?, ?)", (name, seconds)
+                )
+                self._conn.execute(
+                    """
+                    DELETE FROM durations WHERE name = ? AND id <= (
+                        SELECT id FROM durations WHERE name = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                    """,
+                    (name, name, _duration_samples),
+                )
+
+    def get_durations(self) -> Dict[str, List[float]]:
+        durations = {}
+        with self._lock:
+            rows = self._conn.execute("SELECT name, seconds FROM durations ORDER BY id").fetchall()
+        for name, seconds in rows:
+            durations.setdefault(name, []).append(seconds)
+        return durations
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        with sqlite_transaction(self._conn):
+            self._conn.executemany(
+                "INSERT INTO tasks (task_id, state, progress, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (task_id) DO UPDATE SET state = excluded.state,"
+                " progress = excluded.progress, updated_at = excluded.updated_at",
+                [
+                    (task_id, state, progress, updated_at, updated_at)
+                    for task_id, (state, progress, updated_at) in pending.items()
+                ],
+            )
+
+    def _purge(self):
+        if not self.retention or time.monotonic() - self._last_purge < 60:
+            return
+        self._last_purge = time.monotonic()
+        self._conn.execute(
+            "DELETE FROM tasks WHERE state != ? AND updated_at < ?",
+            (const.TASK_STATE_PROCESSING, time.time() - self.retention),
+        )
+
+    @staticmethod
+    def _decode_row(row) -> dict:
+        task_id, state, progress, data = row
+        return {"task_id": task_id, "state": state, "progress": progress, **json.loads(data)}
+
+
+def sqlite_path_from_config() -> str:
+    return config.app.get("sqlite_path", "") or utils.storage_dir("tasks.db")
+
+
 # Global state
 _enable_redis = config.app.get("enable_redis", False)
 _redis_host = config.app.get("redis_host", "localhost")
@@ -149,10 +618,16 @@ _redis_port = config.app.get("redis_port", 6379)
 _redis_db = config.app.get("redis_db", 0)
 _redis_password = config.app.get("redis_password", None)
 
-state = (
-    RedisState(
+if _enable_redis:
+    state = RedisState(
         host=_redis_host, port=_redis_port, db=_redis_db, password=_redis_password
     )
-    if _enable_redis
-    else MemoryState()
-)
+elif config.app.get("enable_sqlite", False):
+    state = SqliteState(
+        sqlite_path_from_config(), retention=config.app.get("task_retention", 86400)
+    )
+else:
+    state = MemoryState(
+        max_tasks=config.app.get("memory_state_max_tasks", 1000),
+        retention=config.app.get("task_retention", 86400),
+    )
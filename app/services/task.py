@@ -2,20 +2,36 @@ import asyncio
 import math
 import os
 import os.path
+import pickle
 import re
+import time
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from os import path
+from typing import List
 
 from loguru import logger
 
 from app.config import config
 from app.models import const
+from app.models.exception import TaskCancelledError
 from app.models.schema import VideoConcatMode, VideoParams
-from app.services import llm, material, subtitle, video, voice
-from app.services import podcast_audio
+from app.services import cancellation, eta, llm, material, subtitle, video, voice
+from app.services import pipeline, podcast_audio, webhooks
+from app.services.cancellation import CancelToken
+from app.services.checkpoint import Checkpoints
 from app.services import state as sm
+from app.services.stage_limits import limiter
 from app.utils import utils
 
 
+def mark_failed(task_id):
+    # a cancelled task keeps its state, its stages may still fail while they stop
+    if not cancellation.is_cancelled(task_id):
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+
+
 def generate_script(task_id, params):
     logger.info("\n\n## generating video script")
 
@@ -35,12 +51,13 @@ def generate_script(task_id, params):
             video_subject=getattr(params, 'video_subject', ''),
             language=params.video_language,
             paragraph_number=params.paragraph_number,
+            use_cache=params.use_llm_cache,
         )
     else:
         logger.debug(f"video script: \n{video_script}")
 
     if not video_script:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        mark_failed(task_id)
         logger.error("failed to generate video script.")
         return None
 
@@ -60,22 +77,75 @@ def generate_podcast_script(task_id, params):
     if params.article_text:
         podcast_script = llm.generate_podcast_script(
             article_text=params.article_text,
-            language=params.video_language
+            language=params.video_language,
+            use_cache=params.use_llm_cache,
         )
 
         if not podcast_script:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            mark_failed(task_id)
             logger.error("failed to generate podcast script.")
             return None
 
         logger.debug(f"generated podcast script: {len(podcast_script)} turns")
         return podcast_script
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+    mark_failed(task_id)
     logger.error("no article text provided for podcast mode.")
     return None
 
 
+def can_stream_script_to_audio(params) -> bool:
+    """
+    需要从文章生成播客脚本时，可以流式接收对话并逐轮合成音频
+    """
+    return bool(
+        getattr(params, "podcast_mode", False)
+        and not params.podcast_script
+        and params.article_text
+        and config.app.get("podcast", {}).get("stream_script", True)
+        # 长文章按段并发生成（map-reduce），不走单次流式请求
+        and not llm.use_chunked_podcast_script(params.article_text)
+    )
+
+
+def generate_podcast_script_and_audio(task_id, params, cancel_token: CancelToken = None):
+    """流式生成播客脚本，并在收到每轮对话后立即合成音频，返回 (podcast_script, (audio_file, audio_duration, sub_maker))"""
+    logger.info("\n\n## generating podcast script and audio (streaming)")
+
+    audio_file = path.join(utils.task_dir(task_id), "audio.mp3")
+
+    try:
+        audio_path, audio_duration, podcast_script = asyncio.run(
+            podcast_audio.podcast_audio_generator.generate_podcast_audio_stream(
+                podcast_turns=llm.astream_podcast_script(
+                    article_text=params.article_text,
+                    language=params.video_language,
+                    use_cache=params.use_llm_cache,
+                ),
+                output_path=audio_file,
+                voice_rate=getattr(params, 'voice_rate', 1.0),
+                voice_volume=getattr(params, 'voice_volume', 1.0),
+                cancel_token=cancel_token,
+            )
+        )
+    except TaskCancelledError:
+        raise
+    except Exception as e:
+        mark_failed(task_id)
+        logger.error(f"failed to generate podcast script and audio: {str(e)}")
+        return None, (None, None, None)
+
+    logger.debug(f"generated podcast script: {len(podcast_script)} turns")
+
+    if not audio_path or not os.path.exists(audio_path):
+        mark_failed(task_id)
+        logger.error("failed to generate podcast audio file.")
+        return podcast_script, (None, None, None)
+
+    logger.info(f"podcast audio generated: {audio_path}, duration: {audio_duration}s")
+    return podcast_script, (audio_path, audio_duration, None)
+
+
 def generate_terms(task_id, params, video_script):
     logger.info("\n\n## generating video terms")
 
@@ -88,38 +158,50 @@ def generate_terms(task_id, params, video_script):
     video_terms = params.video_terms
     if not video_terms:
         video_terms = llm.generate_terms(
-            video_subject=params.video_subject, video_script=video_script, amount=5
+            video_subject=params.video_subject,
+            video_script=video_script,
+            amount=5,
+            use_cache=params.use_llm_cache,
         )
     else:
-        if isinstance(video_terms, str):
-            video_terms = [term.strip() for term in re.split(r"[,，]", video_terms)]
-        elif isinstance(video_terms, list):
-            video_terms = [term.strip() for term in video_terms]
-        else:
-            raise ValueError("video_terms must be a string or a list of strings.")
-
+        video_terms = _normalize_video_terms(video_terms)
         logger.debug(f"video terms: {utils.to_json(video_terms)}")
 
     if not video_terms:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        mark_failed(task_id)
         logger.error("failed to generate video terms.")
         return None
 
     return video_terms
 
 
+def _normalize_video_terms(video_terms):
+    if isinstance(video_terms, str):
+        return [term.strip() for term in re.split(r"[,，]", video_terms)]
+    elif isinstance(video_terms, list):
+        return [term.strip() for term in video_terms]
+    raise ValueError("video_terms must be a string or a list of strings.")
+
+
 def generate_podcast_terms(task_id, params, podcast_script):
     """从播客脚本生成搜索词"""
     logger.info("\n\n## generating podcast search terms")
 
+    # 调用方（如WebUI）已经提取过关键词时直接使用，避免重复请求LLM
+    if params.video_terms:
+        video_terms = _normalize_video_terms(params.video_terms)
+        logger.debug(f"podcast search terms: {utils.to_json(video_terms)}")
+        return video_terms
+
     # 使用播客脚本生成搜索词
     video_terms = llm.generate_terms_from_podcast(
         podcast_script=podcast_script,
-        amount=5
+        amount=5,
+        use_cache=params.use_llm_cache,
     )
 
     if not video_terms:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        mark_failed(task_id)
         logger.error("failed to generate podcast search terms.")
         return None
 
@@ -150,13 +232,13 @@ def save_script_data(task_id, video_script, video_terms, params):
         f.write(utils.to_json(script_data))
 
 
-def generate_audio(task_id, params, video_script):
+def generate_audio(task_id, params, video_script, cancel_token: CancelToken = None):
     logger.info("\n\n## generating audio")
 
     # 检查是否是播客模式
     if hasattr(params, 'podcast_mode') and params.podcast_mode:
         logger.info("Using podcast mode for audio generation")
-        return generate_podcast_audio(task_id, params, video_script)
+        return generate_podcast_audio(task_id, params, video_script, cancel_token)
 
     # 传统模式
     audio_file = path.join(utils.task_dir(task_id), "audio.mp3")
@@ -167,7 +249,7 @@ def generate_audio(task_id, params, video_script):
         voice_file=audio_file,
     )
     if sub_maker is None:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        mark_failed(task_id)
         logger.error(
             """failed to generate audio:
 1. check if the language of the voice matches the language of the video script.
@@ -180,7 +262,7 @@ def generate_audio(task_id, params, video_script):
     return audio_file, audio_duration, sub_maker
 
 
-def generate_podcast_audio(task_id, params, podcast_script):
+def generate_podcast_audio(task_id, params, podcast_script, cancel_token: CancelToken = None):
     """生成播客音频"""
     logger.info("\n\n## generating podcast audio")
 
@@ -192,19 +274,22 @@ def generate_podcast_audio(task_id, params, podcast_script):
             podcast_script=podcast_script,
             output_path=audio_file,
             voice_rate=getattr(params, 'voice_rate', 1.0),
-            voice_volume=getattr(params, 'voice_volume', 1.0)
+            voice_volume=getattr(params, 'voice_volume', 1.0),
+            cancel_token=cancel_token,
         ))
 
         if not audio_path or not os.path.exists(audio_path):
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            mark_failed(task_id)
             logger.error("failed to generate podcast audio file.")
             return None, None, None
 
         logger.info(f"podcast audio generated: {audio_path}, duration: {audio_duration}s")
         return audio_path, audio_duration, None  # 播客模式不需要sub_maker
 
+    except TaskCancelledError:
+        raise
     except Exception as e:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        mark_failed(task_id)
         logger.error(f"failed to generate podcast audio: {str(e)}")
         return None, None, None
 
@@ -225,10 +310,15 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     # 传统模式
     subtitle_fallback = False
     if subtitle_provider == "edge":
-        voice.create_subtitle(
-            text=video_script, sub_maker=sub_maker, subtitle_file=subtitle_path
-        )
-        if not os.path.exists(subtitle_path):
+        if sub_maker is None:
+            # 音频从检查点恢复时没有字词时间戳
+            subtitle_fallback = True
+            logger.warning("no word boundaries for the audio, fallback to whisper")
+        else:
+            voice.create_subtitle(
+                text=video_script, sub_maker=sub_maker, subtitle_file=subtitle_path
+            )
+        if not subtitle_fallback and not os.path.exists(subtitle_path):
             subtitle_fallback = True
             logger.warning("subtitle file not found, fallback to whisper")
 
@@ -445,7 +535,7 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
             materials=params.video_materials, clip_duration=params.video_clip_duration
         )
         if not materials:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            mark_failed(task_id)
             logger.error(
                 "no valid materials found, please check the materials and try again."
             )
@@ -468,7 +558,7 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
             is_podcast_mode=is_podcast_mode,
         )
         if not downloaded_videos:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            mark_failed(task_id)
             logger.error(
                 "failed to download videos, maybe the network is not available. if you are in China, please use a VPN."
             )
@@ -476,60 +566,363 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
         return downloaded_videos
 
 
+def estimate_audio_duration(video_script, params) -> int:
+    """
+    估算脚本的朗读时长（秒），用于在TTS完成前就开始下载素材。
+    素材不足时 combine_videos 会循环片段，估算偏短只会减少画面变化
+    """
+    if isinstance(video_script, list):
+        # 播客脚本：PodcastScript 对象或字典
+        parts = []
+        for turn in video_script:
+            if isinstance(turn, dict):
+                parts += [turn.get("speaker_1", ""), turn.get("speaker_2", "")]
+            else:
+                parts += [getattr(turn, "speaker_1", ""), getattr(turn, "speaker_2", "")]
+        text = " ".join(parts)
+    else:
+        text = video_script or ""
+
+    # 中文约每秒4.5字，英文约每秒2.5词
+    cjk_chars = len(re.findall(r"[\u4e00-\u9fff]", text))
+    words = len(re.findall(r"[A-Za-z0-9']+", text))
+    seconds = cjk_chars / 4.5 + words / 2.5
+    voice_rate = getattr(params, "voice_rate", 1.0) or 1.0
+    return max(1, math.ceil(seconds / voice_rate * 1.2))
+
+
+def render_video(
+    index,
+    task_dir,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    params,
+    video_concat_mode,
+    video_transition_mode,
+    cancel_token: CancelToken = None,
+):
+    """合成第 index 个视频，在渲染进程池中运行，因此只使用可序列化的参数，不更新任务状态"""
+    if cancel_token is None:
+        return _render_video(
+            index, task_dir, downloaded_videos, audio_file, subtitle_path,
+            params, video_concat_mode, video_transition_mode, None,
+        )
+    # 任务取消时结束本进程启动的 ffmpeg
+    with cancel_token.watch():
+        return _render_video(
+            index, task_dir, downloaded_videos, audio_file, subtitle_path,
+            params, video_concat_mode, video_transition_mode, cancel_token,
+        )
+
+
+def _render_video(
+    index,
+    task_dir,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    params,
+    video_concat_mode,
+    video_transition_mode,
+    cancel_token,
+):
+    combined_video_path = path.join(task_dir, f"combined-{index}.mp4")
+    logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
+    video.combine_videos(
+        combined_video_path=combined_video_path,
+        video_paths=downloaded_videos,
+        audio_file=audio_file,
+        video_aspect=params.video_aspect,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        max_clip_duration=params.video_clip_duration,
+        threads=params.n_threads,
+        cancel_token=cancel_token,
+    )
+
+    if cancel_token:
+        cancel_token.raise_if_cancelled()
+    final_video_path = path.join(task_dir, f"final-{index}.mp4")
+    logger.info(f"\n\n## generating video: {index} => {final_video_path}")
+    video.generate_video(
+        video_path=combined_video_path,
+        audio_path=audio_file,
+        subtitle_path=subtitle_path,
+        output_file=final_video_path,
+        params=params,
+        cancel_token=cancel_token,
+    )
+    return final_video_path, combined_video_path
+
+
 def generate_final_videos(
-    task_id, params, downloaded_videos, audio_file, subtitle_path
+    task_id, params, downloaded_videos, audio_file, subtitle_path, cancel_token: CancelToken = None
 ):
-    final_video_paths = []
-    combined_video_paths = []
     video_concat_mode = (
         params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
     )
     video_transition_mode = params.video_transition_mode
+    task_dir = utils.task_dir(task_id)
+    jobs = {
+        index: (
+            index,
+            task_dir,
+            downloaded_videos,
+            audio_file,
+            subtitle_path,
+            params,
+            video_concat_mode,
+            video_transition_mode,
+            cancel_token,
+        )
+        for index in range(1, params.video_count + 1)
+    }
 
+    results = {}
     _progress = 50
-    for i in range(params.video_count):
-        index = i + 1
-        combined_video_path = path.join(
-            utils.task_dir(task_id), f"combined-{index}.mp4"
-        )
-        logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
-        video.combine_videos(
-            combined_video_path=combined_video_path,
-            video_paths=downloaded_videos,
-            audio_file=audio_file,
-            video_aspect=params.video_aspect,
-            video_concat_mode=video_concat_mode,
-            video_transition_mode=video_transition_mode,
-            max_clip_duration=params.video_clip_duration,
-            threads=params.n_threads,
-        )
 
-        _progress += 50 / params.video_count / 2
+    def _video_done(index, result):
+        nonlocal _progress
+        if cancel_token:
+            # must not set a cancelled task back to processing
+            cancel_token.raise_if_cancelled()
+        results[index] = result
+        _progress += 50 / params.video_count
         sm.state.update_task(task_id, progress=_progress)
 
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
+    # 渲染是CPU密集型任务，交给进程池，避免与其他任务的线程争抢GIL
+    pool = pipeline.cpu_pool()
+    if pool:
+        try:
+            futures = {pool.submit(render_video, *job): index for index, job in jobs.items()}
+            for future in as_completed(futures):
+                _video_done(futures[future], future.result())
+        except (BrokenProcessPool, pickle.PicklingError) as e:
+            logger.warning(f"render process pool is not available, rendering in this thread: {str(e)}")
+            pipeline.reset_cpu_pool()
+
+    for index, job in jobs.items():
+        if index not in results:
+            _video_done(index, render_video(*job))
+
+    final_video_paths = [results[index][0] for index in sorted(results)]
+    combined_video_paths = [results[index][1] for index in sorted(results)]
+    return final_video_paths, combined_video_paths
 
-        logger.info(f"\n\n## generating video: {index} => {final_video_path}")
-        video.generate_video(
-            video_path=combined_video_path,
-            audio_path=audio_file,
-            subtitle_path=subtitle_path,
-            output_file=final_video_path,
-            params=params,
+
+def _script_stage(task_id, params, stop_at, cancel_token, context):
+    if stop_at not in ["script", "terms"] and can_stream_script_to_audio(params):
+        # 1+3. synthesize each dialogue turn as soon as the llm has written it
+        with limiter.limit("llm"), limiter.limit("tts"):
+            video_script, audio_result = generate_podcast_script_and_audio(
+                task_id, params, cancel_token
+            )
+        outputs = {"video_script": video_script, "audio_result": audio_result}
+    else:
+        with limiter.limit("llm"):
+            video_script = generate_script(task_id, params)
+        outputs = {"video_script": video_script}
+    if not video_script or (isinstance(video_script, str) and "Error: " in video_script):
+        return None
+    return outputs
+
+
+def _terms_stage(task_id, params, context):
+    video_script = context["video_script"]
+    video_terms = ""
+    if params.video_source != "local":
+        with limiter.limit("llm"):
+            video_terms = generate_terms(task_id, params, video_script)
+        if not video_terms:
+            return None
+
+    save_script_data(task_id, video_script, video_terms, params)
+    return {"video_terms": video_terms}
+
+
+def _audio_stage(task_id, params, cancel_token, context):
+    # 流式生成播客脚本时，音频已在脚本阶段合成
+    audio_result = context.get("audio_result")
+    if audio_result is None:
+        with limiter.limit("tts"):
+            audio_result = generate_audio(
+                task_id, params, context["video_script"], cancel_token
+            )
+    if not audio_result[0]:
+        return None
+    return {"audio_result": audio_result}
+
+
+def _subtitle_stage(task_id, params, context):
+    audio_file, _, sub_maker = context["audio_result"]
+    subtitle_path = generate_subtitle(
+        task_id, params, context["video_script"], sub_maker, audio_file
+    )
+    return {"subtitle_path": subtitle_path or ""}
+
+
+def _materials_stage(task_id, params, context):
+    # 素材只依赖搜索词和时长：音频尚未完成时按脚本估算时长，与TTS并行下载
+    audio_result = context.get("audio_result")
+    if audio_result and audio_result[1]:
+        audio_duration = audio_result[1]
+    else:
+        audio_duration = estimate_audio_duration(context["video_script"], params)
+        logger.info(f"audio is not ready yet, estimated duration: {audio_duration}s")
+
+    with limiter.limit("materials"):
+        downloaded_videos = get_video_materials(
+            task_id, params, context["video_terms"], audio_duration
         )
+    if not downloaded_videos:
+        return None
+    return {"downloaded_videos": downloaded_videos}
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
 
-        final_video_paths.append(final_video_path)
-        combined_video_paths.append(combined_video_path)
+def _render_stage(task_id, params, cancel_token, context):
+    with limiter.limit("render"):
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id,
+            params,
+            context["downloaded_videos"],
+            context["audio_result"][0],
+            context["subtitle_path"],
+            cancel_token,
+        )
+    if not final_video_paths:
+        return None
+    return {
+        "final_video_paths": final_video_paths,
+        "combined_video_paths": combined_video_paths,
+    }
+
+
+# stage => the stages it depends on
+stage_inputs = {
+    "script": [],
+    "terms": ["script"],
+    "audio": ["script"],
+    "subtitle": ["audio"],
+    "materials": ["terms"],
+    "render": ["audio", "subtitle", "materials"],
+}
+
+
+def _stage_inputs(stop_at: str) -> dict:
+    if stop_at != "materials":
+        return stage_inputs
+    # a task stopping at the materials runs the audio (and subtitle) first, like the
+    # sequential pipeline did, the materials are sized by the real audio duration
+    return {**stage_inputs, "materials": ["terms", "audio", "subtitle"]}
+
+
+def _timed(name, func):
+    """Remember how long the stage took when it succeeds, for the ETA of new tasks (app.services.eta)."""
+
+    def run(context):
+        started = time.monotonic()
+        outputs = func(context)
+        if outputs is not None:
+            try:
+                sm.state.add_duration(name, time.monotonic() - started)
+            except Exception as e:
+                logger.warning(f"failed to record the duration of stage {name}: {str(e)}")
+        return outputs
+
+    return run
+
+
+def build_stages(
+    task_id,
+    params,
+    stop_at="video",
+    checkpoints: Checkpoints = None,
+    cancel_token: CancelToken = None,
+):
+    funcs = {
+        "script": partial(_script_stage, task_id, params, stop_at, cancel_token),
+        "terms": partial(_terms_stage, task_id, params),
+        "audio": partial(_audio_stage, task_id, params, cancel_token),
+        "subtitle": partial(_subtitle_stage, task_id, params),
+        "materials": partial(_materials_stage, task_id, params),
+        "render": partial(_render_stage, task_id, params, cancel_token),
+    }
+    inputs = _stage_inputs(stop_at)
+    stages = [
+        # stages restored from a checkpoint are not timed
+        pipeline.Stage(name, _timed(name, func), inputs[name])
+        for name, func in funcs.items()
+    ]
+    if checkpoints:
+        for stage in stages:
+            stage.func = checkpoints.wrap(stage.name, stage.func, stage.inputs)
+    return stages
+
+
+# stop_at => the last stage to run
+_stop_at_stages = {
+    "script": "script",
+    "terms": "terms",
+    "audio": "audio",
+    "subtitle": "subtitle",
+    "materials": "materials",
+    "video": "render",
+}
+
+
+def estimate_duration(stop_at: str = "video") -> float:
+    """Estimated seconds to run a task, see app.services.eta."""
+    return eta.task_duration(_stop_at_stages.get(stop_at, "render"), _stage_inputs(stop_at))
 
-    return final_video_paths, combined_video_paths
 
+# progress added when a stage completes, rendering reports its own progress from 50 to 100
+_stage_progress = {"script": 10, "terms": 10, "audio": 10, "subtitle": 10, "materials": 10}
 
-def start(task_id, params: VideoParams, stop_at: str = "video"):
-    logger.info(f"start task: {task_id}, stop_at: {stop_at}")
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=5)
+
+def start(task_id, params: VideoParams, stop_at: str = "video", resume: bool = False):
+    """resume: skip the stages whose checkpoint is still valid (see app.services.checkpoint)"""
+    cancel_token = cancellation.create(task_id)
+    try:
+        # cancelled while it was queued
+        cancel_token.raise_if_cancelled()
+        # the lines logged by the task (and its stages) are pushed to the clients following it
+        with logger.contextualize(task_id=task_id):
+            return _start(task_id, params, stop_at, resume, cancel_token)
+    except TaskCancelledError:
+        logger.warning(f"task {task_id} cancelled")
+        task = sm.state.get_task(task_id) or {}
+        sm.state.update_task(
+            task_id, state=const.TASK_STATE_CANCELLED, progress=task.get("progress", 0)
+        )
+    except Exception:
+        # so the callback reports the failure
+        mark_failed(task_id)
+        raise
+    finally:
+        try:
+            webhooks.notify(task_id, getattr(params, "callback_url", ""))
+        except Exception as e:
+            logger.error(f"failed to queue the callback of task {task_id}: {str(e)}")
+        try:
+            batch_id = (sm.state.get_task(task_id) or {}).get("batch_id")
+            if batch_id:
+                update_batch(batch_id)
+        except Exception as e:
+            logger.error(f"failed to update the batch of task {task_id}: {str(e)}")
+        # last: deleting the task waits for this (see cancellation.wait)
+        cancellation.release(task_id)
+
+
+def _start(task_id, params: VideoParams, stop_at: str, resume: bool, cancel_token: CancelToken):
+    logger.info(f"start task: {task_id}, stop_at: {stop_at}, resume: {resume}")
+    sm.state.update_task(
+        task_id,
+        state=const.TASK_STATE_PROCESSING,
+        progress=5,
+        started_at=eta.timestamp(0),
+        estimated_finish_at=eta.timestamp(estimate_duration(stop_at)),
+    )
 
     if type(params.video_concat_mode) is str:
         params.video_concat_mode = VideoConcatMode(params.video_concat_mode)
@@ -542,49 +935,50 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     else:
         logger.info("Starting task in TRADITIONAL mode")
 
-    # 1. Generate script
-    video_script = generate_script(task_id, params)
-    if not video_script or (isinstance(video_script, str) and "Error: " in video_script):
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+    # 各阶段按依赖关系调度：素材下载只依赖搜索词，可与音频合成、字幕生成并行
+    progress = 0
+
+    def on_stage_done(stage):
+        nonlocal progress
+        progress += _stage_progress.get(stage, 0)
+        if progress:
+            sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=progress)
+
+    context = {}
+    target = _stop_at_stages.get(stop_at, "render")
+    checkpoints = Checkpoints(task_id, params, stop_at, resume=resume)
+    stages = build_stages(task_id, params, stop_at, checkpoints, cancel_token)
+    if not pipeline.run_stages(stages, target, context, on_stage_done, cancel_token):
+        mark_failed(task_id)
         return
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=10)
-
+    video_script = context["video_script"]
+    script_key = "podcast_script" if is_podcast_mode else "script"
     if stop_at == "script":
-        script_data = {"podcast_script": video_script} if is_podcast_mode else {"script": video_script}
+        script_data = {script_key: video_script}
         sm.state.update_task(
             task_id, state=const.TASK_STATE_COMPLETE, progress=100, **script_data
         )
         return script_data
 
-    # 2. Generate terms
-    video_terms = ""
-    if params.video_source != "local":
-        video_terms = generate_terms(task_id, params, video_script)
-        if not video_terms:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-            return
-
-    save_script_data(task_id, video_script, video_terms, params)
-
+    video_terms = context["video_terms"]
     if stop_at == "terms":
         sm.state.update_task(
             task_id, state=const.TASK_STATE_COMPLETE, progress=100, terms=video_terms
         )
-        return {"podcast_script" if is_podcast_mode else "script": video_script, "terms": video_terms}
-
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=20)
+        return {script_key: video_script, "terms": video_terms}
 
-    # 3. Generate audio
-    audio_file, audio_duration, sub_maker = generate_audio(
-        task_id, params, video_script
-    )
-    if not audio_file:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
-
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=30)
+    if stop_at == "materials":
+        downloaded_videos = context["downloaded_videos"]
+        sm.state.update_task(
+            task_id,
+            state=const.TASK_STATE_COMPLETE,
+            progress=100,
+            materials=downloaded_videos,
+        )
+        return {"materials": downloaded_videos}
 
+    audio_file, audio_duration, _ = context["audio_result"]
     if stop_at == "audio":
         sm.state.update_task(
             task_id,
@@ -595,11 +989,7 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         )
         return {"audio_file": audio_file, "audio_duration": audio_duration}
 
-    # 4. Generate subtitle
-    subtitle_path = generate_subtitle(
-        task_id, params, video_script, sub_maker, audio_file
-    )
-
+    subtitle_path = context["subtitle_path"]
     if stop_at == "subtitle":
         sm.state.update_task(
             task_id,
@@ -609,36 +999,7 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         )
         return {"subtitle_path": subtitle_path}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
-
-    # 5. Get video materials
-    downloaded_videos = get_video_materials(
-        task_id, params, video_terms, audio_duration
-    )
-    if not downloaded_videos:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
-
-    if stop_at == "materials":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            materials=downloaded_videos,
-        )
-        return {"materials": downloaded_videos}
-
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
-
-    # 6. Generate final videos
-    final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
-    )
-
-    if not final_video_paths:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
-
+    final_video_paths = context["final_video_paths"]
     logger.success(
         f"task {task_id} finished, generated {len(final_video_paths)} videos."
     )
@@ -646,18 +1007,14 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     # 构建返回数据，适配播客模式
     kwargs = {
         "videos": final_video_paths,
-        "combined_videos": combined_video_paths,
+        "combined_videos": context["combined_video_paths"],
         "audio_file": audio_file,
         "audio_duration": audio_duration,
         "subtitle_path": subtitle_path,
-        "materials": downloaded_videos,
+        "materials": context["downloaded_videos"],
     }
 
-    if is_podcast_mode:
-        kwargs["podcast_script"] = video_script
-    else:
-        kwargs["script"] = video_script
-
+    kwargs[script_key] = video_script
     kwargs["terms"] = video_terms
 
     sm.state.update_task(
@@ -666,6 +1023,57 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     return kwargs
 
 
+_batch_counts = {
+    const.TASK_STATE_COMPLETE: "completed",
+    const.TASK_STATE_FAILED: "failed",
+    const.TASK_STATE_CANCELLED: "cancelled",
+}
+
+
+def update_batch(batch_id):
+    """
+    Aggregate the states of the tasks of a batch into the state of the batch (progress:
+    finished tasks), called each time one of them finished. The tasks of a batch are
+    queued one by one, they share the work they have in common when they run on the
+    same node (see material.search_videos_cached and material.save_video).
+    """
+    batch = sm.state.get_task(batch_id)
+    if not batch or "task_ids" not in batch:
+        return
+    total = len(batch["task_ids"])
+    counts = {"completed": 0, "failed": 0, "cancelled": 0}
+    for task_id in batch["task_ids"]:
+        # a deleted task counts as failed
+        task = sm.state.get_task(task_id) or {"state": const.TASK_STATE_FAILED}
+        key = _batch_counts.get(task.get("state"))
+        if key:
+            counts[key] += 1
+
+    if batch.get("state") == const.TASK_STATE_CANCELLED:
+        progress = (counts["completed"] + counts["failed"]) * 100 // total
+        sm.state.update_task(batch_id, state=const.TASK_STATE_CANCELLED, progress=progress, **counts)
+        return
+    finished = sum(counts.values())
+    state = const.TASK_STATE_COMPLETE if finished == total else const.TASK_STATE_PROCESSING
+    sm.state.update_task(batch_id, state=state, progress=finished * 100 // total, **counts)
+    if finished == total:
+        logger.success(f"batch {batch_id} finished: {counts}")
+
+
+def cancel_batch(batch_id):
+    """Cancel the tasks of a batch that did not finish, queued or running."""
+    batch = sm.state.get_task(batch_id) or {}
+    for task_id in batch.get("task_ids", []):
+        task = sm.state.get_task(task_id) or {}
+        if task.get("state") == const.TASK_STATE_PROCESSING:
+            # the queued tasks see the state when they start
+            sm.state.update_task(
+                task_id, state=const.TASK_STATE_CANCELLED, progress=task.get("progress", 0)
+            )
+            cancellation.cancel(task_id)
+    update_batch(batch_id)
+
+
 if __name__ == "__main__":
     task_id = "task_id"
     params = VideoParams(
@@ -0,0 +1,121 @@
+"""
+Uploaded files (BGM, local materials) streamed to disk in chunks, so an upload never
+has to fit in memory.
+
+The upload is written to a temporary file next to its destination, up to max_bytes,
+its first bytes must be one of the allowed formats (whatever the filename says), and
+it is probed (app.services.media_catalog) before it is renamed into place: a file
+ffmpeg cannot read is never stored. A filename without one of the allowed extensions
+gets the detected one, the libraries only index the files by their extension.
+"""
+
+import os
+import uuid
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple
+
+from loguru import logger
+
+from app.models.exception import ProbeError, UnsupportedMediaError, UploadTooLargeError
+from app.services import media_catalog
+
+_chunk_size = 1024 * 1024
+
+AUDIO_FORMATS = ("mp3", "wav", "ogg", "flac", "m4a")
+VIDEO_FORMATS = ("mp4", "mov", "mkv", "webm", "avi", "flv")
+IMAGE_FORMATS = ("jpg", "png")
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """The format of a file from its first bytes (at least 16), None if unknown."""
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE6 == 0xE2):
+        # an ID3 tag, or an MPEG audio layer III frame header
+        return "mp3"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return "avi"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"M4A ", b"M4B "):
+            return "m4a"
+        if brand == b"qt  ":
+            return "mov"
+        return "mp4"
+    if head[4:8] in (b"moov", b"mdat", b"wide", b"free"):
+        return "mov"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm" if b"webm" in head else "mkv"
+    if head.startswith(b"FLV"):
+        return "flv"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    return None
+
+
+def save_upload(
+    source: BinaryIO,
+    directory: str,
+    filename: str,
+    formats: Iterable[str],
+    max_bytes: int,
+    kind: str,
+    loudness: bool = False,
+) -> Tuple[str, Dict]:
+    """
+    Stream source into directory/filename, returns (the path, its catalog entry).
+    Raises UploadTooLargeError beyond max_bytes (0: no limit), UnsupportedMediaError
+    for a format not in formats, a file ffmpeg cannot read or an invalid filename.
+    """
+    formats = tuple(formats)
+    filename = os.path.basename((filename or "").replace("\\", "/")).strip()
+    if filename in ("", ".", ".."):
+        raise UnsupportedMediaError("the file has no valid name")
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}")
+    try:
+        size = 0
+        with open(temp_path, "wb") as f:
+            head = b""
+            while True:
+                chunk = source.read(_chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(
+                        f"the file is larger than {max_bytes // (1024 * 1024)} MB"
+                    )
+                if len(head) < 64:
+                    head += chunk[: 64 - len(head)]
+                f.write(chunk)
+
+        detected = sniff(head)
+        if detected not in formats:
+            raise UnsupportedMediaError(
+                f"{filename} is not a {'/'.join(formats)} file (detected: {detected or 'unknown'})"
+            )
+        try:
+            info = media_catalog.probe(temp_path, loudness=loudness)
+        except ProbeError as e:
+            raise UnsupportedMediaError(f"{filename} cannot be read: {str(e)}")
+        stem, ext = os.path.splitext(filename)
+        if ext.lower().lstrip(".") not in formats:
+            filename = f"{stem}.{detected}"
+        path = os.path.join(directory, filename)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    entry = media_catalog.catalog().record(path, kind, info)
+    logger.info(
+        f"uploaded {path}: {size} bytes, {detected}, {entry['codec']}, {entry['duration']:.1f}s"
+        + (f", {entry['loudness']} LUFS" if entry["loudness"] is not None else "")
+    )
+    return path, entry
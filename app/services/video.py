@@ -1,7 +1,7 @@
-import glob
 import itertools
 import os
 import random
+import functools
 import gc
 import shutil
 from typing import List
@@ -21,6 +21,7 @@ from moviepy.video.tools.subtitles import SubtitlesClip
 from PIL import ImageFont
 
 from app.models import const
+from app.models.exception import TaskCancelledError
 from app.models.schema import (
     MaterialInfo,
     VideoAspect,
@@ -28,6 +29,8 @@ from app.models.schema import (
     VideoParams,
     VideoTransitionMode,
 )
+from app.services import bgm, cancellation
+from app.services.cancellation import CancelToken
 from app.services.utils import video_effects
 from app.utils import utils
 
@@ -106,10 +109,7 @@ def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
         return bgm_file
 
     if bgm_type == "random":
-        suffix = "*.mp3"
-        song_dir = utils.song_dir()
-        files = glob.glob(os.path.join(song_dir, suffix))
-        return random.choice(files)
+        return bgm.library().pick()
 
     return ""
 
@@ -123,6 +123,7 @@ def combine_videos(
     video_transition_mode: VideoTransitionMode = None,
     max_clip_duration: int = 5,
     threads: int = 2,
+    cancel_token: CancelToken = None,
 ) -> str:
     audio_clip = AudioFileClip(audio_file)
     audio_duration = audio_clip.duration
@@ -165,6 +166,8 @@ def combine_videos(
     for i, subclipped_item in enumerate(subclipped_items):
         if video_duration > audio_duration:
             break
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
         
         logger.debug(f"processing clip {i+1}: {subclipped_item.width}x{subclipped_item.height}, current duration: {video_duration:.2f}s, remaining: {audio_duration - video_duration:.2f}s")
         
@@ -219,7 +222,12 @@ def combine_videos(
                 
             # wirte clip to temp file
             clip_file = f"{output_dir}/temp-clip-{i+1}.mp4"
-            clip.write_videofile(clip_file, logger=None, fps=fps, codec=video_codec)
+            clip.write_videofile(
+                clip_file,
+                logger=cancellation.progress_logger(cancel_token),
+                fps=fps,
+                codec=video_codec,
+            )
             
             close_clip(clip)
         
@@ -264,6 +272,8 @@ def combine_videos(
     
     # merge remaining video clips one by one
     for i, clip in enumerate(processed_clips[1:], 1):
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
         logger.info(f"merging clip {i}/{len(processed_clips)-1}, duration: {clip.duration:.2f}s")
         
         try:
@@ -278,7 +288,7 @@ def combine_videos(
             merged_clip.write_videofile(
                 filename=temp_merged_next,
                 threads=threads,
-                logger=None,
+                logger=cancellation.progress_logger(cancel_token),
                 temp_audiofile_path=output_dir,
                 audio_codec=audio_codec,
                 fps=fps,
@@ -306,9 +316,15 @@ def combine_videos(
     return combined_video_path
 
 
+# fonts are shared by all the subtitles (and tasks) using them, load each one once
+@functools.lru_cache(maxsize=32)
+def load_font(font: str, fontsize: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font, fontsize)
+
+
 def wrap_text(text, max_width, font="Arial", fontsize=60):
     # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
+    font = load_font(font, fontsize)
 
     def get_text_size(inner_text):
         inner_text = inner_text.strip()
@@ -366,6 +382,7 @@ def generate_video(
     subtitle_path: str,
     output_file: str,
     params: VideoParams,
+    cancel_token: CancelToken = None,
 ):
     aspect = VideoAspect(params.video_aspect)
     video_width, video_height = aspect.to_resolution()
@@ -460,13 +477,27 @@ def generate_video(
     bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
     if bgm_file:
         try:
-            bgm_clip = AudioFileClip(bgm_file).with_effects(
-                [
-                    afx.MultiplyVolume(params.bgm_volume),
-                    afx.AudioFadeOut(3),
-                    afx.AudioLoop(duration=video_clip.duration),
-                ]
+            # sliced from the decoded, loudness-normalized track of the bgm library
+            bgm_clip = bgm.library().clip(
+                bgm_file,
+                duration=video_clip.duration,
+                volume=params.bgm_volume,
+                cancel_token=cancel_token,
             )
+        except TaskCancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"bgm library unavailable for {bgm_file}, decoding it: {str(e)}")
+            bgm_clip = None
+        try:
+            if bgm_clip is None:
+                bgm_clip = AudioFileClip(bgm_file).with_effects(
+                    [
+                        afx.MultiplyVolume(params.bgm_volume),
+                        afx.AudioFadeOut(3),
+                        afx.AudioLoop(duration=video_clip.duration),
+                    ]
+                )
             audio_clip = CompositeAudioClip([audio_clip, bgm_clip])
         except Exception as e:
             logger.error(f"failed to add bgm: {str(e)}")
@@ -477,7 +508,7 @@ def generate_video(
         audio_codec=audio_codec,
         temp_audiofile_path=output_dir,
         threads=params.n_threads or 2,
-        logger=None,
+        logger=cancellation.progress_logger(cancel_token),
         fps=fps,
     )
     video_clip.close()
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import os
 import re
 from datetime import datetime
@@ -42,7 +43,9 @@ def get_siliconflow_voices() -> list[str]:
     ]
 
 
-def get_all_azure_voices(filter_locals=None) -> list[str]:
+# parsed once, the voice list is read by every task validating its voices
+@functools.lru_cache(maxsize=1)
+def _azure_voice_names() -> tuple:
     azure_voices_str = """
 Name: af-ZA-AdriNeural
 Gender: Female
@@ -1038,13 +1041,15 @@ Gender: Female
 Name: zh-CN-XiaoxiaoMultilingualNeural-V2
 Gender: Female
     """.strip()
-    voices = []
     # 定义正则表达式模式，用于匹配 Name 和 Gender 行
     pattern = re.compile(r"Name:\s*(.+)\s*Gender:\s*(.+)\s*", re.MULTILINE)
     # 使用正则表达式查找所有匹配项
-    matches = pattern.findall(azure_voices_str)
+    return tuple(pattern.findall(azure_voices_str))
+
 
-    for name, gender in matches:
+def get_all_azure_voices(filter_locals=None) -> list[str]:
+    voices = []
+    for name, gender in _azure_voice_names():
         # 应用过滤条件
         if filter_locals and any(
             name.lower().startswith(fl.lower()) for fl in filter_locals
@@ -0,0 +1,439 @@
+"""Completion callbacks of tasks created with a callback_url.
+
+When such a task finishes (complete, failed or cancelled), a signed POST is written
+to a durable outbox: a SQLite table on single nodes, a Redis sorted set with
+enable_redis, so a notification survives restarts and is sent by any node.
+
+A dispatcher thread per process claims the due deliveries in batches, leasing them
+for webhook_lease seconds so no other node sends them meanwhile, and posts them
+concurrently. A failed delivery is retried with exponential backoff (and jitter) up
+to webhook_max_attempts times, then moved to the dead letters.
+
+Every delivery carries X-Webhook-Id (the same for all its attempts, to drop
+duplicates), X-Webhook-Timestamp and
+X-Webhook-Signature: sha256=HMAC-SHA256(webhook_secret, "{timestamp}.{body}"),
+a callback_url is only accepted when webhook_secret is set.
+
+Callbacks are only sent to public addresses: the host of a callback_url must not
+resolve to a loopback, private, link-local (cloud metadata) or otherwise reserved
+address, unless it is listed in webhook_allowed_hosts. The check is made when the
+task is created and again before every attempt, the host may resolve differently
+by then.
+"""
+
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+
+from app.config import config
+from app.models import const
+from app.services import state as sm
+from app.utils import utils
+
+_events = {
+    const.TASK_STATE_COMPLETE: "task.completed",
+    const.TASK_STATE_FAILED: "task.failed",
+    const.TASK_STATE_CANCELLED: "task.cancelled",
+}
+# dead letters kept for inspection
+_max_dead_letters = 1000
+
+
+def validate_url(url: str):
+    """Raises ValueError unless notifications can be sent to url, see check_address."""
+    if not config.app.get("webhook_secret", ""):
+        raise ValueError("callback_url needs webhook_secret to be set in config.toml, notifications are always signed")
+    try:
+        check_address(url)
+    except OSError as e:
+        raise ValueError(f"invalid callback_url: {url}, cannot resolve its host: {str(e)}")
+
+
+def check_address(url: str):
+    """
+    Raises ValueError unless url is an absolute http(s) url whose host only resolves
+    to public addresses (or is in webhook_allowed_hosts), OSError when it does not resolve.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"invalid callback_url: {url}")
+    host = parsed.hostname.lower()
+    if host in [h.lower() for h in config.app.get("webhook_allowed_hosts", [])]:
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        raise ValueError(f"invalid callback_url: {url}")
+    for *_, sockaddr in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP):
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"invalid callback_url: {url}, {host} is not a public address ({address})")
+
+
+def sign(secret: str, timestamp: int, body: str) -> str:
+    digest = hmac.new(
+        secret.encode("utf-8"), f"{timestamp}.{body}".encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    return f"sha256={digest}"
+
+
+def backoff(attempts: int, base: float, maximum: float) -> float:
+    """Seconds before the next attempt after attempts failed ones, doubling, +-20% jitter."""
+    delay = min(maximum, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class SqliteOutbox:
+    """Deliveries in a table of the task database (see state.sqlite_connect)."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sm.sqlite_connect(path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_outbox (
+                id TEXT PRIMARY KEY,
+                delivery TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                dead INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due
+                ON webhook_outbox (dead, next_attempt_at);
+            """
+        )
+
+    def add(self, delivery_id: str, delivery: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO webhook_outbox (id, delivery, next_attempt_at)"
+                " VALUES (?, ?, ?)",
+                (delivery_id, json.dumps(delivery, ensure_ascii=False), time.time()),
+            )
+
+    def claim(self, limit: int, lease: float) -> List[Tuple[str, dict, int]]:
+        """Up to limit due deliveries as (id, delivery, attempts), hidden for lease seconds."""
+        now = time.time()
+        with self._lock:
+            with sm.sqlite_transaction(self._conn, "BEGIN IMMEDIATE"):
+                rows = self._conn.execute(
+                    "SELECT id, delivery, attempts FROM webhook_outbox"
+                    " WHERE dead = 0 AND next_attempt_at <= ?"
+                    " ORDER BY next_attempt_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE webhook_outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + lease, row[0]) for row in rows],
+                )
+        return [(row[0], json.loads(row[1]), row[2]) for row in rows]
+
+    def complete(self, delivery_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_outbox WHERE id = ?", (delivery_id,))
+
+    def retry(self, delivery_id: str, attempts: int, delay: float, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE webhook_outbox SET attempts = ?, next_attempt_at = ?, last_error = ?"
+                " WHERE id = ?",
+                (attempts, time.time() + delay, error, delivery_id),
+            )
+
+    def kill(self, delivery_id: str, attempts: int, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE webhook_outbox SET dead = 1, attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, delivery_id),
+            )
+            self._conn.execute(
+                "DELETE FROM webhook_outbox WHERE dead = 1 AND id NOT IN"
+                " (SELECT id FROM webhook_outbox WHERE dead = 1"
+                "  ORDER BY next_attempt_at DESC LIMIT ?)",
+                (_max_dead_letters,),
+            )
+
+
+class RedisOutbox:
+    """
+    Deliveries in a hash (id => delivery), due times in a sorted set shared by all the
+    nodes; claiming moves the due time forward by the lease in one transaction.
+    """
+
+    deliveries = "webhook_outbox:deliveries"
+    due = "webhook_outbox:due"
+    dead_letters = "webhook_outbox:dead"
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+
+    def add(self, delivery_id: str, delivery: dict):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hsetnx(self.deliveries, delivery_id, json.dumps({**delivery, "attempts": 0}))
+        pipe.zadd(self.due, {delivery_id: time.time()}, nx=True)
+        pipe.execute()
+
+    def claim(self, limit: int, lease: float) -> List[Tuple[str, dict, int]]:
+        import redis
+
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.due)
+                    now = time.time()
+                    ids = pipe.zrangebyscore(self.due, "-inf", now, start=0, num=limit)
+                    if not ids:
+                        pipe.unwatch()
+                        return []
+                    pipe.multi()
+                    pipe.zadd(self.due, {delivery_id: now + lease for delivery_id in ids}, xx=True)
+                    pipe.hmget(self.deliveries, ids)
+                    _, values = pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        claimed = []
+        for delivery_id, value in zip(ids, values):
+            delivery_id = delivery_id.decode("utf-8")
+            if value is None:
+                # completed by another node after its lease expired
+                self._redis.zrem(self.due, delivery_id)
+                continue
+            delivery = json.loads(value)
+            claimed.append((delivery_id, delivery, delivery.pop("attempts", 0)))
+        return claimed
+
+    def complete(self, delivery_id: str):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hdel(self.deliveries, delivery_id)
+        pipe.zrem(self.due, delivery_id)
+        pipe.execute()
+
+    def retry(self, delivery_id: str, attempts: int, delay: float, error: str):
+        delivery = self._redis.hget(self.deliveries, delivery_id)
+        if delivery is None:
+            return
+        delivery = {**json.loads(delivery), "attempts": attempts, "last_error": error}
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hset(self.deliveries, delivery_id, json.dumps(delivery))
+        pipe.zadd(self.due, {delivery_id: time.time() + delay}, xx=True)
+        pipe.execute()
+
+    def kill(self, delivery_id: str, attempts: int, error: str):
+        delivery = self._redis.hget(self.deliveries, delivery_id)
+        pipe = self._redis.pipeline(transaction=True)
+        if delivery is not None:
+            delivery = {**json.loads(delivery), "id": delivery_id, "attempts": attempts, "last_error": error}
+            pipe.lpush(self.dead_letters, json.dumps(delivery))
+            pipe.ltrim(self.dead_letters, 0, _max_dead_letters - 1)
+        pipe.hdel(self.deliveries, delivery_id)
+        pipe.zrem(self.due, delivery_id)
+        pipe.execute()
+
+
+def _post(url: str, body: str, headers: dict, timeout: float) -> int:
+    # a redirect would lead past check_address
+    return requests.post(
+        url, data=body.encode("utf-8"), headers=headers, timeout=timeout, allow_redirects=False
+    ).status_code
+
+
+class Dispatcher:
+    """Sends the due deliveries of an outbox from a background thread."""
+
+    def __init__(
+        self,
+        outbox,
+        secret: str = "",
+        batch_size: int = 20,
+        concurrency: int = 8,
+        lease: float = 60,
+        timeout: float = 10,
+        max_attempts: int = 10,
+        retry_base: float = 5,
+        retry_max: float = 3600,
+        poll_interval: float = 1,
+        post: Callable[[str, str, dict, float], int] = _post,
+        check: Callable[[str], None] = check_address,
+    ):
+        self.outbox = outbox
+        self.secret = secret
+        self.batch_size = batch_size
+        self.lease = lease
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self._post = post
+        self._check = check
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="webhook")
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._loop, name="webhook-outbox", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def shutdown(self, timeout: Optional[float] = None):
+        # deliveries not sent yet stay in the outbox
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                sent = self.run_once()
+            except Exception as e:
+                logger.error(f"failed to send webhooks: {str(e)}")
+                sent = 0
+            # a full batch: more are probably due
+            if sent < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self) -> int:
+        """Send one batch of due deliveries, returns how many were claimed."""
+        claimed = self.outbox.claim(self.batch_size, self.lease)
+        for future in [self._executor.submit(self._deliver, *item) for item in claimed]:
+            future.result()
+        return len(claimed)
+
+    def _deliver(self, delivery_id: str, delivery: dict, attempts: int):
+        body = json.dumps(delivery["payload"], ensure_ascii=False)
+        timestamp = int(time.time())
+        headers = {
+            "Content-Type": "application/json",
+            "X-Webhook-Id": delivery_id,
+            "X-Webhook-Event": delivery["payload"]["event"],
+            "X-Webhook-Timestamp": str(timestamp),
+        }
+        attempts += 1
+        if not self.secret:
+            # never sent unsigned, e.g. when webhook_secret was removed after the task was created
+            self.outbox.kill(delivery_id, attempts, "webhook_secret is not set")
+            logger.error(f"webhook {delivery_id} refused: webhook_secret is not set")
+            return
+        headers["X-Webhook-Signature"] = sign(self.secret, timestamp, body)
+        try:
+            # again, the host may resolve to another address than when the task was created
+            self._check(delivery["url"])
+        except ValueError as e:
+            self.outbox.kill(delivery_id, attempts, str(e))
+            logger.error(f"webhook {delivery_id} refused: {str(e)}")
+            return
+        except OSError as e:
+            status, error = None, f"cannot resolve the host: {str(e)}"
+        else:
+            try:
+                status = self._post(delivery["url"], body, headers, self.timeout)
+                error = f"status {status}"
+            except Exception as e:
+                status, error = None, str(e)
+        if status is not None and 200 <= status < 300:
+            self.outbox.complete(delivery_id)
+            logger.info(f"webhook {delivery_id} delivered to {delivery['url']}")
+            return
+        # any other client error will not go away by retrying
+        permanent = status is not None and 400 <= status < 500 and status not in (408, 429)
+        if permanent or attempts >= self.max_attempts:
+            self.outbox.kill(delivery_id, attempts, error)
+            logger.error(f"webhook {delivery_id} to {delivery['url']} failed for good: {error}")
+            return
+        delay = backoff(attempts, self.retry_base, self.retry_max)
+        self.outbox.retry(delivery_id, attempts, delay, error)
+        logger.warning(
+            f"webhook {delivery_id} to {delivery['url']} failed ({error}), attempt {attempts}, retrying in {int(delay)}s"
+        )
+
+
+_dispatcher: Optional[Dispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def _create_outbox():
+    if config.app.get("enable_redis", False):
+        import redis
+
+        return RedisOutbox(
+            redis.Redis(
+                host=config.app.get("redis_host", "localhost"),
+                port=config.app.get("redis_port", 6379),
+                db=config.app.get("redis_db", 0),
+                password=config.app.get("redis_password", None),
+            )
+        )
+    return SqliteOutbox(sm.sqlite_path_from_config())
+
+
+def dispatcher() -> Dispatcher:
+    """The dispatcher of this process, created and started on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher(
+                _create_outbox(),
+                secret=config.app.get("webhook_secret", ""),
+                batch_size=config.app.get("webhook_batch_size", 20),
+                concurrency=config.app.get("webhook_concurrency", 8),
+                lease=config.app.get("webhook_lease", 60),
+                timeout=config.app.get("webhook_timeout", 10),
+                max_attempts=config.app.get("webhook_max_attempts", 10),
+                retry_base=config.app.get("webhook_retry_base", 5),
+                retry_max=config.app.get("webhook_retry_max", 3600),
+            )
+        _dispatcher.start()
+        return _dispatcher
+
+
+def shutdown(timeout: Optional[float] = None):
+    if _dispatcher is not None:
+        _dispatcher.shutdown(timeout)
+
+
+def notify(task_id: str, callback_url: str):
+    """Queue the notification of a finished task for callback_url, nothing if it is still running."""
+    if not callback_url:
+        return
+    task = sm.state.get_task(task_id)
+    if not task or task.get("state") not in _events:
+        return
+    payload = {
+        "event": _events[task["state"]],
+        "task_id": task_id,
+        "timestamp": utils.timestamp(),
+        "task": task,
+    }
+    # one delivery per task and outcome, a task resumed after failing notifies again
+    delivery_id = hashlib.sha256(
+        f"{task_id} {task['state']} {task.get('started_at', '')}".encode("utf-8")
+    ).hexdigest()[:32]
+    sender = dispatcher()
+    sender.outbox.add(delivery_id, {"url": callback_url, "payload": json.loads(utils.to_json(payload))})
+    sender.wake()
+    logger.info(f"webhook {payload['event']} of task {task_id} queued for {callback_url}")
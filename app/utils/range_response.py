@@ -0,0 +1,270 @@
+"""
+File responses with HTTP range and conditional request support (RFC 9110), used by
+/stream and /download.
+
+The body is sent with the ASGI zero-copy extension (sendfile) when the server offers
+it, else read in chunk_size blocks aligned to the chunk size, each read in a worker
+thread, so a slow disk never stalls the event loop.
+"""
+
+import mimetypes
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from secrets import token_hex
+from typing import List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# more ranges than this in one request are answered with the whole file
+max_ranges = 16
+
+
+def parse_ranges(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    The (start, stop) byte ranges of a Range header, sorted and merged, stop exclusive.
+    None when the header is invalid (the whole file is sent), [] when no range is
+    satisfiable (416).
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs.strip():
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash or not (first or last):
+            return None
+        try:
+            if not first:
+                # the last n bytes
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                if suffix and size:
+                    ranges.append((max(0, size - suffix), size))
+                continue
+            start = int(first)
+            stop = int(last) + 1 if last else None
+        except ValueError:
+            return None
+        if start < 0 or (stop is not None and stop <= start):
+            return None
+        stop = size if stop is None else stop
+        if start < size:
+            ranges.append((start, min(stop, size)))
+    if len(ranges) > max_ranges:
+        return None
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_after(header: str, mtime: float) -> bool:
+    """The file was not modified after the HTTP date in header (invalid dates: False)."""
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return False
+
+
+def _read(file, offset: int, size: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(file.fileno(), size, offset)
+    # windows
+    file.seek(offset)
+    return file.read(size)
+
+
+class RangeFileResponse(Response):
+    """
+    Sends path, or the requested ranges of it: 206 for one range, a multipart/byteranges
+    body for several, 416 when none is satisfiable. ETag and Last-Modified are set from
+    the file's stat, If-None-Match / If-Modified-Since answer 304, If-Match /
+    If-Unmodified-Since 412, and If-Range sends the whole file when it changed.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        filename: Optional[str] = None,
+        content_disposition_type: str = "attachment",
+    ):
+        self.path = path
+        self.stat_result = stat_result
+        self.status_code = 200
+        self.media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.background = None
+        self.init_headers(headers)
+        self.etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["etag"] = self.etag
+        self.headers["last-modified"] = self.last_modified
+        if filename:
+            quoted = quote(filename)
+            if quoted != filename:
+                disposition = f"{content_disposition_type}; filename*=utf-8''{quoted}"
+            else:
+                disposition = f'{content_disposition_type}; filename="{filename}"'
+            self.headers.setdefault("content-disposition", disposition)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        request_headers = Headers(scope=scope)
+        head = scope["method"].upper() == "HEAD"
+        size = self.stat_result.st_size
+        mtime = self.stat_result.st_mtime
+
+        if_match = request_headers.get("if-match")
+        if_unmodified_since = request_headers.get("if-unmodified-since")
+        if (if_match is not None and not _etag_matches(if_match, self.etag, weak=False)) or (
+            if_match is None
+            and if_unmodified_since is not None
+            and not _not_after(if_unmodified_since, mtime)
+        ):
+            return await self._send_empty(send, 412)
+
+        if_none_match = request_headers.get("if-none-match")
+        if_modified_since = request_headers.get("if-modified-since")
+        if (if_none_match is not None and _etag_matches(if_none_match, self.etag, weak=True)) or (
+            if_none_match is None
+            and if_modified_since is not None
+            and _not_after(if_modified_since, mtime)
+        ):
+            return await self._send_empty(send, 304)
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if range_header is not None and self._if_range(request_headers.get("if-range"), mtime):
+            ranges = parse_ranges(range_header, size)
+            if ranges == []:
+                self.headers["content-range"] = f"bytes */{size}"
+                return await self._send_empty(send, 416)
+
+        if not ranges:
+            self.headers["content-length"] = str(size)
+            parts = [(b"", 0, size)]
+            status = 200
+        elif len(ranges) == 1:
+            start, stop = ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{stop - 1}/{size}"
+            self.headers["content-length"] = str(stop - start)
+            parts = [(b"", start, stop)]
+            status = 206
+        else:
+            boundary = token_hex(13)
+            content_type = self.headers["content-type"]
+            parts = []
+            for start, stop in ranges:
+                # the CRLF ending the previous part belongs to the delimiter
+                delimiter = f"\r\n--{boundary}\r\n" if parts else f"--{boundary}\r\n"
+                part_header = (
+                    f"{delimiter}Content-Type: {content_type}\r\n"
+                    f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+                )
+                parts.append((part_header.encode("latin-1"), start, stop))
+            trailer = f"\r\n--{boundary}--\r\n".encode("latin-1")
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            self.headers["content-length"] = str(
+                sum(len(h) + stop - start for h, start, stop in parts) + len(trailer)
+            )
+            parts.append((trailer, 0, 0))
+            status = 206
+
+        await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+        if head:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            for part_header, start, stop in parts:
+                if part_header:
+                    await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                if zero_copy:
+                    if stop > start:
+                        await send(
+                            {
+                                "type": "http.response.zerocopysend",
+                                "file": file.fileno(),
+                                "offset": start,
+                                "count": stop - start,
+                                "more_body": True,
+                            }
+                        )
+                    continue
+                await self._send_range(send, file, start, stop)
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    def _if_range(self, if_range: Optional[str], mtime: float) -> bool:
+        """Whether the range applies: no If-Range, or the file is still the one it names."""
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # a weak etag never matches for a range
+            return if_range == self.etag
+        try:
+            return int(mtime) == int(parsedate_to_datetime(if_range).timestamp())
+        except (TypeError, ValueError, IndexError):
+            return False
+
+    async def _send_range(self, send: Send, file, start: int, stop: int):
+        offset = start
+        while offset < stop:
+            # up to the next chunk boundary, then whole aligned chunks
+            size = min(self.chunk_size - offset % self.chunk_size, stop - offset)
+            chunk = await anyio.to_thread.run_sync(_read, file, offset, size)
+            if not chunk:
+                # the file was truncated meanwhile
+                raise RuntimeError(f"{self.path} is shorter than {stop} bytes")
+            offset += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    async def _send_empty(self, send: Send, status: int):
+        # 304 keeps the validators, the other headers describe a body that is not sent
+        headers = [
+            (k, v)
+            for k, v in self.raw_headers
+            if k not in (b"content-type", b"content-length", b"content-disposition")
+        ] + [(b"content-length", b"0")]
+        if status == 304:
+            headers = [(k, v) for k, v in headers if k != b"content-length"]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def stat_file(path: str) -> Optional[os.stat_result]:
+    """The stat of path if it is a regular file, else None; call it from a worker thread."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result if stat.S_ISREG(stat_result.st_mode) else None
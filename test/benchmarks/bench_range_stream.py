@@ -0,0 +1,133 @@
+"""
+Benchmark of range streaming: the former /stream (a StreamingResponse over 4 KB
+reads) against RangeFileResponse, with many clients reading ranges of one file at
+the same time.
+
+    python test/benchmarks/bench_range_stream.py
+    python test/benchmarks/bench_range_stream.py --clients 200 --size-mb 256 --range-mb 8
+
+Runs in process over httpx's ASGI transport, so it measures the server side only:
+the throughput, and how late a timer on the event loop fires while the clients are
+served (the lag a viewer's next request would see).
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+from app.utils import range_response
+
+
+def legacy_stream(path):
+    """/stream as it was before RangeFileResponse."""
+
+    async def endpoint(request: Request):
+        range_header = request.headers.get("Range")
+        video_size = os.path.getsize(path)
+        start, end = 0, video_size - 1
+        length = video_size
+        if range_header:
+            range_ = range_header.split("bytes=")[1]
+            start, end = [int(part) if part else None for part in range_.split("-")]
+            if end is None:
+                end = video_size - 1
+            length = end - start + 1
+
+        def file_iterator(offset, bytes_to_read):
+            with open(path, "rb") as f:
+                f.seek(offset, os.SEEK_SET)
+                remaining = bytes_to_read
+                while remaining > 0:
+                    data = f.read(min(4096, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+
+        response = StreamingResponse(file_iterator(start, length), media_type="video/mp4")
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{video_size}"
+        response.headers["Content-Length"] = str(length)
+        response.status_code = 206
+        return response
+
+    return endpoint
+
+
+def range_stream(path):
+    async def endpoint(request: Request):
+        return range_response.RangeFileResponse(
+            path, range_response.stat_file(path), media_type="video/mp4"
+        )
+
+    return endpoint
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.005):
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(endpoint, size: int, clients: int, range_size: int, seed: int):
+    app = Starlette(routes=[Route("/video", endpoint)])
+    rng = random.Random(seed)
+    starts = [rng.randrange(0, size - range_size) for _ in range(clients)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def fetch(start):
+            response = await client.get(
+                "/video", headers={"Range": f"bytes={start}-{start + range_size - 1}"}
+            )
+            assert response.status_code == 206 and len(response.content) == range_size
+            return len(response.content)
+
+        stop = asyncio.Event()
+        lag = asyncio.create_task(measure_lag(stop))
+        began = time.perf_counter()
+        total = sum(await asyncio.gather(*(fetch(start) for start in starts)))
+        elapsed = time.perf_counter() - began
+        stop.set()
+        return total / elapsed / 1024 / 1024, await lag
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--range-mb", type=int, default=4)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    range_size = args.range_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "final-1.mp4")
+        with open(path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        print(f"{args.clients} clients, {args.range_mb} MB ranges of a {args.size_mb} MB file")
+        for name, endpoint in (("legacy 4 KB reads", legacy_stream(path)), ("RangeFileResponse", range_stream(path))):
+            throughput, lag = asyncio.run(run(endpoint, size, args.clients, range_size, seed=1))
+            print(f"{name:>20}: {throughput:8.1f} MB/s, worst event loop lag {lag * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
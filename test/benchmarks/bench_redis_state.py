@@ -0,0 +1,141 @@
+"""
+Benchmark of RedisState.update_task / get_task: the former one HSET per field with
+str() / ast.literal_eval encoding against the single HSET with JSON encoding.
+
+    python test/benchmarks/bench_redis_state.py
+    python test/benchmarks/bench_redis_state.py --redis-url redis://localhost:6379/15
+
+Uses fakeredis unless --redis-url is given, round trips are counted on the client
+so they are the same either way; the timings only mean something on a real server.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models import const
+from app.services.state import RedisState
+
+
+class LegacyRedisState(RedisState):
+    """update_task and get_task as they were before the JSON encoding."""
+
+    def update_task(self, task_id: str, state: int, progress: int = 0, **kwargs):
+        fields = {"task_id": task_id, "state": state, "progress": progress, **kwargs}
+        for field, value in fields.items():
+            self._redis.hset(task_id, field, str(value))
+
+    def get_task(self, task_id: str):
+        task_data = self._redis.hgetall(task_id)
+        if not task_data:
+            return None
+        return {
+            key.decode("utf-8"): self._convert_to_original_type(value)
+            for key, value in task_data.items()
+        }
+
+
+def count_round_trips(client):
+    counter = {"n": 0}
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def counting(*args, **kwargs):
+        counter["n"] += 1
+        return execute_command(*args, **kwargs)
+
+    def counting_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipe_execute = pipe.execute
+
+        def execute(*a, **kw):
+            counter["n"] += 1
+            return pipe_execute(*a, **kw)
+
+        pipe.execute = execute
+        return pipe
+
+    client.execute_command = counting
+    client.pipeline = counting_pipeline
+    return counter
+
+
+def final_update(task_id: str, videos: int):
+    # the fields task.start writes when a task completes
+    return dict(
+        task_id=task_id,
+        state=const.TASK_STATE_COMPLETE,
+        progress=100,
+        videos=[f"storage/tasks/{task_id}/final-{i}.mp4" for i in range(1, videos + 1)],
+        combined_videos=[f"storage/tasks/{task_id}/combined-{i}.mp4" for i in range(1, videos + 1)],
+        script="人工智能正在改变我们的生活方式。" * 20,
+        terms=["artificial intelligence", "robot", "city skyline", "data center", "future"],
+        audio_file=f"storage/tasks/{task_id}/audio.mp3",
+        audio_duration=63.2,
+        subtitle_path=f"storage/tasks/{task_id}/subtitle.srt",
+        materials=[f"storage/cache_videos/vid-{i:032x}.mp4" for i in range(20)],
+    )
+
+
+def run(name: str, state: RedisState, client, iterations: int, videos: int):
+    counter = count_round_trips(client)
+    started = time.perf_counter()
+    for i in range(iterations):
+        state.update_task(**final_update(f"{name}-{i}", videos))
+    write_time = time.perf_counter() - started
+    writes = counter["n"] / iterations
+
+    counter["n"] = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        task = state.get_task(f"{name}-{i}")
+    read_time = time.perf_counter() - started
+    reads = counter["n"] / iterations
+
+    # decode time alone, without the HGETALL
+    legacy = isinstance(state, LegacyRedisState)
+    raw = client.hgetall(f"{name}-0" if legacy else state._key(f"{name}-0"))
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if legacy:
+            {k.decode("utf-8"): state._convert_to_original_type(v) for k, v in raw.items()}
+        else:
+            state._decode_task(dict(raw))
+    decode_time = time.perf_counter() - started
+
+    print(
+        f"{name:>7}: update {writes:4.0f} round trips {write_time / iterations * 1e6:8.1f} us | "
+        f"get {reads:2.0f} round trips {read_time / iterations * 1e6:8.1f} us | "
+        f"decode {decode_time / iterations * 1e6:6.1f} us | "
+        f"types kept: {task['script'] == final_update('', videos)['script'] and isinstance(task['videos'], list)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--redis-url", default="", help="benchmark against a real redis (its db is flushed)")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--videos", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.redis_url:
+        import redis
+
+        client = redis.Redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+
+        client = fakeredis.FakeStrictRedis()
+    client.flushdb()
+
+    run("legacy", LegacyRedisState(redis_client=client), client, args.iterations, args.videos)
+    run("json", RedisState(redis_client=client), client, args.iterations, args.videos)
+    client.flushdb()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Unit test package for controllers
\ No newline at end of file
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from app.controllers.manager import redis_manager
+from app.controllers.manager.redis_manager import RedisTaskManager, register_task_func
+from app.models.exception import TaskQueueFullError
+from app.models.schema import VideoParams
+
+_results = []
+_release = threading.Event()
+
+
+def record_task(task_id, params=None):
+    _results.append((task_id, params))
+
+
+def blocking_task(task_id):
+    _release.wait(5)
+
+
+register_task_func(record_task)
+register_task_func(blocking_task)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisTaskManager(unittest.TestCase):
+    def setUp(self):
+        _results.clear()
+        _release.clear()
+        self.redis = fakeredis.FakeRedis()
+        self.managers = []
+
+    def tearDown(self):
+        _release.set()
+        for manager in self.managers:
+            manager.shutdown(timeout=5)
+
+    def _manager(self, workers, **kwargs):
+        manager = RedisTaskManager(workers, redis_client=self.redis, **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def _wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return condition()
+
+    def test_tasks_run_on_another_node_and_are_acked(self):
+        api = self._manager(0)
+        self._manager(2)
+        params = VideoParams(video_subject="test")
+        for i in range(3):
+            api.add_task(record_task, task_id=f"task-{i}", params=params)
+
+        self.assertTrue(self._wait_for(lambda: len(_results) == 3))
+        self.assertEqual(sorted(r[0] for r in _results), ["task-0", "task-1", "task-2"])
+        self.assertIsInstance(_results[0][1], VideoParams)
+        self.assertTrue(self._wait_for(lambda: self.redis.llen(api.processing_queue) == 0))
+        self.assertEqual(self.redis.hlen(api.heartbeats), 0)
+
+    def test_tasks_are_fifo(self):
+        api = self._manager(0)
+        for i in range(3):
+            api.add_task(record_task, task_id=f"task-{i}")
+        self._manager(1)
+        self.assertTrue(self._wait_for(lambda: len(_results) == 3))
+        self.assertEqual([r[0] for r in _results], ["task-0", "task-1", "task-2"])
+
+    def test_bounded_queue(self):
+        api = self._manager(0, max_queue_size=1)
+        api.add_task(record_task, task_id="task-0")
+        with self.assertRaises(TaskQueueFullError):
+            api.add_task(record_task, task_id="task-1")
+
+    def test_rejected_tasks_do_not_count_against_the_tenant(self):
+        api = self._manager(0, max_queue_size=1)
+        api.add_task(record_task, task_id="b-0", api_key="b")
+        for _ in range(5):
+            with self.assertRaises(TaskQueueFullError):
+                api.add_task(record_task, task_id="a-x", api_key="a")
+        tenant = api.scheduler.tenant_id("a")
+        self.assertIsNone(self.redis.hget(api.tags, f"normal:{tenant}"))
+
+    def test_unregistered_function_is_rejected(self):
+        api = self._manager(0)
+        with self.assertRaises(ValueError):
+            api.add_task(print, "hello")
+
+    def test_stalled_task_is_requeued_then_dead_lettered(self):
+        api = self._manager(0, visibility_timeout=30, max_attempts=2)
+        api.add_task(record_task, task_id="task-0")
+        # a worker took the task and died without acking it
+        task_id = api.dequeue(timeout=1)["id"]
+        self.redis.hset(api.heartbeats, task_id, time.time() - 60)
+
+        self.assertEqual(api.requeue_stuck_tasks(), 1)
+        self.assertEqual(self.redis.llen(api.processing_queue), 0)
+        raw = self.redis.zrange(api.scheduled_queue, 0, 0)[0]
+        self.assertEqual(json.loads(raw)["attempts"], 1)
+
+        api.dequeue(timeout=1)
+        self.redis.hset(api.heartbeats, task_id, time.time() - 60)
+        self.assertEqual(api.requeue_stuck_tasks(), 1)
+        self.assertEqual(api.queue_size(), 0)
+        self.assertEqual(self.redis.llen(api.dead_letter_queue), 1)
+
+    def test_priorities_and_tenants(self):
+        api = self._manager(0)
+        for i in range(2):
+            api.add_task(record_task, task_id=f"a-bulk-{i}", priority="low", api_key="a")
+        api.add_task(record_task, task_id="b-0", priority="low", api_key="b")
+        api.add_task(record_task, task_id="a-preview", priority="high", api_key="a")
+        order = [api.dequeue(timeout=1)["kwargs"]["task_id"] for _ in range(4)]
+        self.assertEqual(order[0], "a-preview")
+        self.assertEqual(sorted(order[1:3]), ["a-bulk-0", "b-0"])
+        self.assertEqual(order[3], "a-bulk-1")
+
+    def test_tasks_queued_by_older_versions_still_run(self):
+        api = self._manager(0)
+        payload = {"func": "record_task", "args": [], "kwargs": {"task_id": "old"}}
+        self.redis.lpush(api.queue, json.dumps(payload))
+        self.assertEqual(api.queue_size(), 1)
+        self.assertEqual(api.dequeue(timeout=1)["kwargs"], {"task_id": "old"})
+
+    def test_running_task_keeps_heartbeating(self):
+        worker = self._manager(1, heartbeat_interval=0.05, visibility_timeout=0.3)
+        worker.add_task(blocking_task, task_id="task-0")
+        self.assertTrue(self._wait_for(lambda: worker.current_tasks == 1))
+        time.sleep(0.5)
+        self.assertEqual(worker.requeue_stuck_tasks(), 0)
+        self.assertEqual(self.redis.llen(worker.processing_queue), 1)
+        _release.set()
+        self.assertTrue(self._wait_for(lambda: self.redis.llen(worker.processing_queue) == 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
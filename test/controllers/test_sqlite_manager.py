@@ -0,0 +1,132 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.controllers.manager.registry import register_task_func
+from app.controllers.manager.sqlite_manager import SqliteTaskManager
+from app.models import const
+from app.models.exception import TaskQueueFullError
+from app.models.schema import VideoParams
+from app.services import state as sm
+
+_results = []
+
+
+def record_sqlite_task(task_id, params=None):
+    _results.append((task_id, params))
+
+
+register_task_func(record_sqlite_task)
+
+
+class TestSqliteTaskManager(unittest.TestCase):
+    def setUp(self):
+        _results.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "tasks.db")
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.shutdown(timeout=5)
+            manager.queue.close()
+        self.tmp.cleanup()
+
+    def create_manager(self, *args, **kwargs):
+        manager = SqliteTaskManager(*args, db_path=self.db_path, **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def _wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if condition():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_runs_queued_tasks(self):
+        manager = self.create_manager(max_concurrent_tasks=1)
+        params = VideoParams(article_text="sea")
+        manager.add_task(record_sqlite_task, task_id="t1", params=params)
+        self.assertTrue(self._wait_for(lambda: _results))
+        task_id, received = _results[0]
+        self.assertEqual(task_id, "t1")
+        self.assertEqual(received.article_text, "sea")
+        self.assertTrue(self._wait_for(lambda: manager.queue_size() == 0))
+        count = manager.queue.execute("SELECT COUNT(*) FROM task_queue").fetchone()[0]
+        self.assertEqual(count, 0)
+
+    def test_bounded_queue(self):
+        # no workers, the tasks only wait
+        manager = self.create_manager(max_concurrent_tasks=0, max_queue_size=1)
+        manager.add_task(record_sqlite_task, task_id="t1")
+        with self.assertRaises(TaskQueueFullError):
+            manager.add_task(record_sqlite_task, task_id="t2")
+
+    def test_rejected_tasks_do_not_count_against_the_tenant(self):
+        manager = self.create_manager(max_concurrent_tasks=0, max_queue_size=1)
+        manager.add_task(record_sqlite_task, task_id="b-0", api_key="b")
+        for _ in range(5):
+            with self.assertRaises(TaskQueueFullError):
+                manager.add_task(record_sqlite_task, task_id="a-x", api_key="a")
+        self.assertEqual(manager.dequeue()["kwargs"]["task_id"], "b-0")
+        manager.max_queue_size = 0
+        manager.add_task(record_sqlite_task, task_id="b-1", api_key="b")
+        manager.add_task(record_sqlite_task, task_id="a-0", api_key="a")
+        self.assertEqual(manager.dequeue()["kwargs"]["task_id"], "a-0")
+
+    def test_higher_priority_tasks_run_first(self):
+        manager = self.create_manager(max_concurrent_tasks=0)
+        manager.add_task(record_sqlite_task, task_id="bulk", priority="low")
+        manager.add_task(record_sqlite_task, task_id="preview", priority="high")
+        self.assertEqual(manager.dequeue()["kwargs"]["task_id"], "preview")
+        self.assertEqual(manager.dequeue()["kwargs"]["task_id"], "bulk")
+
+    def test_waiting_tasks_survive_restart(self):
+        manager = self.create_manager(max_concurrent_tasks=0)
+        manager.add_task(record_sqlite_task, task_id="t1")
+        manager.shutdown(timeout=1)
+
+        self.create_manager(max_concurrent_tasks=1)
+        self.assertTrue(self._wait_for(lambda: _results))
+        self.assertEqual(_results[0][0], "t1")
+
+    def test_interrupted_tasks_are_requeued_then_failed(self):
+        state = sm.MemoryState()
+        with mock.patch.object(sm, "state", state):
+            manager = self.create_manager(max_concurrent_tasks=0, max_attempts=2)
+            manager.add_task(record_sqlite_task, task_id="t1")
+            # taken by a worker that then crashed
+            self.assertIsNotNone(manager.dequeue(timeout=1))
+
+            restarted = self.create_manager(max_concurrent_tasks=0, max_attempts=2)
+            self.assertEqual(restarted.queue_size(), 1)
+            self.assertIsNotNone(restarted.dequeue(timeout=1))
+
+            # second interruption reaches max_attempts
+            state.update_task("t1", const.TASK_STATE_PROCESSING, 50)
+            restarted_again = self.create_manager(max_concurrent_tasks=0, max_attempts=2)
+            self.assertEqual(restarted_again.queue_size(), 0)
+            self.assertEqual(state.get_task("t1")["state"], const.TASK_STATE_FAILED)
+
+    def test_dequeue_waits_for_enqueue(self):
+        manager = self.create_manager(max_concurrent_tasks=0)
+        threading.Timer(0.1, lambda: manager.add_task(record_sqlite_task, task_id="t1")).start()
+        started = time.monotonic()
+        task_info = manager.dequeue(timeout=2)
+        self.assertIsNotNone(task_info)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(task_info["kwargs"]["task_id"], "t1")
+
+
+if __name__ == "__main__":
+    unittest.main()
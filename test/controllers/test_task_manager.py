@@ -0,0 +1,183 @@
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.controllers.manager.fair_scheduler import FairScheduler
+from app.controllers.manager.memory_manager import InMemoryTaskManager
+from app.models.exception import TaskManagerStoppedError, TaskQueueFullError
+from app.services.stage_limits import StageLimiter
+
+
+class TestInMemoryTaskManager(unittest.TestCase):
+    def setUp(self):
+        self.manager = None
+
+    def tearDown(self):
+        if self.manager:
+            self.manager.shutdown(timeout=5)
+
+    def _wait_idle(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.manager.queue_size() or self.manager.current_tasks:
+            self.assertLess(time.monotonic(), deadline, "tasks did not finish")
+            time.sleep(0.01)
+
+    def test_burst_never_exceeds_max_concurrent_tasks(self):
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=2)
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+        done = []
+
+        def task(i):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            done.append(i)
+
+        for i in range(10):
+            self.manager.add_task(task, i)
+        self._wait_idle()
+
+        self.assertEqual(sorted(done), list(range(10)))
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(self.manager.current_tasks, 0)
+
+    def test_full_queue_rejects_task(self):
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=1, max_queue_size=1)
+        release = threading.Event()
+        self.manager.add_task(release.wait)
+        # wait until the worker picked up the first task
+        while self.manager.current_tasks == 0:
+            time.sleep(0.01)
+
+        self.manager.add_task(release.wait)
+        with self.assertRaises(TaskQueueFullError):
+            self.manager.add_task(release.wait)
+        release.set()
+
+    def test_shutdown_finishes_running_task_only_and_rejects_new_tasks(self):
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=1)
+        done = []
+        for i in range(3):
+            self.manager.add_task(lambda i=i: (time.sleep(0.2), done.append(i)))
+        # wait until the worker picked up the first task
+        while self.manager.current_tasks == 0:
+            time.sleep(0.01)
+        self.assertTrue(self.manager.shutdown(timeout=5))
+
+        self.assertEqual(done, [0])
+        with self.assertRaises(TaskManagerStoppedError):
+            self.manager.add_task(print)
+
+    def test_shutdown_reports_workers_still_running(self):
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=1)
+        release = threading.Event()
+        self.manager.add_task(release.wait)
+        while self.manager.current_tasks == 0:
+            time.sleep(0.01)
+        try:
+            self.assertFalse(self.manager.shutdown(timeout=0.1))
+        finally:
+            release.set()
+
+    def test_failing_task_does_not_stop_worker(self):
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=1)
+        done = []
+        self.manager.add_task(lambda: 1 / 0)
+        self.manager.add_task(lambda: done.append(True))
+        self._wait_idle()
+        self.assertEqual(done, [True])
+
+    def _order(self):
+        order = []
+        while True:
+            task_info = self.manager.dequeue()
+            if not task_info:
+                return order
+            order.append(task_info["args"][0])
+
+    def test_priorities_run_first_within_a_tenant(self):
+        # no workers, the tasks only wait
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=0)
+        for i in range(3):
+            self.manager.add_task(print, f"bulk-{i}", priority="low", api_key="a")
+        self.manager.add_task(print, "preview", priority="high", api_key="a")
+        self.assertEqual(self._order(), ["preview", "bulk-0", "bulk-1", "bulk-2"])
+
+        with self.assertRaises(ValueError):
+            self.manager.add_task(print, "x", priority="urgent")
+
+    def test_tenants_share_the_workers_fairly(self):
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=0)
+        for i in range(3):
+            self.manager.add_task(print, f"a-{i}", api_key="a")
+        self.manager.add_task(print, "b-0", api_key="b")
+        self.assertEqual(self._order(), ["a-0", "b-0", "a-1", "a-2"])
+
+    def test_rejected_tasks_do_not_count_against_the_tenant(self):
+        self.manager = InMemoryTaskManager(max_concurrent_tasks=0, max_queue_size=1)
+        self.manager.add_task(print, "b-0", api_key="b")
+        for _ in range(5):
+            with self.assertRaises(TaskQueueFullError):
+                self.manager.add_task(print, "a-x", api_key="a")
+        self.assertEqual(self._order(), ["b-0"])
+        # a's retries against the full queue did not push its next task back
+        self.manager.max_queue_size = 0
+        self.manager.add_task(print, "b-1", api_key="b")
+        self.manager.add_task(print, "a-0", api_key="a")
+        self.assertEqual(self._order(), ["a-0", "b-1"])
+
+
+class TestFairScheduler(unittest.TestCase):
+    def test_low_priority_tasks_age(self):
+        scheduler = FairScheduler(fair_share=60, priority_delays={}, tenant_weights={})
+        low = scheduler.score(scheduler.tag("", now=0), "low")
+        # a high priority task queued shortly after runs first, one queued much later does not
+        self.assertLess(scheduler.score(scheduler.tag("", now=10), "high"), low)
+        self.assertGreater(scheduler.score(scheduler.tag("", now=301), "high"), low)
+
+    def test_weights_by_api_key(self):
+        scheduler = FairScheduler(fair_share=60, priority_delays={}, tenant_weights={"gold": 2})
+        tenant = scheduler.tenant_id("gold")
+        self.assertNotIn("gold", tenant)
+        self.assertEqual(scheduler.tag(tenant, now=0), 30)
+        self.assertEqual(scheduler.tag(scheduler.tenant_id("other"), now=0), 60)
+
+
+class TestStageLimiter(unittest.TestCase):
+    def test_stage_limit(self):
+        limiter = StageLimiter({"render": 1, "tts": 0})
+        lock = threading.Lock()
+        running = {"render": 0, "tts": 0}
+        peak = {"render": 0, "tts": 0}
+
+        def run(stage):
+            with limiter.limit(stage):
+                with lock:
+                    running[stage] += 1
+                    peak[stage] = max(peak[stage], running[stage])
+                time.sleep(0.05)
+                with lock:
+                    running[stage] -= 1
+
+        threads = [threading.Thread(target=run, args=(s,)) for s in ["render", "tts"] * 3]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(peak["render"], 1)
+        self.assertEqual(peak["tts"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import shutil
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.controllers.manager import registry
+from app.models import const
+from app.models.schema import TaskVideoBatchRequest, TaskVideoRequest, VideoParams
+from app.services import state as sm
+from app.services import task as tm
+from app.utils import utils
+
+
+class TestStartBatch(unittest.TestCase):
+    def setUp(self):
+        self.state = sm.MemoryState()
+        patcher = mock.patch.object(sm, "state", self.state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.task_ids = ["b-t1", "b-t2", "b-t3"]
+        self.params = [VideoParams(article_text=t) for t in ("sea", "sky", "fail")]
+        self.state.update_task("batch-1", task_ids=self.task_ids)
+        for task_id in self.task_ids:
+            self.state.update_task(task_id, batch_id="batch-1")
+
+    def test_batch_state_follows_its_tasks(self):
+        def fake_start(task_id, params, stop_at, resume, cancel_token):
+            state = const.TASK_STATE_FAILED if params.article_text == "fail" else const.TASK_STATE_COMPLETE
+            self.state.update_task(task_id, state=state, progress=100)
+
+        with mock.patch.object(tm, "_start", side_effect=fake_start), mock.patch.object(
+            tm.webhooks, "notify"
+        ):
+            tm.start("b-t1", self.params[0])
+            batch = self.state.get_task("batch-1")
+            self.assertEqual(batch["state"], const.TASK_STATE_PROCESSING)
+            self.assertEqual(batch["progress"], 33)
+            tm.start("b-t2", self.params[1])
+            tm.start("b-t3", self.params[2])
+
+        batch = self.state.get_task("batch-1")
+        self.assertEqual(batch["state"], const.TASK_STATE_COMPLETE)
+        self.assertEqual(batch["progress"], 100)
+        self.assertEqual((batch["completed"], batch["failed"], batch["cancelled"]), (2, 1, 0))
+        self.assertEqual(batch["task_ids"], self.task_ids)
+
+    def test_cancelled_batch_cancels_its_tasks(self):
+        for task_id in ["batch-1"] + self.task_ids:
+            self.addCleanup(shutil.rmtree, utils.task_dir(task_id), True)
+        self.state.update_task("b-t1", state=const.TASK_STATE_COMPLETE, progress=100)
+        self.state.update_task("batch-1", state=const.TASK_STATE_CANCELLED)
+        tm.cancel_batch("batch-1")
+        # the real start, the queued tasks see their cancelled state before running any stage
+        with mock.patch.object(tm, "_start") as _start, mock.patch.object(tm.webhooks, "notify"):
+            for task_id, params in zip(self.task_ids[1:], self.params[1:]):
+                tm.start(task_id, params)
+        _start.assert_not_called()
+        for task_id in self.task_ids[1:]:
+            self.assertEqual(self.state.get_task(task_id)["state"], const.TASK_STATE_CANCELLED)
+        batch = self.state.get_task("batch-1")
+        self.assertEqual(batch["state"], const.TASK_STATE_CANCELLED)
+        self.assertEqual((batch["completed"], batch["cancelled"]), (1, 2))
+
+    def test_batch_tasks_run_through_the_task_manager(self):
+        from app.controllers.v1 import video as video_controller
+
+        manager = mock.Mock(max_queue_size=0, max_concurrent_tasks=2)
+        request = mock.Mock(headers={})
+        body = TaskVideoBatchRequest(tasks=[TaskVideoRequest(article_text=t) for t in ("sea", "sky")])
+        with mock.patch.object(video_controller, "task_manager", manager), mock.patch.object(
+            video_controller, "_estimate_wait", return_value=0
+        ):
+            response = video_controller.create_video_batch(request, body)
+
+        task_ids = response["data"]["task_ids"]
+        self.assertEqual(manager.add_task.call_count, 2)
+        for call, task_id in zip(manager.add_task.call_args_list, task_ids):
+            self.assertIs(call.args[0], tm.start)
+            self.assertEqual(call.kwargs["task_id"], task_id)
+            self.assertEqual(call.kwargs["priority"], "low")
+            # durable queues store the queued task as its function name
+            func, _, kwargs = registry.decode_task(
+                registry.encode_task({"func": call.args[0], "args": (), "kwargs": {
+                    k: v for k, v in call.kwargs.items() if k not in ("priority", "api_key")
+                }})
+            )
+            self.assertIsInstance(kwargs["params"], VideoParams)
+
+
+if __name__ == "__main__":
+    unittest.main()
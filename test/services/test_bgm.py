@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services import bgm, media_catalog
+from app.utils import utils
+
+
+class TestBgmLibrary(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.song_dir = os.path.join(directory.name, "songs")
+        os.makedirs(self.song_dir)
+        self.song = os.path.join(self.song_dir, "a.mp3")
+        shutil.copy(os.path.join(utils.song_dir(), "output000.mp3"), self.song)
+        self.catalog = media_catalog.MediaCatalog(os.path.join(directory.name, "media.db"))
+        self.library = bgm.BgmLibrary(
+            self.song_dir,
+            os.path.join(directory.name, "cache"),
+            target_loudness=-20,
+            watch_interval=0,
+            catalog=self.catalog,
+        )
+
+    def test_tracks_follow_the_directory(self):
+        self.assertEqual([t["name"] for t in self.library.tracks()], ["a.mp3"])
+        self.assertEqual(self.library.pick(), self.song)
+
+        shutil.copy(self.song, os.path.join(self.song_dir, "b.mp3"))
+        with open(os.path.join(self.song_dir, "notes.txt"), "w") as f:
+            f.write("not a song")
+        # the directory mtime may not change within its resolution
+        self.library._refresh(force=True)
+        self.assertEqual([t["name"] for t in self.library.tracks()], ["a.mp3", "b.mp3"])
+
+        self.library.pcm(self.song)
+        self.assertIsNotNone(self.library.tracks()[0]["loudness"])
+        os.remove(self.song)
+        self.library._refresh(force=True)
+        self.assertEqual([t["name"] for t in self.library.tracks()], ["b.mp3"])
+        self.assertIsNone(self.catalog.get(self.song))
+
+    def test_pcm_is_decoded_once_and_normalized(self):
+        pcm = self.library.pcm(self.song)
+        entry = self.catalog.get(self.song)
+        self.assertEqual(pcm.shape[1], 2)
+        self.assertAlmostEqual(len(pcm) / 44100, entry["duration"], delta=0.2)
+        cache_files = os.listdir(self.library.cache_dir)
+        self.assertEqual(len(cache_files), 1)
+
+        self.library.pcm(self.song)
+        self.assertEqual(os.listdir(self.library.cache_dir), cache_files)
+
+        louder = bgm.BgmLibrary(
+            self.song_dir, self.library.cache_dir, target_loudness=-14, catalog=self.catalog
+        ).pcm(self.song)
+        rms = lambda a: np.sqrt(np.mean(a[44100 * 30 : 44100 * 60].astype(np.float64) ** 2))
+        # +6 dB: twice the amplitude
+        self.assertAlmostEqual(rms(louder) / rms(pcm), 2, delta=0.1)
+
+    def test_clip_loops_with_a_fade_out_per_pass(self):
+        pcm = self.library.pcm(self.song)
+        frames = len(pcm)
+        clip = self.library.clip(self.song, duration=frames / 44100 * 2.5, volume=0.5)
+        self.assertEqual(clip.nchannels, 2)
+
+        t = np.array([10.0, 10.0 + frames / 44100])
+        np.testing.assert_allclose(clip.get_frame(t)[0], clip.get_frame(t)[1])
+        np.testing.assert_allclose(clip.get_frame(10.0), pcm[441000] / 32768 * 0.5, rtol=1e-5)
+        # the last sample of a pass is faded out, the first of the next one is not
+        last = (frames - 1) / 44100
+        self.assertTrue(np.all(np.abs(clip.get_frame(last)) < 1e-3))
+        np.testing.assert_allclose(clip.get_frame(last + 1 / 44100), pcm[0] / 32768 * 0.5, rtol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
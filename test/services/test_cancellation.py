@@ -0,0 +1,180 @@
+import os
+import pickle
+import shutil
+import subprocess
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models import const
+from app.models.exception import TaskCancelledError
+from app.models.schema import VideoParams
+from app.services import cancellation, pipeline
+from app.services import state as sm
+from app.services import task as tm
+from app.utils import utils
+
+_sleep = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+class TestCancellation(unittest.TestCase):
+    def setUp(self):
+        self.task_id = f"test-cancel-{utils.get_uuid()}"
+
+    def tearDown(self):
+        cancellation.release(self.task_id)
+        shutil.rmtree(utils.task_dir(self.task_id), ignore_errors=True)
+
+    def _wait_exit(self, process, timeout=5):
+        try:
+            return process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            self.fail("subprocess was not killed")
+
+    def test_cancel_kills_the_subprocesses_of_the_token(self):
+        token = cancellation.create(self.task_id)
+        process = token.popen(_sleep)
+        # not started through the token: not the task's
+        other = subprocess.Popen(_sleep)
+        try:
+            self.assertTrue(cancellation.cancel(self.task_id))
+            self._wait_exit(process)
+            self.assertIsNone(other.poll())
+        finally:
+            other.kill()
+            other.wait()
+        with self.assertRaises(TaskCancelledError):
+            token.raise_if_cancelled()
+        self.assertTrue(cancellation.is_cancelled(self.task_id))
+
+    def test_run_raises_once_its_process_is_killed(self):
+        token = cancellation.create(self.task_id)
+        threading.Timer(0.2, token.cancel).start()
+        started = time.monotonic()
+        with self.assertRaises(TaskCancelledError):
+            # from another thread than the one that cancels, e.g. asyncio.to_thread
+            cancellation.run(_sleep, token, capture_output=True)
+        self.assertLess(time.monotonic() - started, 5)
+        # without a token: plain subprocess.run
+        result = cancellation.run([sys.executable, "-c", "print(1)"], capture_output=True, text=True)
+        self.assertEqual(result.stdout, "1\n")
+
+    def test_progress_logger_stops_a_moviepy_write(self):
+        from moviepy import ColorClip
+
+        token = cancellation.create(self.task_id)
+        token.cancel()
+        output = utils.task_dir(self.task_id) + "/clip.mp4"
+        with self.assertRaises(TaskCancelledError):
+            ColorClip((16, 16), (0, 0, 0), duration=60).write_videofile(
+                output, fps=10, logger=token.progress_logger()
+            )
+
+    def test_checking_an_unknown_task_creates_nothing(self):
+        self.assertFalse(cancellation.is_cancelled(self.task_id))
+        self.assertFalse(cancellation.CancelToken(self.task_id).cancelled)
+        self.assertFalse(os.path.exists(os.path.join(utils.storage_dir("tasks"), self.task_id)))
+
+    def test_copy_in_render_process_sees_the_flag_file(self):
+        token = cancellation.create(self.task_id)
+        copy = pickle.loads(pickle.dumps(token))
+        with copy.watch():
+            process = copy.popen(_sleep)
+            token.cancel()
+            # killed by the poller of the copy, which only sees the flag file
+            self._wait_exit(process)
+        self.assertTrue(copy.cancelled)
+
+    def test_run_stages_returns_on_cancel(self):
+        token = cancellation.create(self.task_id)
+        release = threading.Event()
+
+        def slow(context):
+            release.wait(10)
+            return {}
+
+        threading.Timer(0.2, token.cancel).start()
+        started = time.monotonic()
+        try:
+            with self.assertRaises(TaskCancelledError):
+                pipeline.run_stages(
+                    [pipeline.Stage("slow", slow)], "slow", {}, cancel_token=token
+                )
+            self.assertLess(time.monotonic() - started, 2)
+        finally:
+            release.set()
+
+    def test_task_cancelled_while_queued_does_not_run(self):
+        state = sm.MemoryState()
+        with mock.patch.object(sm, "state", state), mock.patch.object(tm, "build_stages") as build:
+            state.update_task(self.task_id, const.TASK_STATE_CANCELLED, 0)
+            self.assertIsNone(tm.start(self.task_id, VideoParams(article_text="sea")))
+            build.assert_not_called()
+            self.assertEqual(state.get_task(self.task_id)["state"], const.TASK_STATE_CANCELLED)
+
+    def test_failures_after_cancel_keep_the_cancelled_state(self):
+        state = sm.MemoryState()
+        with mock.patch.object(sm, "state", state):
+            cancellation.create(self.task_id)
+            state.update_task(self.task_id, const.TASK_STATE_CANCELLED, 40)
+            cancellation.cancel(self.task_id)
+            cancellation.release(self.task_id)
+            tm.mark_failed(self.task_id)
+            self.assertEqual(state.get_task(self.task_id)["state"], const.TASK_STATE_CANCELLED)
+
+    def _delete_running_task(self, state, stop_delay):
+        from app.controllers.v1 import video as video_controller
+
+        started = threading.Event()
+
+        def _start(task_id, params, stop_at, resume, cancel_token):
+            state.update_task(task_id, const.TASK_STATE_PROCESSING, 40)
+            started.set()
+            while not cancel_token.cancelled:
+                time.sleep(0.01)
+            # still writing into the task dir after the cancel
+            time.sleep(stop_delay)
+            with open(os.path.join(utils.task_dir(task_id), "final.mp4"), "w") as f:
+                f.write("partial")
+            cancel_token.raise_if_cancelled()
+
+        worker = threading.Thread(
+            target=tm.start, args=(self.task_id, VideoParams(article_text="sea"))
+        )
+        with mock.patch.object(tm, "_start", _start):
+            worker.start()
+            self.assertTrue(started.wait(5))
+            try:
+                return video_controller.delete_video(mock.Mock(headers={}), self.task_id)
+            finally:
+                worker.join(5)
+
+    def test_delete_waits_for_the_running_task_to_stop(self):
+        state = sm.MemoryState()
+        with mock.patch.object(sm, "state", state):
+            self._delete_running_task(state, stop_delay=0.3)
+            self.assertFalse(os.path.exists(os.path.join(utils.storage_dir("tasks"), self.task_id)))
+            self.assertIsNone(state.get_task(self.task_id))
+
+    def test_delete_keeps_a_task_that_does_not_stop_in_time(self):
+        from app.config import config
+        from app.models.exception import HttpException
+
+        state = sm.MemoryState()
+        with mock.patch.object(sm, "state", state), mock.patch.dict(
+            config.app, {"task_delete_timeout": 0.05}
+        ):
+            with self.assertRaises(HttpException):
+                self._delete_running_task(state, stop_delay=0.5)
+            self.assertEqual(state.get_task(self.task_id)["state"], const.TASK_STATE_CANCELLED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import unittest
+import sys
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import PodcastScript, VideoParams
+from app.services import pipeline
+from app.services.checkpoint import Checkpoints, load_task
+from app.utils import utils
+
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.task_id = f"test-checkpoint-{utils.get_uuid()}"
+        self.task_dir = utils.task_dir(self.task_id)
+        self.params = VideoParams(article_text="sea", podcast_mode=True)
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.task_dir, ignore_errors=True)
+
+    def build_stages(self, checkpoints, fail_render=False):
+        audio_file = os.path.join(self.task_dir, "audio.mp3")
+
+        def script(context):
+            self.calls.append("script")
+            turn = PodcastScript(
+                speaker_1="hi", speaker_2="hello", speaker_1_voice="v1", speaker_2_voice="v2"
+            )
+            return {"video_script": [turn]}
+
+        def audio(context):
+            self.calls.append("audio")
+            with open(audio_file, "wb") as f:
+                f.write(b"audio" * len(self.calls))
+            # the sub maker is not restored
+            return {"audio_result": (audio_file, 3.5, object())}
+
+        def render(context):
+            self.calls.append("render")
+            if fail_render:
+                return None
+            self.assertIsInstance(context["video_script"][0], PodcastScript)
+            return {"final_video_paths": [context["audio_result"][0]]}
+
+        stages = [
+            pipeline.Stage("script", script),
+            pipeline.Stage("audio", audio, ["script"]),
+            pipeline.Stage("render", render, ["audio"]),
+        ]
+        for stage in stages:
+            stage.func = checkpoints.wrap(stage.name, stage.func, stage.inputs)
+        return stages
+
+    def run_task(self, resume, fail_render=False):
+        checkpoints = Checkpoints(self.task_id, self.params, "video", resume=resume)
+        context = {}
+        ok = pipeline.run_stages(
+            self.build_stages(checkpoints, fail_render), "render", context
+        )
+        return ok, context
+
+    def test_resume_skips_finished_stages(self):
+        ok, _ = self.run_task(resume=False, fail_render=True)
+        self.assertFalse(ok)
+        self.assertEqual(self.calls, ["script", "audio", "render"])
+
+        self.calls.clear()
+        ok, context = self.run_task(resume=True)
+        self.assertTrue(ok)
+        self.assertEqual(self.calls, ["render"])
+        audio_file, duration, sub_maker = context["audio_result"]
+        self.assertEqual(duration, 3.5)
+        self.assertIsNone(sub_maker)
+
+        params, stop_at = load_task(self.task_id)
+        self.assertEqual(params.article_text, "sea")
+        self.assertEqual(stop_at, "video")
+
+    def test_changed_output_reruns_dependent_stages(self):
+        self.run_task(resume=False)
+        with open(os.path.join(self.task_dir, "audio.mp3"), "ab") as f:
+            f.write(b"truncated or replaced")
+
+        self.calls.clear()
+        self.run_task(resume=True)
+        self.assertEqual(self.calls, ["audio", "render"])
+
+    def test_without_resume_every_stage_runs(self):
+        self.run_task(resume=False)
+        self.calls.clear()
+        self.run_task(resume=False)
+        self.assertEqual(self.calls, ["script", "audio", "render"])
+
+    def test_changed_params_invalidate_checkpoints(self):
+        self.run_task(resume=False)
+        self.params = VideoParams(article_text="sky", podcast_mode=True)
+        self.calls.clear()
+        self.run_task(resume=True)
+        self.assertEqual(self.calls, ["script", "audio", "render"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services import eta
+from app.services import state as sm
+from app.services import task as tm
+
+
+class TestEta(unittest.TestCase):
+    def setUp(self):
+        self.state = sm.MemoryState()
+        patcher = mock.patch.object(sm, "state", self.state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(eta, "_cache", (0.0, {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_task_duration_is_the_longest_chain_of_stages(self):
+        durations = {"script": 10, "terms": 5, "audio": 30, "subtitle": 5, "materials": 60, "render": 100}
+        # script, terms, materials (75) is longer than script, audio, subtitle (45)
+        self.assertEqual(eta.task_duration("render", tm.stage_inputs, durations), 175)
+        self.assertEqual(eta.task_duration("subtitle", tm.stage_inputs, durations), 45)
+
+    def test_stage_durations_use_the_recent_runs(self):
+        for seconds in (10, 200, 30):
+            self.state.add_duration("render", seconds)
+        durations = eta.stage_durations()
+        self.assertEqual(durations["render"], 30)
+        # no runs yet, the default
+        self.assertGreater(durations["materials"], 0)
+
+    def test_stage_timing_records_successful_runs_only(self):
+        tm._timed("audio", lambda context: {"audio_result": 1})({})
+        tm._timed("render", lambda context: None)({})
+        self.assertEqual(list(self.state.get_durations()), ["audio"])
+
+    def test_queue_wait(self):
+        # a free worker
+        self.assertEqual(eta.queue_wait(queued=0, running=1, concurrency=2, duration=100), 0)
+        # the running task is half done
+        self.assertEqual(eta.queue_wait(queued=0, running=1, concurrency=1, duration=100), 50)
+        self.assertEqual(eta.queue_wait(queued=3, running=2, concurrency=2, duration=100), 175)
+
+    def test_timestamp(self):
+        at = datetime.fromisoformat(eta.timestamp(60))
+        seconds = (at - datetime.now(timezone.utc)).total_seconds()
+        self.assertTrue(55 <= seconds <= 61)
+
+
+if __name__ == "__main__":
+    unittest.main()
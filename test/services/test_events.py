@@ -0,0 +1,141 @@
+import asyncio
+import json
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from loguru import logger
+
+from app.models import const
+from app.services import events
+from app.services import state as sm
+
+
+async def next_event(subscription, timeout=2):
+    return json.loads(await asyncio.wait_for(subscription.queue.get(), timeout))
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(events, "_redis", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        events.start()
+        self.addCleanup(events.stop)
+
+    def test_state_updates_and_task_logs_reach_the_subscribers(self):
+        state = sm.MemoryState()
+
+        async def run():
+            subscription = events.subscribe("t1")
+            other = events.subscribe("t2")
+            state.update_task("t1", const.TASK_STATE_PROCESSING, 50, audio_file="a.mp3")
+            with logger.contextualize(task_id="t1"):
+                logger.info("rendering")
+            logger.info("not a task log line")
+
+            first = await next_event(subscription)
+            self.assertEqual(first["event"], "state")
+            self.assertEqual(first["data"]["progress"], 50)
+            self.assertEqual(first["data"]["audio_file"], "a.mp3")
+            second = await next_event(subscription)
+            self.assertEqual(second["event"], "log")
+            self.assertEqual(second["data"]["message"], "rendering")
+            self.assertTrue(subscription.queue.empty())
+            self.assertTrue(other.queue.empty())
+
+            subscription.close()
+            other.close()
+            self.assertFalse(events.has_subscribers("t1"))
+
+        asyncio.run(run())
+
+    def test_task_logs_are_not_published_after_stop(self):
+        async def run():
+            subscription = events.subscribe("t1")
+            events.stop()
+            with logger.contextualize(task_id="t1"):
+                logger.info("after shutdown")
+            await asyncio.sleep(0.05)
+            self.assertTrue(subscription.queue.empty())
+            subscription.close()
+
+        asyncio.run(run())
+
+    def test_event_stream_ends_when_the_task_finished(self):
+        from app.controllers.v1 import video
+
+        request = mock.Mock()
+        request.is_disconnected = mock.AsyncMock(return_value=False)
+
+        async def run():
+            subscription = events.subscribe("t1")
+            task = {"task_id": "t1", "state": const.TASK_STATE_PROCESSING, "progress": 5}
+            stream = video._event_stream(request, subscription, task)
+            chunks = [await stream.__anext__(), await stream.__anext__()]
+            events.publish("t1", "state", {"task_id": "t1", "state": const.TASK_STATE_COMPLETE, "progress": 100})
+            chunks += [chunk async for chunk in stream]
+            return chunks
+
+        chunks = asyncio.run(run())
+        self.assertEqual(chunks[0], "retry: 3000\n\n")
+        self.assertTrue(chunks[1].startswith("event: state\ndata: "))
+        self.assertEqual(json.loads(chunks[2].split("data: ", 1)[1])["progress"], 100)
+        self.assertEqual(len(chunks), 3)
+        self.assertFalse(events.has_subscribers("t1"))
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisEvents(unittest.TestCase):
+    def test_updates_on_another_node_are_fanned_out(self):
+        server = fakeredis.FakeServer()
+        worker_state = sm.RedisState(redis_client=fakeredis.FakeRedis(server=server))
+        for name, value in (
+            ("_redis", fakeredis.FakeRedis(server=server)),
+            ("_listener", None),
+            ("_log_publisher", None),
+        ):
+            patcher = mock.patch.object(events, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        events.start()
+        self.addCleanup(events.stop)
+
+        async def run():
+            subscription = events.subscribe("t1")
+            # the listener subscribes in the background
+            for _ in range(100):
+                if events._redis.execute_command("PUBSUB", "NUMPAT"):
+                    break
+                await asyncio.sleep(0.02)
+            worker_state.update_task("t1", const.TASK_STATE_COMPLETE, 100)
+            # published by the background thread, not by the logging call
+            with logger.contextualize(task_id="t1"):
+                logger.info("rendering")
+            received = [await next_event(subscription), await next_event(subscription)]
+            subscription.close()
+            return received
+
+        state_event, log_event = asyncio.run(run())
+        self.assertEqual(state_event["event"], "state")
+        self.assertEqual(state_event["data"]["state"], const.TASK_STATE_COMPLETE)
+        self.assertEqual(log_event["event"], "log")
+        self.assertEqual(log_event["data"]["message"], "rendering")
+
+        listener, publisher = events._listener, events._log_publisher
+        events.stop()
+        self.assertFalse(listener.is_alive())
+        self.assertFalse(publisher.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
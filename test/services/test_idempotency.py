@@ -0,0 +1,91 @@
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.controllers.manager.fair_scheduler import FairScheduler
+from app.models import const
+from app.models.exception import IdempotencyKeyReusedError
+from app.models.schema import VideoParams
+from app.services import idempotency
+from app.services import state as sm
+
+
+class TestIdempotency(unittest.TestCase):
+    def setUp(self):
+        self.state = sm.MemoryState()
+        patcher = mock.patch.object(sm, "state", self.state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create(self, task_id, params, key="", api_key=""):
+        self.state.update_task(task_id)
+        existing, claimed = idempotency.claim(
+            task_id, params, "video", key, tenant=FairScheduler.tenant_id(api_key)
+        )
+        if existing:
+            self.state.delete_task(task_id)
+        return existing, claimed
+
+    def test_fingerprint_ignores_surrounding_whitespace(self):
+        a = idempotency.fingerprint(VideoParams(article_text="sea "), "video")
+        b = idempotency.fingerprint(VideoParams(article_text="sea"), "video")
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, idempotency.fingerprint(VideoParams(article_text="sea"), "audio"))
+
+    def test_duplicates_attach_while_the_task_runs(self):
+        params = VideoParams(article_text="sea")
+        self.assertEqual(self.create("t1", params)[0], None)
+        self.assertEqual(self.create("t2", VideoParams(article_text="sea"))[0], "t1")
+        self.assertIsNone(self.state.get_task("t2"))
+
+        # finished: the same request renders again
+        self.state.update_task("t1", const.TASK_STATE_COMPLETE, 100)
+        self.assertEqual(self.create("t3", params)[0], None)
+
+    def test_idempotency_key_returns_the_task_in_any_state(self):
+        params = VideoParams(article_text="sea")
+        self.assertEqual(self.create("t1", params, key="k1")[0], None)
+        self.state.update_task("t1", const.TASK_STATE_COMPLETE, 100)
+        self.assertEqual(self.create("t2", params, key="k1")[0], "t1")
+
+        with self.assertRaises(IdempotencyKeyReusedError):
+            self.create("t3", VideoParams(article_text="sky"), key="k1")
+
+    def test_idempotency_key_follows_the_coalesced_task(self):
+        params = VideoParams(article_text="sea")
+        self.create("t1", params)
+        self.assertEqual(self.create("t2", params, key="k2")[0], "t1")
+        self.state.update_task("t1", const.TASK_STATE_COMPLETE, 100)
+        self.assertEqual(self.create("t3", params, key="k2")[0], "t1")
+
+    def test_tenants_never_attach_to_each_other(self):
+        params = VideoParams(article_text="sea")
+        self.assertEqual(self.create("t1", params, key="k1", api_key="alice")[0], None)
+        # same Idempotency-Key, same params, another API key
+        self.assertEqual(self.create("t2", params, key="k1", api_key="bob")[0], None)
+        self.assertEqual(self.create("t3", params, api_key="bob")[0], "t2")
+        self.assertEqual(self.create("t4", params, key="k1", api_key="alice")[0], "t1")
+        self.assertEqual(self.create("t5", params)[0], None)
+
+    def test_release_frees_the_keys(self):
+        params = VideoParams(article_text="sea")
+        _, claimed = self.create("t1", params, key="k1")
+        self.assertEqual(len(claimed), 2)
+        # e.g. the queue was full
+        self.state.delete_task("t1")
+        idempotency.release("t1", params, "video", claimed)
+        self.assertEqual(self.create("t2", params, key="k1")[0], None)
+
+    def test_coalescing_can_be_disabled(self):
+        params = VideoParams(article_text="sea")
+        self.create("t1", params)
+        with mock.patch.dict(idempotency.config.app, {"coalesce_duplicate_tasks": False}):
+            self.assertEqual(self.create("t2", params)[0], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
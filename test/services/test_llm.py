@@ -0,0 +1,349 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import PodcastScript
+from app.services import llm, podcast_audio
+
+
+def setUpModule():
+    # never the real storage/llm_cache
+    global _cache_dir, _cache_patcher
+    _cache_dir = tempfile.mkdtemp()
+    _cache_patcher = mock.patch.object(llm.llm_cache, "cache", llm.llm_cache.LLMCache(cache_dir=_cache_dir))
+    _cache_patcher.start()
+
+
+def tearDownModule():
+    _cache_patcher.stop()
+    shutil.rmtree(_cache_dir, ignore_errors=True)
+
+
+def _turn(a, b):
+    return PodcastScript(speaker_1=a, speaker_2=b, speaker_1_voice="v1", speaker_2_voice="v2")
+
+
+class TestPodcastChunking(unittest.TestCase):
+    def test_split_article_keeps_paragraphs_together(self):
+        paragraphs = [f"paragraph {i} " + "x" * 90 for i in range(10)]
+        article = "\n\n".join(paragraphs)
+        chunks = llm.split_article(article, 250)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 250 for chunk in chunks))
+        # nothing is lost and the order is preserved
+        self.assertEqual("\n\n".join(chunks), article)
+
+    def test_split_article_breaks_long_paragraph_by_sentence(self):
+        article = "第一句话。" * 30
+        chunks = llm.split_article(article, 40)
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+        self.assertEqual("".join(chunks).replace("\n", ""), article)
+
+    def test_allocate_turns(self):
+        self.assertEqual(llm._allocate_turns(["a" * 100, "b" * 300], 8), [2, 6])
+        self.assertEqual(llm._allocate_turns(["a", "b", "c"], 8), [3, 3, 2])
+        # never more than max_turns, at least one turn per chunk when there are enough
+        self.assertEqual(llm._allocate_turns(["a", "b", "c"], 1), [1, 0, 0])
+        self.assertEqual(llm._allocate_turns(["a", "b" * 1000], 4), [1, 3])
+
+    def test_chunks_are_grouped_to_the_turns(self):
+        self.assertEqual(llm._group_chunks(["a", "b", "c"], 2), ["a", "b\n\nc"])
+        self.assertEqual(llm._group_chunks(["a", "b"], 6), ["a", "b"])
+
+    def test_stitch_rewrites_section_openings(self):
+        sections = [[_turn("hi", "hello")], [_turn("so", "yes")], [_turn("and", "bye")]]
+        with mock.patch.object(
+            llm, "_generate_response", return_value=json.dumps(["moving on, so", "and then"])
+        ):
+            result = llm._stitch_podcast_sections(sections, "en", use_cache=False)
+
+        self.assertEqual([t.speaker_1 for t in result], ["hi", "moving on, so", "and then"])
+
+    def test_stitch_falls_back_on_invalid_reduce_response(self):
+        sections = [[_turn("hi", "hello")], [_turn("so", "yes")]]
+        with mock.patch.object(llm, "_generate_response", return_value="Error: timeout"):
+            result = llm._stitch_podcast_sections(sections, "en", use_cache=False)
+
+        self.assertEqual([t.speaker_1 for t in result], ["hi", "so"])
+
+
+class TestJsonRepair(unittest.TestCase):
+    def test_local_fix_needs_no_llm_call(self):
+        with mock.patch.object(llm, "_generate_response") as generate:
+            result = llm._parse_json_response('```json\n["a", "b",]\n```', llm._validate_string_list)
+        self.assertEqual(result, ["a", "b"])
+        generate.assert_not_called()
+
+    def test_repair_prompt_contains_only_the_broken_answer(self):
+        with mock.patch.object(llm, "_generate_response", return_value='["a", "b"]') as generate:
+            result = llm._parse_json_response('["a", 1]', llm._validate_string_list)
+        self.assertEqual(result, ["a", "b"])
+        generate.assert_called_once()
+        repair_prompt = generate.call_args[0][0]
+        self.assertIn('["a", 1]', repair_prompt)
+        self.assertIn("array of strings", repair_prompt)
+
+    def test_gives_up_after_max_repair_attempts(self):
+        with mock.patch.object(llm, "_generate_response", return_value="no json") as generate:
+            with self.assertRaises(ValueError):
+                llm._parse_json_response("still no json", llm._validate_string_list)
+        self.assertEqual(generate.call_count, llm._max_repair_attempts)
+
+    def test_podcast_script_calls_are_capped_in_total(self):
+        with mock.patch.object(llm, "_generate_response", return_value="no json") as generate, mock.patch.dict(
+            llm.config.app, {"llm_max_calls": 4}
+        ):
+            with self.assertRaises(Exception):
+                llm._generate_podcast_turns("prompt", use_cache=False)
+        # regenerations and repairs share the cap, not 5 x (1 + 2)
+        self.assertEqual(generate.call_count, 4)
+
+    def test_generate_terms_without_regeneration(self):
+        with mock.patch.object(
+            llm, "_generate_response", return_value='Terms:\n["solar power",\n "wind turbine",]'
+        ) as generate, mock.patch.object(llm.llm_cache.cache, "set"):
+            terms = llm.generate_terms("energy", "script", amount=2, use_cache=False)
+        self.assertEqual(terms, ["solar power", "wind turbine"])
+        self.assertEqual(generate.call_count, 1)
+
+
+class TestProviderFailover(unittest.TestCase):
+    def setUp(self):
+        llm.llm_health.health.reset()
+        self.config = {"llm_provider": "openai", "llm_fallback_providers": ["deepseek"]}
+        patcher = mock.patch.object(llm.config, "app", self.config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(llm.llm_health.health.reset)
+
+    def test_fails_over_to_next_provider(self):
+        answers = {"openai": "Error: rate limited", "deepseek": "ok"}
+        with mock.patch.object(
+            llm, "_generate_provider_response", side_effect=lambda p, *args: answers[p]
+        ) as generate:
+            self.assertEqual(llm._generate_response("prompt"), "ok")
+        self.assertEqual([c[0][0] for c in generate.call_args_list], ["openai", "deepseek"])
+
+    def test_open_circuit_is_tried_last(self):
+        for _ in range(llm.llm_health.health.failure_threshold):
+            llm.llm_health.health.record_failure("openai")
+        self.assertEqual(llm._get_provider_chain(), ["deepseek", "openai"])
+
+    def test_hedged_request_returns_first_valid_answer(self):
+        self.config["llm_hedging"] = True
+        for _ in range(llm.llm_health.health.min_samples):
+            llm.llm_health.health.record_success("openai", 0.05)
+
+        cancelled = threading.Event()
+
+        async def generate(llm_provider, *args):
+            try:
+                await asyncio.sleep(1 if llm_provider == "openai" else 0.05)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return f"answer from {llm_provider}"
+
+        with mock.patch.object(llm, "_agenerate_openai_response", side_effect=generate):
+            start = time.monotonic()
+            self.assertEqual(llm._generate_response("prompt"), "answer from deepseek")
+            self.assertLess(time.monotonic() - start, 0.5)
+            # the slower request is not left running
+            self.assertTrue(cancelled.wait(1))
+        self.assertEqual(llm._answered_by.get(), "deepseek")
+
+    def test_hedged_sync_sdk_requests_run_on_the_hedge_pool(self):
+        self.config.update(
+            {"llm_provider": "qwen", "llm_fallback_providers": ["gemini"], "llm_hedging": True}
+        )
+        threads = []
+
+        def generate(llm_provider, *args):
+            threads.append(threading.current_thread().name)
+            return f"answer from {llm_provider}"
+
+        with mock.patch.object(llm, "_generate_provider_response", side_effect=generate):
+            self.assertEqual(llm._generate_response("prompt"), "answer from qwen")
+        self.assertTrue(threads[0].startswith("llm-hedge"))
+
+    def test_async_fails_over_to_next_provider(self):
+        # qwen and gemini have no async SDK and run on a worker thread
+        self.config.update({"llm_provider": "qwen", "llm_fallback_providers": ["gemini"]})
+        answers = {"qwen": "", "gemini": "ok"}
+        with mock.patch.object(
+            llm, "_generate_provider_response", side_effect=lambda p, *args: answers[p]
+        ):
+            self.assertEqual(asyncio.run(llm._agenerate_response("prompt")), "ok")
+
+    def test_answer_is_cached_under_the_provider_that_gave_it(self):
+        answers = {
+            "openai": "Error: rate limited",
+            "deepseek": '[{"speaker_1": "hi", "speaker_2": "hello"}]',
+        }
+        with mock.patch.object(
+            llm, "_generate_provider_response", side_effect=lambda p, *args: answers[p]
+        ) as generate:
+            llm._generate_podcast_turns("cache prompt")
+            self.assertIsNone(llm.llm_cache.cache.get(llm._get_cache_key("cache prompt", "openai")))
+            self.assertIsNotNone(llm.llm_cache.cache.get(llm._get_cache_key("cache prompt", "deepseek")))
+            # found again along the provider chain
+            self.assertEqual(llm._generate_podcast_turns("cache prompt")[0].speaker_1, "hi")
+            self.assertEqual(generate.call_count, 2)
+
+    def test_nothing_is_cached_without_use_cache(self):
+        with mock.patch.object(
+            llm, "_generate_provider_response", return_value='["solar power", "wind"]'
+        ), mock.patch.object(llm.llm_cache.cache, "set") as cache_set:
+            llm.generate_terms("energy", "script", amount=2, use_cache=False)
+            llm.generate_terms_from_podcast([_turn("solar", "wind")], amount=2, use_cache=False)
+            llm._stitch_podcast_sections(
+                [[_turn("hi", "hello")], [_turn("so", "yes")]], "en", use_cache=False
+            )
+        cache_set.assert_not_called()
+
+    def test_async_timeout_returns_an_error(self):
+        self.config.update({"llm_provider": "qwen", "llm_fallback_providers": []})
+
+        def generate(*args):
+            time.sleep(1)
+            return "late"
+
+        async def timed():
+            start = time.monotonic()
+            content = await llm._agenerate_response("prompt", timeout=0.1)
+            return content, time.monotonic() - start
+
+        with mock.patch.object(llm, "_generate_provider_response", side_effect=generate):
+            # asyncio.run() itself still joins the abandoned worker thread
+            content, elapsed = asyncio.run(timed())
+        self.assertTrue(content.startswith("Error: [qwen] no response within 0.1 seconds"))
+        self.assertLess(elapsed, 0.5)
+
+    def test_async_cancel_aborts_the_request(self):
+        self.config["llm_fallback_providers"] = []
+        started, aborted = asyncio.Event(), []
+
+        class Completions:
+            async def create(self, **kwargs):
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    aborted.append(True)
+                    raise
+
+        client = mock.Mock()
+        client.chat.completions = Completions()
+
+        async def cancel():
+            task = asyncio.create_task(llm._agenerate_response("prompt"))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        provider_config = {"api_key": "sk", "base_url": "url", "model_name": "m", "api_version": ""}
+        with mock.patch.object(llm, "_get_provider_config", return_value=provider_config), \
+                mock.patch.object(llm, "_get_async_openai_client", return_value=client):
+            asyncio.run(cancel())
+        # cancelled on the loop of the client, not left running there
+        time.sleep(0.1)
+        self.assertEqual(aborted, [True])
+
+
+class TestPodcastStream(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(llm.llm_cache.cache, "set")
+        self.cache_set = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, *chunks, error=None):
+        async def generate(prompt, json_mode=False):
+            llm._answered_by.set("openai")
+            for chunk in chunks:
+                yield chunk
+            if error:
+                raise error
+
+        return mock.patch.object(llm, "_agenerate_response_stream", side_effect=generate)
+
+    def render(self, use_cache=False):
+        """Run the streamed script through generate_podcast_audio_stream, TTS mocked."""
+        generator = podcast_audio.PodcastAudioGenerator()
+        with mock.patch.object(
+            generator, "_generate_dialogue_audio", side_effect=lambda i, *args: f"turn{i}.mp3"
+        ), mock.patch.object(
+            generator, "_finalize_audio", return_value=("audio.mp3", 10.0)
+        ) as finalize, mock.patch.object(generator, "_cleanup_temp_files"):
+            try:
+                return asyncio.run(
+                    generator.generate_podcast_audio_stream(
+                        llm.astream_podcast_script("article", "en", use_cache=use_cache), "audio.mp3"
+                    )
+                )
+            finally:
+                self.finalized = finalize.called
+
+    def test_complete_stream(self):
+        with self.stream('[{"speaker_1": "hi", "speaker_2": "hello"},', ' {"speaker_1": "so", "speaker_2": "bye"}]'):
+            _, _, script = self.render(use_cache=True)
+        self.assertEqual([t.speaker_1 for t in script], ["hi", "so"])
+        self.cache_set.assert_called_once()
+
+    def test_error_after_the_first_turn_fails_the_render(self):
+        with self.stream('[{"speaker_1": "hi", "speaker_2": "hello"},', error=ConnectionError("reset")):
+            with self.assertRaises(ConnectionError):
+                self.render()
+        self.assertFalse(self.finalized)
+        self.cache_set.assert_not_called()
+
+    def test_truncated_stream_fails_the_render(self):
+        with self.stream('[{"speaker_1": "hi", "speaker_2": "hello"}, {"speaker_1": "so"'):
+            with self.assertRaisesRegex(ValueError, "cut off"):
+                self.render()
+        self.assertFalse(self.finalized)
+        self.cache_set.assert_not_called()
+
+    def test_error_before_the_first_turn_is_retried(self):
+        calls = []
+
+        async def generate(prompt, json_mode=False):
+            calls.append(json_mode)
+            if len(calls) == 1:
+                raise ConnectionError("refused")
+            yield '[{"speaker_1": "hi", "speaker_2": "hello"}]'
+
+        with mock.patch.object(llm, "_agenerate_response_stream", side_effect=generate):
+            _, _, script = self.render()
+        self.assertEqual(len(script), 1)
+        self.assertEqual(calls, [True, True])
+
+    def test_stream_fails_over_before_the_first_chunk(self):
+        llm.llm_health.health.reset()
+        self.addCleanup(llm.llm_health.health.reset)
+        config = {"llm_provider": "qwen", "llm_fallback_providers": ["gemini"]}
+        answers = {"qwen": "Error: rate limited", "gemini": '{"items": []}'}
+
+        async def collect():
+            return [chunk async for chunk in llm._agenerate_response_stream("prompt", json_mode=True)]
+
+        with mock.patch.object(llm.config, "app", config), mock.patch.object(
+            llm, "_generate_provider_response", side_effect=lambda p, *args: answers[p]
+        ) as generate:
+            self.assertEqual(asyncio.run(collect()), ['{"items": []}'])
+        self.assertEqual([c[0][0] for c in generate.call_args_list], ["qwen", "gemini"])
+        self.assertTrue(all(c[0][3] for c in generate.call_args_list))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import sys
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.llm_cache import LLMCache, make_key
+
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = LLMCache(cache_dir=self.cache_dir, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_key_ignores_whitespace_but_not_model(self):
+        key = make_key("openai", "gpt-4o-mini", "  generate\n  5 terms ")
+        self.assertEqual(key, make_key("openai", "gpt-4o-mini", "generate 5 terms"))
+        self.assertNotEqual(key, make_key("openai", "gpt-4o", "generate 5 terms"))
+        self.assertNotEqual(key, make_key("deepseek", "gpt-4o-mini", "generate 5 terms"))
+
+    def test_set_and_get(self):
+        key = make_key("openai", "gpt-4o-mini", "prompt")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, ["solar power", "wind"])
+        self.assertEqual(self.cache.get(key), ["solar power", "wind"])
+
+    def test_expired_entry_is_dropped(self):
+        key = make_key("openai", "gpt-4o-mini", "prompt")
+        self.cache.set(key, "script")
+        entry_file = self.cache._path(key)
+        with open(entry_file, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time() - 120, "value": "script"}, f)
+
+        self.assertIsNone(self.cache.get(key))
+        self.assertFalse(os.path.exists(entry_file))
+
+    def test_disabled_cache(self):
+        cache = LLMCache(cache_dir=self.cache_dir, enabled=False)
+        key = make_key("openai", "gpt-4o-mini", "prompt")
+        cache.set(key, "script")
+        self.assertIsNone(cache.get(key))
+
+
+if __name__ == "__main__":
+    unittest.main()
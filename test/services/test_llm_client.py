@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import unittest
+import sys
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.llm_client import LLMClientRegistry
+
+
+class TestLLMClientRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = LLMClientRegistry()
+
+    def test_client_is_built_once_per_key(self):
+        created = []
+
+        def factory():
+            created.append(object())
+            return created[-1]
+
+        key = ("openai", "https://api.openai.com/v1", "sk-1")
+        threads = [
+            threading.Thread(target=self.registry.get_client, args=(key, factory))
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(created), 1)
+        self.assertIs(self.registry.get_client(key, factory), created[0])
+        other = self.registry.get_client(("openai", "https://api.openai.com/v1", "sk-2"), factory)
+        self.assertIsNot(other, created[0])
+
+    def test_token_is_cached_until_expiry(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return f"token-{len(calls)}", 3600
+
+        self.assertEqual(self.registry.get_token(("ernie", "k"), fetch), "token-1")
+        self.assertEqual(self.registry.get_token(("ernie", "k"), fetch), "token-1")
+        self.assertEqual(len(calls), 1)
+
+        self.registry.invalidate_token(("ernie", "k"))
+        self.assertEqual(self.registry.get_token(("ernie", "k"), fetch), "token-2")
+
+    def test_short_lived_token_is_refreshed(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return f"token-{len(calls)}", 10  # shorter than the refresh margin
+
+        self.registry.get_token(("ernie", "k"), fetch)
+        self.registry.get_token(("ernie", "k"), fetch)
+        self.assertEqual(len(calls), 2)
+
+
+class _AsyncClient:
+    def __init__(self):
+        self.loops = []
+        self.closed = False
+
+    async def get(self):
+        self.loops.append(asyncio.get_running_loop())
+        return len(self.loops)
+
+    async def chunks(self):
+        for i in range(3):
+            self.loops.append(asyncio.get_running_loop())
+            yield i
+
+    async def aclose(self):
+        self.closed = True
+
+
+class TestAsyncClients(unittest.TestCase):
+    def setUp(self):
+        self.registry = LLMClientRegistry()
+        self.addCleanup(self.registry.clear)
+
+    def test_async_client_is_shared_by_short_lived_loops(self):
+        created = []
+
+        def factory():
+            created.append(_AsyncClient())
+            return created[-1]
+
+        async def call():
+            client = self.registry.get_async_client(("openai", "url", "sk"), factory)
+            return await self.registry.run(client.get())
+
+        # e.g. two tasks, each with its own asyncio.run()
+        self.assertEqual(asyncio.run(call()), 1)
+        self.assertEqual(asyncio.run(call()), 2)
+        self.assertEqual(len(created), 1)
+        self.assertEqual(created[0].loops, [self.registry.loop()] * 2)
+
+    def test_iterate_on_the_client_loop(self):
+        client = self.registry.get_async_client("k", _AsyncClient)
+
+        async def collect():
+            return [item async for item in self.registry.iterate(client.chunks)]
+
+        self.assertEqual(asyncio.run(collect()), [0, 1, 2])
+        self.assertEqual(set(client.loops), {self.registry.loop()})
+
+    def test_clear_closes_async_clients(self):
+        client = self.registry.get_async_client("k", _AsyncClient)
+        asyncio.run(self.registry.run(client.get()))
+        loop = self.registry.loop()
+        self.registry.clear()
+        self.assertTrue(client.closed)
+        self.assertIsNot(self.registry.loop(), loop)
+        self.assertIsNot(self.registry.get_async_client("k", _AsyncClient), client)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.llm_health import HealthTracker
+
+
+class TestHealthTracker(unittest.TestCase):
+    def test_circuit_opens_and_recovers_after_cooldown(self):
+        tracker = HealthTracker(failure_threshold=2, cooldown=30)
+        with mock.patch("app.services.llm_health.time.monotonic", return_value=100):
+            tracker.record_failure("openai")
+            self.assertTrue(tracker.available("openai"))
+            tracker.record_failure("openai")
+            self.assertFalse(tracker.available("openai"))
+            self.assertEqual(tracker.order(["openai", "deepseek"]), ["deepseek", "openai"])
+
+        with mock.patch("app.services.llm_health.time.monotonic", return_value=131):
+            self.assertTrue(tracker.available("openai"))
+
+        tracker.record_success("openai", 1.0)
+        self.assertEqual(tracker.order(["openai", "deepseek"]), ["openai", "deepseek"])
+
+    def test_p95_needs_enough_samples(self):
+        tracker = HealthTracker(window=100, min_samples=10)
+        for i in range(9):
+            tracker.record_success("openai", i + 1)
+        self.assertIsNone(tracker.p95("openai"))
+
+        for i in range(9, 100):
+            tracker.record_success("openai", i + 1)
+        self.assertEqual(tracker.p95("openai"), 95)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import sys
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.llm_json import JsonArrayStreamParser, extract_json
+
+
+class TestJsonArrayStreamParser(unittest.TestCase):
+    def test_items_are_emitted_as_soon_as_complete(self):
+        text = '```json\n[\n  {"speaker_1": "Hi, {A} here", "speaker_2": "Hello \\"B\\""},\n  {"speaker_1": "x]", "speaker_2": "y"}\n]\n```'
+        parser = JsonArrayStreamParser()
+        emitted = []
+        for i in range(0, len(text), 7):
+            items = parser.feed(text[i : i + 7])
+            emitted.append(len(items))
+            for item in items:
+                self.assertIn("speaker_1", item)
+
+        self.assertEqual(sum(emitted), 2)
+        # the first turn is available before the end of the stream
+        first = next(i for i, n in enumerate(emitted) if n)
+        self.assertLess(first, len(emitted) - 3)
+        self.assertTrue(parser.finished)
+
+    def test_raw_newlines_inside_strings(self):
+        parser = JsonArrayStreamParser()
+        items = parser.feed('[{"speaker_1": "line one\nline two", "speaker_2": "ok"}]')
+        self.assertEqual(items[0]["speaker_1"], "line one\nline two")
+
+    def test_incomplete_stream(self):
+        parser = JsonArrayStreamParser()
+        items = parser.feed('[{"speaker_1": "a", "speaker_2": "b"}, {"speaker_1": "c", "spea')
+        self.assertEqual(len(items), 1)
+        self.assertFalse(parser.finished)
+
+
+class TestExtractJson(unittest.TestCase):
+    def test_code_fence_and_prose(self):
+        text = 'Sure, here you go:\n```json\n["solar power", "wind"]\n```\nHope it helps!'
+        self.assertEqual(extract_json(text), ["solar power", "wind"])
+
+    def test_trailing_comma(self):
+        self.assertEqual(extract_json('["a", "b",]'), ["a", "b"])
+        self.assertEqual(extract_json('{"x": 1,}', expect=dict), {"x": 1})
+
+    def test_json_mode_object_is_unwrapped(self):
+        self.assertEqual(extract_json('{"items": ["a", "b"]}'), ["a", "b"])
+
+    def test_truncated_array_keeps_complete_items(self):
+        text = '```json\n[{"speaker_1": "a", "speaker_2": "b"}, {"speaker_1": "c", "spea'
+        self.assertEqual(extract_json(text), [{"speaker_1": "a", "speaker_2": "b"}])
+
+    def test_nothing_usable(self):
+        with self.assertRaises(ValueError):
+            extract_json("I cannot help with that.")
+        with self.assertRaises(ValueError):
+            extract_json('{"a": 1, "b": 2}')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import threading
+import unittest
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import MaterialInfo
+from app.services import material
+
+
+class TestMaterialSharing(unittest.TestCase):
+    def setUp(self):
+        material._search_cache.clear()
+        self.addCleanup(material._search_cache.clear)
+
+    def test_concurrent_searches_share_one_request(self):
+        calls = []
+        release = threading.Event()
+
+        def search_videos_pexels(search_term, minimum_duration, video_aspect):
+            calls.append(search_term)
+            release.wait(5)
+            return [MaterialInfo(provider="pexels", url=f"https://v/{search_term}", duration=6)]
+
+        def search(term):
+            return material.search_videos_cached(search_videos_pexels, term, 5)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(search, term) for term in ("Sea", "sea ", "sea", "sky")]
+            threading.Event().wait(0.1)
+            release.set()
+            results = [f.result() for f in futures]
+
+        self.assertEqual(sorted(calls), ["Sea", "sky"])
+        self.assertEqual(results[0][0].url, results[2][0].url)
+        # remembered for the next task
+        search("sea")
+        self.assertEqual(len(calls), 2)
+
+    def test_callers_get_their_own_items(self):
+        item = MaterialInfo(provider="pexels", url="https://v/sea", duration=6)
+        search_videos = mock.Mock(return_value=[item], __name__="search_videos_pexels")
+        first = material.search_videos_cached(search_videos, "sea", 5)
+        first[0].url = "/tmp/sea.mp4"
+        second = material.search_videos_cached(search_videos, "sea", 5)
+        self.assertEqual(search_videos.call_count, 1)
+        self.assertEqual(second[0].url, "https://v/sea")
+
+    def test_failed_searches_are_not_remembered(self):
+        search_videos = mock.Mock(return_value=[], __name__="search_videos_pixabay")
+        material.search_videos_cached(search_videos, "sea", 5)
+        material.search_videos_cached(search_videos, "sea", 5)
+        self.assertEqual(search_videos.call_count, 2)
+
+    def test_concurrent_downloads_of_a_video_share_one_request(self):
+        calls = []
+
+        def fake_get(url, **kwargs):
+            calls.append(url)
+            threading.Event().wait(0.1)
+            return mock.Mock(content=b"video")
+
+        clip = mock.Mock(duration=5, fps=25)
+        with tempfile.TemporaryDirectory() as save_dir, mock.patch.object(
+            material.requests, "get", side_effect=fake_get
+        ), mock.patch.object(material, "VideoFileClip", return_value=clip):
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                paths = list(
+                    executor.map(
+                        lambda _: material.save_video("https://v/1.mp4?token=a", save_dir),
+                        range(3),
+                    )
+                )
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(len(set(paths)), 1)
+            # only the finished video is left in the cache directory
+            self.assertEqual(os.listdir(save_dir), [os.path.basename(paths[0])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import contextlib
+import threading
+import time
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import PodcastScript, VideoParams
+from app.services import pipeline
+from app.services import task as tm
+
+
+def _stage(name, inputs=(), delay=0.0, log=None, outputs=True):
+    def run(context):
+        if log is not None:
+            log.append(("start", name, time.monotonic()))
+        time.sleep(delay)
+        if log is not None:
+            log.append(("end", name, time.monotonic()))
+        return {name: True} if outputs else None
+
+    return pipeline.Stage(name, run, inputs)
+
+
+class TestRunStages(unittest.TestCase):
+    def test_independent_stages_overlap(self):
+        log = []
+        stages = [
+            _stage("script"),
+            _stage("audio", ["script"], delay=0.2, log=log),
+            _stage("materials", ["script"], delay=0.2, log=log),
+            _stage("render", ["audio", "materials"], log=log),
+        ]
+        context = {}
+        start = time.monotonic()
+        self.assertTrue(pipeline.run_stages(stages, "render", context))
+
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual(set(context), {"script", "audio", "materials", "render"})
+        # render starts only after both of its inputs are done
+        render_start = next(t for event, name, t in log if event == "start" and name == "render")
+        ends = [t for event, name, t in log if event == "end" and name != "render"]
+        self.assertGreaterEqual(render_start, max(ends))
+
+    def test_only_required_stages_run(self):
+        stages = [_stage("script"), _stage("audio", ["script"]), _stage("render", ["audio"])]
+        context = {}
+        self.assertTrue(pipeline.run_stages(stages, "audio", context))
+        self.assertEqual(set(context), {"script", "audio"})
+
+    def test_failed_stage_skips_dependents(self):
+        ran = threading.Event()
+
+        def render(context):
+            ran.set()
+            return {}
+
+        stages = [
+            _stage("script"),
+            _stage("audio", ["script"], outputs=False),
+            pipeline.Stage("render", render, ["audio"]),
+        ]
+        self.assertFalse(pipeline.run_stages(stages, "render", {}))
+        self.assertFalse(ran.is_set())
+
+
+class TestBuildStages(unittest.TestCase):
+    def test_stopping_at_materials_sizes_them_by_the_audio(self):
+        stubs = {
+            "_script_stage": {"video_script": "sea " * 50},
+            "_terms_stage": {"video_terms": ["sea"]},
+            "_audio_stage": {"audio_result": ("audio.mp3", 42, None)},
+            "_subtitle_stage": {"subtitle_path": "subtitle.srt"},
+        }
+        with contextlib.ExitStack() as stack:
+            for name, outputs in stubs.items():
+                stack.enter_context(
+                    mock.patch.object(tm, name, lambda *args, outputs=outputs: outputs)
+                )
+            get_video_materials = stack.enter_context(
+                mock.patch.object(tm, "get_video_materials", return_value=["a.mp4"])
+            )
+            stages = tm.build_stages("t1", VideoParams(video_subject="test"), "materials")
+            context = {}
+            self.assertTrue(pipeline.run_stages(stages, "materials", context))
+
+        self.assertEqual(get_video_materials.call_args.args[3], 42)
+        self.assertIn("subtitle_path", context)
+
+    def test_materials_do_not_wait_for_the_audio_of_a_video(self):
+        stages = {stage.name: stage for stage in tm.build_stages("t1", VideoParams(), "video")}
+        self.assertEqual(stages["materials"].inputs, ["terms"])
+
+
+class TestEstimateAudioDuration(unittest.TestCase):
+    def test_estimate(self):
+        params = VideoParams(video_subject="test", voice_rate=1.0)
+        chinese = tm.estimate_audio_duration("金钱" * 45, params)
+        self.assertAlmostEqual(chinese, 24, delta=1)
+
+        podcast = [
+            PodcastScript(
+                speaker_1="hello " * 10,
+                speaker_2="world " * 10,
+                speaker_1_voice="v1",
+                speaker_2_voice="v2",
+            )
+        ]
+        self.assertAlmostEqual(tm.estimate_audio_duration(podcast, params), 10, delta=1)
+
+        params.voice_rate = 2.0
+        self.assertLess(tm.estimate_audio_duration("金钱" * 45, params), chinese)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,342 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+import sys
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from app.models import const
+from app.models.schema import PodcastScript
+from app.services.state import MemoryState, RedisState, SqliteState
+
+
+class TestMemoryState(unittest.TestCase):
+    def test_update_task_merges_fields(self):
+        state = MemoryState()
+        state.update_task("t1", const.TASK_STATE_PROCESSING, 10, script="hello")
+        state.update_task("t1", progress=50)
+        task = state.get_task("t1")
+        self.assertEqual(task["script"], "hello")
+        self.assertEqual(task["progress"], 50)
+
+        # callers get a copy, not the stored task
+        task["script"] = "changed"
+        self.assertEqual(state.get_task("t1")["script"], "hello")
+
+    def test_get_all_tasks_pages_newest_first(self):
+        state = MemoryState()
+        for i in range(5):
+            state.update_task(f"t{i}", const.TASK_STATE_PROCESSING, 0)
+        # updates keep the creation order
+        state.update_task("t0", const.TASK_STATE_COMPLETE, 100)
+
+        tasks, total = state.get_all_tasks(1, 2)
+        self.assertEqual(total, 5)
+        self.assertEqual([t["task_id"] for t in tasks], ["t4", "t3"])
+        tasks, _ = state.get_all_tasks(3, 2)
+        self.assertEqual([t["task_id"] for t in tasks], ["t0"])
+        self.assertEqual(state.get_all_tasks(4, 2), ([], 5))
+
+    def test_max_tasks_evicts_oldest_finished_tasks(self):
+        state = MemoryState(max_tasks=3)
+        state.update_task("running", const.TASK_STATE_PROCESSING, 0)
+        state.update_task("done-1", const.TASK_STATE_PROCESSING, 0)
+        state.update_task("done-2", const.TASK_STATE_PROCESSING, 0)
+        state.update_task("done-2", const.TASK_STATE_COMPLETE, 100)
+        state.update_task("done-1", const.TASK_STATE_FAILED)
+
+        state.update_task("new", const.TASK_STATE_PROCESSING, 0)
+        # done-2 finished first
+        self.assertIsNone(state.get_task("done-2"))
+        self.assertIsNotNone(state.get_task("done-1"))
+
+        # running tasks are kept even beyond max_tasks
+        state.update_task("new-2", const.TASK_STATE_PROCESSING, 0)
+        state.update_task("new-3", const.TASK_STATE_PROCESSING, 0)
+        _, total = state.get_all_tasks(1, 10)
+        self.assertEqual(total, 4)
+        self.assertIsNotNone(state.get_task("running"))
+
+    def test_claim_key(self):
+        state = MemoryState()
+        self.assertIsNone(state.claim_key("k", "a", 60))
+        self.assertEqual(state.claim_key("k", "b", 60), "a")
+        state.release_key("k", "b")
+        self.assertEqual(state.claim_key("k", "b", 60), "a")
+        state.release_key("k", "a")
+        self.assertIsNone(state.claim_key("k", "b", 0.05))
+        time.sleep(0.1)
+        self.assertIsNone(state.claim_key("k", "c", 60))
+
+    def test_durations(self):
+        state = MemoryState()
+        for i in range(55):
+            state.add_duration("render", i)
+        state.add_duration("audio", 1.5)
+        self.assertEqual(state.get_durations(), {"render": list(range(5, 55)), "audio": [1.5]})
+
+    def test_retention_expires_finished_tasks(self):
+        state = MemoryState(retention=0.05)
+        state.update_task("running", const.TASK_STATE_PROCESSING, 0)
+        state.update_task("done", const.TASK_STATE_COMPLETE, 100)
+        time.sleep(0.1)
+        self.assertIsNone(state.get_task("done"))
+        self.assertIsNotNone(state.get_task("running"))
+        self.assertEqual(state.get_all_tasks(1, 10)[1], 1)
+
+
+class TestSqliteState(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "tasks.db")
+        self.state = SqliteState(self.path, flush_interval=60)
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp.cleanup()
+
+    def test_update_task_merges_fields_and_survives_restart(self):
+        self.state.update_task("t1", const.TASK_STATE_PROCESSING, 0, script="hello")
+        self.state.update_task(
+            "t1", const.TASK_STATE_COMPLETE, 100, videos=["a.mp4"], script="1234"
+        )
+        self.state.close()
+
+        self.state = SqliteState(self.path)
+        self.assertEqual(
+            self.state.get_task("t1"),
+            {
+                "task_id": "t1",
+                "state": const.TASK_STATE_COMPLETE,
+                "progress": 100,
+                "script": "1234",
+                "videos": ["a.mp4"],
+            },
+        )
+        self.assertIsNone(self.state.get_task("missing"))
+
+    def test_progress_ticks_are_batched(self):
+        self.state.update_task("t1", const.TASK_STATE_PROCESSING, 0, script="hello")
+        self.state.update_task("t1", progress=30)
+        self.state.update_task("t1", progress=40)
+
+        # buffered, but visible to readers
+        row = self.state._conn.execute("SELECT progress FROM tasks WHERE task_id = 't1'").fetchone()
+        self.assertEqual(row[0], 0)
+        self.assertEqual(self.state.get_task("t1")["progress"], 40)
+        self.assertEqual(self.state.get_task("t1")["script"], "hello")
+
+        # a full update supersedes the buffered tick
+        self.state.update_task("t1", const.TASK_STATE_COMPLETE, 100)
+        self.state.close()
+        self.state = SqliteState(self.path)
+        self.assertEqual(self.state.get_task("t1")["progress"], 100)
+
+    def test_get_all_tasks_pages_newest_first(self):
+        for i in range(5):
+            self.state.update_task(f"t{i}", const.TASK_STATE_PROCESSING, 0)
+        self.state.update_task("t0", progress=50)
+
+        tasks, total = self.state.get_all_tasks(1, 2)
+        self.assertEqual(total, 5)
+        self.assertEqual([t["task_id"] for t in tasks], ["t4", "t3"])
+        tasks, _ = self.state.get_all_tasks(3, 2)
+        self.assertEqual(tasks[0]["progress"], 50)
+
+        self.state.delete_task("t4")
+        self.assertEqual(self.state.get_all_tasks(1, 10)[1], 4)
+
+    def test_claim_key(self):
+        self.assertIsNone(self.state.claim_key("k", "a", 60))
+        self.assertEqual(self.state.claim_key("k", "b", 60), "a")
+        self.state.release_key("k", "b")
+        self.assertEqual(self.state.claim_key("k", "b", 60), "a")
+        self.state.release_key("k", "a")
+        self.assertIsNone(self.state.claim_key("k", "b", -1))
+        self.assertIsNone(self.state.claim_key("k", "c", 60))
+
+    def test_failed_claim_is_rolled_back(self):
+        self.assertIsNone(self.state.claim_key("expired", "a", -1))
+        conn = self.state._conn
+
+        class FailingInsert:
+            def execute(self, sql, *args):
+                if sql.startswith("INSERT INTO claimed_keys"):
+                    raise sqlite3.OperationalError("disk I/O error")
+                return conn.execute(sql, *args)
+
+        self.state._conn = FailingInsert()
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                self.state.claim_key("k", "a", 60)
+        finally:
+            self.state._conn = conn
+        self.assertFalse(conn.in_transaction)
+        # the purge of the expired key was not committed without the claim
+        count = conn.execute("SELECT COUNT(*) FROM claimed_keys").fetchone()[0]
+        self.assertEqual(count, 1)
+        self.assertIsNone(self.state.claim_key("k", "b", 60))
+
+    def test_durations(self):
+        for i in range(55):
+            self.state.add_duration("render", i)
+        self.state.add_duration("audio", 1.5)
+        self.assertEqual(
+            self.state.get_durations(), {"render": list(range(5, 55)), "audio": [1.5]}
+        )
+
+    def test_retention_purges_finished_tasks(self):
+        self.state.retention = 1
+        self.state.update_task("done", const.TASK_STATE_COMPLETE, 100)
+        self.state.update_task("running", const.TASK_STATE_PROCESSING, 0)
+        self.state._conn.execute("UPDATE tasks SET updated_at = updated_at - 10")
+        self.state._last_purge = 0
+        self.state.update_task("new", const.TASK_STATE_PROCESSING, 0)
+        self.assertIsNone(self.state.get_task("done"))
+        self.assertIsNotNone(self.state.get_task("running"))
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisState(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.state = RedisState(redis_client=self.redis)
+
+    def count_round_trips(self):
+        calls = []
+        execute_command = self.redis.execute_command
+        pipeline = self.redis.pipeline
+
+        def counting(*args, **kwargs):
+            calls.append(args[0])
+            return execute_command(*args, **kwargs)
+
+        def counting_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            pipe_execute = pipe.execute
+
+            def execute(*a, **kw):
+                calls.append("PIPELINE")
+                return pipe_execute(*a, **kw)
+
+            pipe.execute = execute
+            return pipe
+
+        self.redis.execute_command = counting
+        self.redis.pipeline = counting_pipeline
+        return calls
+
+    def test_update_task_is_one_round_trip(self):
+        calls = self.count_round_trips()
+        self.state.update_task(
+            "t1", const.TASK_STATE_COMPLETE, 100, videos=["a.mp4"], script="a, b"
+        )
+        self.assertEqual(calls, ["PIPELINE"])
+        self.assertTrue(self.redis.exists("task:t1"))
+        self.assertIsNotNone(self.redis.zscore("task_index", "t1"))
+
+    def test_round_trip_keeps_types(self):
+        turn = PodcastScript(
+            speaker_1="hi", speaker_2="hello", speaker_1_voice="v1", speaker_2_voice="v2"
+        )
+        self.state.update_task(
+            "t1",
+            const.TASK_STATE_COMPLETE,
+            100,
+            videos=["a.mp4", "b.mp4"],
+            script="1234",
+            terms=["sea", "sky"],
+            podcast_script=[turn],
+            audio_duration=12.5,
+        )
+        task = self.state.get_task("t1")
+        self.assertEqual(task["state"], const.TASK_STATE_COMPLETE)
+        self.assertEqual(task["progress"], 100)
+        self.assertEqual(task["videos"], ["a.mp4", "b.mp4"])
+        # digit strings used to come back as int
+        self.assertEqual(task["script"], "1234")
+        self.assertEqual(task["audio_duration"], 12.5)
+        self.assertEqual(task["podcast_script"][0]["speaker_1_voice"], "v1")
+        self.assertNotIn("_schema", task)
+
+    def test_legacy_tasks_are_migrated_once(self):
+        # written by the former str() encoding, one field at a time, under the bare id
+        self.redis.hset(
+            "old", mapping={"task_id": "old", "state": "1", "videos": str(["a.mp4"])}
+        )
+        self.redis.hset("settings", mapping={"theme": "dark"})
+        self.state.migrate()
+        self.assertFalse(self.redis.exists("old"))
+        self.assertTrue(self.redis.exists("settings"))
+        self.assertEqual(
+            self.state.get_task("old"), {"task_id": "old", "state": 1, "videos": ["a.mp4"]}
+        )
+        self.assertEqual([t["task_id"] for t in self.state.get_all_tasks(1, 10)[0]], ["old"])
+
+        self.redis.hset("later", mapping={"task_id": "later", "state": "1"})
+        self.state.migrate()
+        self.assertTrue(self.redis.exists("later"))
+
+    def test_unknown_task_is_one_round_trip(self):
+        self.state.update_task("t1", const.TASK_STATE_COMPLETE, 100)
+        calls = self.count_round_trips()
+        self.assertIsNone(self.state.get_task("missing"))
+        self.assertEqual(calls, ["HGETALL"])
+        # keys that are not tasks are not found, whatever their type
+        for task_id in ("task_index", "duration_names"):
+            self.assertIsNone(self.state.get_task(task_id))
+
+    def test_claim_key(self):
+        self.assertIsNone(self.state.claim_key("k", "a", 60))
+        self.assertEqual(self.state.claim_key("k", "b", 60), "a")
+        self.state.release_key("k", "b")
+        self.assertEqual(self.state.claim_key("k", "b", 60), "a")
+        self.state.release_key("k", "a")
+        self.assertIsNone(self.state.claim_key("k", "b", 60))
+        self.assertIsNotNone(self.redis.pttl("claim:k"))
+
+    def test_durations(self):
+        for i in range(55):
+            self.state.add_duration("render", i)
+        self.state.add_duration("audio", 1.5)
+        self.assertEqual(
+            self.state.get_durations(), {"render": list(range(5, 55)), "audio": [1.5]}
+        )
+
+    def test_get_all_tasks(self):
+        # keys that are not tasks must not be listed nor counted
+        self.redis.set("unrelated", "1")
+        self.redis.lpush("task_queue", "{}")
+        for i in range(5):
+            self.state.update_task(f"t{i}", const.TASK_STATE_PROCESSING, i * 10)
+            # the creation time, updates must not move a task in the index
+            self.redis.zadd("task_index", {f"t{i}": i}, xx=True)
+        self.state.update_task("t0", const.TASK_STATE_COMPLETE, 100)
+
+        calls = self.count_round_trips()
+        tasks, total = self.state.get_all_tasks(1, 2)
+        self.assertEqual(total, 5)
+        self.assertEqual([t["task_id"] for t in tasks], ["t4", "t3"])
+        self.assertEqual(calls, ["PIPELINE", "PIPELINE"])
+
+        tasks, total = self.state.get_all_tasks(3, 2)
+        self.assertEqual([t["task_id"] for t in tasks], ["t0"])
+        self.assertEqual(tasks[0]["progress"], 100)
+
+        self.state.delete_task("t4")
+        tasks, total = self.state.get_all_tasks(1, 2)
+        self.assertEqual(total, 4)
+        self.assertEqual([t["task_id"] for t in tasks], ["t3", "t2"])
+        self.assertEqual(self.state.get_all_tasks(9, 2), ([], 4))
+
+if __name__ == "__main__":
+    unittest.main()
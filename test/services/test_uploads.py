@@ -0,0 +1,113 @@
+import io
+import os
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.exception import UnsupportedMediaError, UploadTooLargeError
+from app.services import media_catalog, uploads
+from app.utils import utils
+
+
+class TestSniff(unittest.TestCase):
+    def test_formats(self):
+        cases = {
+            b"ID3\x04\x00" + b"\x00" * 11: "mp3",
+            b"\xff\xfb\x90\x64" + b"\x00" * 12: "mp3",
+            b"RIFF\x00\x00\x00\x00WAVEfmt ": "wav",
+            b"RIFF\x00\x00\x00\x00AVI LIST": "avi",
+            b"\x00\x00\x00\x20ftypisom\x00\x00\x02\x00": "mp4",
+            b"\x00\x00\x00\x20ftypM4A \x00\x00\x00\x00": "m4a",
+            b"\x00\x00\x00\x14ftypqt  \x00\x00\x00\x00": "mov",
+            b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\x82\x84webm": "webm",
+            b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00": "jpg",
+            b"\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR": "png",
+            b"<html><body>hi</body></html>": None,
+        }
+        for head, expected in cases.items():
+            self.assertEqual(uploads.sniff(head), expected, head)
+
+
+class TestSaveUpload(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.catalog = media_catalog.MediaCatalog(os.path.join(self.directory, "media.db"))
+        patcher = mock.patch.object(media_catalog, "_catalog", self.catalog)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with open(os.path.join(utils.song_dir(), "output000.mp3"), "rb") as f:
+            self.mp3 = f.read()
+
+    def test_audio_is_probed_and_recorded(self):
+        path, entry = uploads.save_upload(
+            io.BytesIO(self.mp3), self.directory, "../song.mp3", ("mp3",), 0, "bgm", loudness=True
+        )
+        self.assertEqual(path, os.path.join(self.directory, "song.mp3"))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.mp3)
+        self.assertEqual(entry["codec"], "mp3")
+        self.assertGreater(entry["duration"], 1)
+        self.assertGreater(entry["sample_rate"], 0)
+        self.assertLess(entry["loudness"], 0)
+        self.assertEqual(self.catalog.get(path), entry)
+        self.assertEqual([e["path"] for e in self.catalog.entries("bgm")], [path])
+
+    def test_video_material(self):
+        from moviepy import ColorClip
+
+        clip_path = os.path.join(self.directory, "source.mp4")
+        ColorClip((32, 32), (0, 0, 255), duration=1).write_videofile(
+            clip_path, fps=10, codec="libx264", logger=None
+        )
+        with open(clip_path, "rb") as f:
+            path, entry = uploads.save_upload(
+                f, self.directory, "clip.mp4", uploads.VIDEO_FORMATS, 0, "material"
+            )
+        self.assertEqual(entry["codec"], "h264")
+        self.assertGreater(entry["width"], 0)
+        self.assertIsNone(entry["loudness"])
+
+    def test_filename_gets_the_detected_extension(self):
+        names = {"song.wav": "song.mp3", "song": "song.mp3", "Song.MP3": "Song.MP3"}
+        for filename, expected in names.items():
+            path, _ = uploads.save_upload(
+                io.BytesIO(self.mp3), self.directory, filename, ("mp3",), 0, "bgm"
+            )
+            self.assertEqual(path, os.path.join(self.directory, expected))
+
+    def test_invalid_filenames_are_rejected(self):
+        for filename in ["", ".", "..", "songs/", "..\\"]:
+            with self.assertRaises(UnsupportedMediaError, msg=filename):
+                uploads.save_upload(
+                    io.BytesIO(self.mp3), self.directory, filename, ("mp3",), 0, "bgm"
+                )
+
+    def test_rejected_uploads_are_not_stored(self):
+        with self.assertRaises(UploadTooLargeError):
+            uploads.save_upload(
+                io.BytesIO(self.mp3), self.directory, "song.mp3", ("mp3",), 1024, "bgm"
+            )
+        with self.assertRaises(UnsupportedMediaError):
+            uploads.save_upload(
+                io.BytesIO(b"<html>" * 100), self.directory, "song.mp3", ("mp3",), 0, "bgm"
+            )
+        # looks like an mp3, but ffmpeg cannot decode it
+        with self.assertRaises(UnsupportedMediaError):
+            uploads.save_upload(
+                io.BytesIO(b"ID3" + b"\x00" * 100), self.directory, "song.mp3", ("mp3",), 0, "bgm",
+                loudness=True,
+            )
+        self.assertEqual(
+            [f for f in os.listdir(self.directory) if not f.startswith("media.db")], []
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,230 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from app.models import const
+from app.services import state as sm
+from app.services import webhooks
+
+_public = [(2, 1, 6, "", ("93.184.216.34", 80))]
+
+
+def resolve(addresses):
+    """A getaddrinfo that resolves every host to addresses."""
+    return mock.Mock(
+        return_value=[(2, 1, 6, "", (address, 80)) for address in addresses]
+    )
+
+
+class OutboxTests:
+    def create_outbox(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.outbox = self.create_outbox()
+
+    def test_claimed_deliveries_are_leased(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {"event": "task.completed"}})
+        self.outbox.add("d1", {"url": "http://example.com/other", "payload": {}})
+
+        claimed = self.outbox.claim(10, lease=60)
+        self.assertEqual(len(claimed), 1)
+        delivery_id, delivery, attempts = claimed[0]
+        self.assertEqual(delivery_id, "d1")
+        self.assertEqual(delivery["url"], "http://example.com/hook")
+        self.assertEqual(attempts, 0)
+        self.assertEqual(self.outbox.claim(10, lease=60), [])
+
+    def test_retry_and_complete(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {}})
+        self.outbox.claim(10, lease=60)
+        self.outbox.retry("d1", 1, delay=0, error="status 500")
+        [(_, _, attempts)] = self.outbox.claim(10, lease=60)
+        self.assertEqual(attempts, 1)
+
+        self.outbox.complete("d1")
+        self.outbox.retry("d1", 2, delay=0, error="status 500")
+        self.assertEqual(self.outbox.claim(10, lease=0), [])
+
+    def test_dead_deliveries_are_not_claimed(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {}})
+        self.outbox.kill("d1", 10, "status 500")
+        self.assertEqual(self.outbox.claim(10, lease=0), [])
+
+
+class TestSqliteOutbox(OutboxTests, unittest.TestCase):
+    def create_outbox(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return webhooks.SqliteOutbox(os.path.join(directory.name, "tasks.db"))
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisOutbox(OutboxTests, unittest.TestCase):
+    def create_outbox(self):
+        return webhooks.RedisOutbox(fakeredis.FakeRedis())
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.outbox = webhooks.SqliteOutbox(os.path.join(directory.name, "tasks.db"))
+        self.responses = []
+        self.sent = []
+        patcher = mock.patch.object(webhooks.socket, "getaddrinfo", return_value=_public)
+        self.getaddrinfo = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, url, body, headers, timeout):
+        self.sent.append((url, body, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def dispatcher(self, **kwargs):
+        dispatcher = webhooks.Dispatcher(
+            self.outbox, secret="s3cret", retry_base=0, post=self.post, **kwargs
+        )
+        self.addCleanup(dispatcher.shutdown)
+        return dispatcher
+
+    def test_signed_delivery(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {"event": "task.completed"}})
+        self.responses = [204]
+        self.assertEqual(self.dispatcher().run_once(), 1)
+
+        url, body, headers = self.sent[0]
+        self.assertEqual(url, "http://example.com/hook")
+        self.assertEqual(headers["X-Webhook-Id"], "d1")
+        self.assertEqual(headers["X-Webhook-Event"], "task.completed")
+        expected = hmac.new(
+            b"s3cret", f"{headers['X-Webhook-Timestamp']}.{body}".encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+        self.assertEqual(headers["X-Webhook-Signature"], f"sha256={expected}")
+        self.assertEqual(self.outbox.claim(10, lease=0), [])
+
+    def test_failed_deliveries_are_retried_until_max_attempts(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {"event": "task.failed"}})
+        self.responses = [ConnectionError("refused"), 503, 500]
+        dispatcher = self.dispatcher(max_attempts=3)
+        for _ in range(3):
+            self.assertEqual(dispatcher.run_once(), 1)
+        self.assertEqual(dispatcher.run_once(), 0)
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual({headers["X-Webhook-Id"] for _, _, headers in self.sent}, {"d1"})
+
+    def test_client_errors_are_not_retried(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {"event": "task.failed"}})
+        self.responses = [404]
+        dispatcher = self.dispatcher()
+        dispatcher.run_once()
+        self.assertEqual(dispatcher.run_once(), 0)
+
+    def test_address_is_checked_again_before_sending(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {"event": "task.failed"}})
+        # rebound to the metadata address since the task was created
+        self.getaddrinfo.return_value = [(2, 1, 6, "", ("169.254.169.254", 80))]
+        dispatcher = self.dispatcher()
+        self.assertEqual(dispatcher.run_once(), 1)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(dispatcher.run_once(), 0)
+
+    def test_unsigned_deliveries_are_not_sent(self):
+        self.outbox.add("d1", {"url": "http://example.com/hook", "payload": {"event": "task.failed"}})
+        dispatcher = webhooks.Dispatcher(self.outbox, secret="", post=self.post)
+        self.addCleanup(dispatcher.shutdown)
+        dispatcher.run_once()
+        self.assertEqual(self.sent, [])
+
+    def test_backoff_doubles_up_to_the_maximum(self):
+        with mock.patch.object(webhooks.random, "uniform", return_value=1):
+            self.assertEqual(webhooks.backoff(1, 5, 3600), 5)
+            self.assertEqual(webhooks.backoff(4, 5, 3600), 40)
+            self.assertEqual(webhooks.backoff(20, 5, 3600), 3600)
+
+
+class TestNotify(unittest.TestCase):
+    def setUp(self):
+        self.state = sm.MemoryState()
+        patcher = mock.patch.object(sm, "state", self.state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.outbox = mock.Mock()
+        patcher = mock.patch.object(webhooks, "dispatcher", return_value=mock.Mock(outbox=self.outbox))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_finished_tasks_are_queued_once_per_outcome(self):
+        self.state.update_task("t1", const.TASK_STATE_PROCESSING, 50)
+        webhooks.notify("t1", "http://example.com/hook")
+        self.outbox.add.assert_not_called()
+
+        self.state.update_task("t1", const.TASK_STATE_COMPLETE, 100, videos=["final-1.mp4"])
+        webhooks.notify("t1", "http://example.com/hook")
+        webhooks.notify("t1", "http://example.com/hook")
+        (first_id, delivery), _ = self.outbox.add.call_args_list[0]
+        (second_id, _), _ = self.outbox.add.call_args_list[1]
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(delivery["url"], "http://example.com/hook")
+        self.assertEqual(delivery["payload"]["event"], "task.completed")
+        self.assertEqual(delivery["payload"]["task"]["videos"], ["final-1.mp4"])
+        json.dumps(delivery)
+
+
+
+class TestValidateUrl(unittest.TestCase):
+    def setUp(self):
+        self.config = {"webhook_secret": "s3cret"}
+        patcher = mock.patch.object(webhooks.config, "app", self.config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_invalid_callback_urls_are_rejected(self):
+        with mock.patch.object(webhooks.socket, "getaddrinfo", return_value=_public):
+            webhooks.validate_url("https://example.com/hook")
+            for url in ("ftp://example.com/hook", "example.com/hook", "http://", "http://example.com:x/"):
+                with self.assertRaises(ValueError):
+                    webhooks.validate_url(url)
+
+    def test_internal_addresses_are_rejected(self):
+        for address in ("127.0.0.1", "10.0.0.5", "192.168.1.1", "169.254.169.254", "::1", "::ffff:127.0.0.1", "fd00::1"):
+            with mock.patch.object(webhooks.socket, "getaddrinfo", resolve(["93.184.216.34", address])):
+                with self.assertRaises(ValueError, msg=address):
+                    webhooks.validate_url("http://hooks.example.com/hook")
+
+    def test_allowed_hosts_may_be_internal(self):
+        self.config["webhook_allowed_hosts"] = ["hooks.internal"]
+        with mock.patch.object(webhooks.socket, "getaddrinfo", resolve(["10.0.0.5"])) as getaddrinfo:
+            webhooks.validate_url("http://HOOKS.internal:8080/hook")
+        getaddrinfo.assert_not_called()
+
+    def test_unresolvable_hosts_are_rejected(self):
+        with mock.patch.object(webhooks.socket, "getaddrinfo", side_effect=OSError("not known")):
+            with self.assertRaises(ValueError):
+                webhooks.validate_url("http://nowhere.example/hook")
+
+    def test_callback_url_needs_a_secret(self):
+        self.config["webhook_secret"] = ""
+        with mock.patch.object(webhooks.socket, "getaddrinfo", return_value=_public):
+            with self.assertRaises(ValueError):
+                webhooks.validate_url("https://example.com/hook")
+
+
+if __name__ == "__main__":
+    unittest.main()
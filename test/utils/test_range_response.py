@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+import sys
+from email.utils import formatdate
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils import range_response
+from app.utils.range_response import RangeFileResponse, parse_ranges
+
+
+class TestParseRanges(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_ranges("bytes=0-9", 100), [(0, 10)])
+        self.assertEqual(parse_ranges("bytes=90-", 100), [(90, 100)])
+        self.assertEqual(parse_ranges("bytes=-10", 100), [(90, 100)])
+        self.assertEqual(parse_ranges("bytes=-500", 100), [(0, 100)])
+        self.assertEqual(parse_ranges("bytes=50-500", 100), [(50, 100)])
+        # sorted, overlapping and adjacent ranges merged
+        self.assertEqual(parse_ranges("bytes=50-59, 0-9,5-19,60-69", 100), [(0, 20), (50, 70)])
+
+    def test_unsatisfiable_and_invalid_ranges(self):
+        self.assertEqual(parse_ranges("bytes=100-", 100), [])
+        self.assertEqual(parse_ranges("bytes=-0", 100), [])
+        self.assertEqual(parse_ranges("bytes=200-300, 100-", 100), [])
+        for header in ("bytes=9-0", "bytes=a-b", "bytes=-", "items=0-9", "bytes=", "bytes=0-9,x"):
+            self.assertIsNone(parse_ranges(header, 100), header)
+        self.assertIsNone(parse_ranges(",".join(["bytes=0-0"] * 17), 100))
+
+
+class TestRangeFileResponse(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "final-1.mp4")
+        self.data = bytes(range(256)) * 64
+        with open(self.path, "wb") as f:
+            f.write(self.data)
+
+        def endpoint(request):
+            return RangeFileResponse(
+                self.path, range_response.stat_file(self.path), media_type="video/mp4"
+            )
+
+        app = Starlette(routes=[Route("/video", endpoint, methods=["GET", "HEAD"])])
+        self.client = TestClient(app)
+
+    def test_whole_file(self):
+        response = self.client.get("/video")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.data)
+        self.assertEqual(response.headers["accept-ranges"], "bytes")
+        self.assertIn("etag", response.headers)
+        self.assertIn("last-modified", response.headers)
+
+        response = self.client.head("/video")
+        self.assertEqual(response.headers["content-length"], str(len(self.data)))
+        self.assertEqual(response.content, b"")
+
+    def test_single_range_in_aligned_chunks(self):
+        sent = []
+        send_range = RangeFileResponse._send_range
+
+        async def recording(response, send, file, start, stop):
+            async def record(message):
+                sent.append(len(message["body"]))
+                await send(message)
+
+            await send_range(response, record, file, start, stop)
+
+        RangeFileResponse.chunk_size = 4096
+        RangeFileResponse._send_range = recording
+        try:
+            response = self.client.get("/video", headers={"Range": "bytes=1000-9999"})
+        finally:
+            RangeFileResponse.chunk_size = 1024 * 1024
+            RangeFileResponse._send_range = send_range
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.data[1000:10000])
+        self.assertEqual(response.headers["content-range"], f"bytes 1000-9999/{len(self.data)}")
+        self.assertEqual(sent, [4096 - 1000, 4096, 10000 - 8192])
+
+    def test_multiple_ranges(self):
+        response = self.client.get("/video", headers={"Range": "bytes=0-9,100-109"})
+        self.assertEqual(response.status_code, 206)
+        content_type = response.headers["content-type"]
+        self.assertTrue(content_type.startswith("multipart/byteranges; boundary="))
+        boundary = content_type.split("boundary=")[1]
+        self.assertEqual(int(response.headers["content-length"]), len(response.content))
+        expected = (
+            f"--{boundary}\r\nContent-Type: video/mp4\r\nContent-Range: bytes 0-9/{len(self.data)}\r\n\r\n"
+        ).encode() + self.data[0:10] + (
+            f"\r\n--{boundary}\r\nContent-Type: video/mp4\r\nContent-Range: bytes 100-109/{len(self.data)}\r\n\r\n"
+        ).encode() + self.data[100:110] + f"\r\n--{boundary}--\r\n".encode()
+        self.assertEqual(response.content, expected)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get("/video", headers={"Range": f"bytes={len(self.data)}-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["content-range"], f"bytes */{len(self.data)}")
+        self.assertEqual(response.content, b"")
+
+    def test_conditional_requests(self):
+        etag = self.client.get("/video").headers["etag"]
+        mtime = os.stat(self.path).st_mtime
+
+        response = self.client.get("/video", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], etag)
+        self.assertEqual(response.content, b"")
+        response = self.client.get("/video", headers={"If-Modified-Since": formatdate(mtime + 60, usegmt=True)})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get("/video", headers={"If-Modified-Since": formatdate(mtime - 60, usegmt=True)})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get("/video", headers={"If-Match": '"other"'}).status_code, 412)
+        self.assertEqual(self.client.get("/video", headers={"If-Match": etag}).status_code, 200)
+
+    def test_if_range(self):
+        etag = self.client.get("/video").headers["etag"]
+        response = self.client.get("/video", headers={"Range": "bytes=0-9", "If-Range": etag})
+        self.assertEqual(response.status_code, 206)
+        # the file changed: the whole new file
+        response = self.client.get("/video", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.content), len(self.data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,7 +24,8 @@ from app.models.schema import (
     VideoTransitionMode,
     PodcastScript,
 )
-from app.services import llm, voice
+from app.models.exception import UnsupportedMediaError, UploadTooLargeError
+from app.services import llm, uploads, voice
 from app.services import task as tm
 from app.services.podcast_audio import podcast_audio_generator
 from app.utils import utils
@@ -1043,15 +1044,25 @@ if start_button:
     if uploaded_files:
         local_videos_dir = utils.storage_dir("local_videos", create=True)
         for file in uploaded_files:
-            file_path = os.path.join(local_videos_dir, f"{file.file_id}_{file.name}")
-            with open(file_path, "wb") as f:
-                f.write(file.getbuffer())
-                m = MaterialInfo()
-                m.provider = "local"
-                m.url = file_path
-                if not params.video_materials:
-                    params.video_materials = []
-                params.video_materials.append(m)
+            # written in chunks, sniffed and probed like the uploads of the api
+            try:
+                file_path, _ = uploads.save_upload(
+                    file,
+                    local_videos_dir,
+                    f"{file.file_id}_{file.name}",
+                    uploads.VIDEO_FORMATS + uploads.IMAGE_FORMATS,
+                    config.app.get("max_material_upload_mb", 500) * 1024 * 1024,
+                    "material",
+                )
+            except (UploadTooLargeError, UnsupportedMediaError) as e:
+                st.error(f"{file.name}: {str(e)}")
+                continue
+            m = MaterialInfo()
+            m.provider = "local"
+            m.url = file_path
+            if not params.video_materials:
+                params.video_materials = []
+            params.video_materials.append(m)
 
     log_container = st.empty()
     log_records = []
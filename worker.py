@@ -0,0 +1,69 @@
+"""
+Standalone task worker for the Redis queue.
+
+Runs tasks queued by the api node (enable_redis = true), so rendering can be
+scaled out over several machines:
+
+    python worker.py --concurrency 2
+
+Set max_concurrent_tasks = 0 on the api node to leave all tasks to the workers.
+"""
+
+import argparse
+import signal
+import threading
+
+from loguru import logger
+
+from app.config import config
+from app.controllers.manager.redis_manager import RedisTaskManager, redis_url_from_config
+from app.services import bgm, events, llm_client, pipeline, webhooks
+from app.services import state as sm
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MoneyPrinterTurbo task worker")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.app.get("max_concurrent_tasks", 5),
+        help="number of tasks run at the same time",
+    )
+    args = parser.parse_args()
+
+    if not config.app.get("enable_redis", False):
+        raise SystemExit("worker mode needs the redis task queue, set enable_redis = true in config.toml")
+
+    task_manager = RedisTaskManager(
+        max_concurrent_tasks=args.concurrency,
+        redis_url=redis_url_from_config(),
+        visibility_timeout=config.app.get("task_visibility_timeout", 60),
+        max_attempts=config.app.get("task_max_attempts", 3),
+    )
+    # the tasks stored by older versions
+    sm.state.migrate()
+    # the lines logged by the tasks run here, for the clients following them on the api nodes
+    events.start()
+    # the callbacks of the tasks finished here, and any due in the shared outbox
+    webhooks.dispatcher()
+    # decode the songs for the renders ahead of them
+    bgm.library().watch()
+    logger.info(f"worker started, concurrency: {args.concurrency}")
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    stop_event.wait()
+
+    # running tasks are finished (and acked), the waiting ones stay in redis for the other workers
+    joined = task_manager.shutdown(timeout=config.app.get("shutdown_timeout", 60))
+    webhooks.shutdown(timeout=5)
+    events.stop()
+    bgm.library().stop()
+    if joined:
+        pipeline.shutdown(block=False)
+        # the pooled llm clients, async ones closed on their loop
+        llm_client.registry.clear()
+    else:
+        # the tasks still running use the stage pools and llm clients
+        logger.warning("tasks still running, leaving their pools and clients open")
+    logger.info("worker stopped")